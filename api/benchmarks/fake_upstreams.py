@@ -0,0 +1,308 @@
+"""基准测试用的本地上游替身：SerpAPI、Gemini、Supabase（PostgREST/Storage）
+
+各替身是独立的Starlette应用，在后台线程中以uvicorn运行，响应延迟按配置的分布采样，
+返回内容可替换为指定的JSON文件。仅用于离线基准，不追求完整的协议兼容。
+"""
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import socket
+import hashlib
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Callable
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+
+class LatencyDistribution:
+    """响应延迟分布
+
+    规格字符串：
+      fixed:50              固定50ms
+      uniform:20:120        20-120ms均匀分布
+      lognormal:300:0.5     中位数300ms、sigma=0.5的对数正态分布（长尾）
+      0 / none              无额外延迟
+    """
+
+    def __init__(self, spec: str = "0", seed: Optional[int] = None):
+        self.spec = spec
+        self._random = random.Random(seed)
+        if spec in ("", "none"):
+            spec = "0"
+        if ":" in spec:
+            self.kind, *params = spec.split(":")
+        else:
+            self.kind, params = "fixed", [spec]
+        self.params = [float(p) for p in params]
+
+    def sample(self) -> float:
+        """采样一次延迟（秒）"""
+        if self.kind == "fixed":
+            ms = self.params[0]
+        elif self.kind == "uniform":
+            ms = self._random.uniform(self.params[0], self.params[1])
+        elif self.kind == "lognormal":
+            ms = self.params[0] * math.exp(self._random.gauss(0.0, self.params[1]))
+        else:
+            raise ValueError(f"未知的延迟分布: {self.spec}")
+        return max(ms, 0.0) / 1000.0
+
+    async def wait(self):
+        delay = self.sample()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+def _load_payload(path: Optional[str]) -> Optional[Any]:
+    if not path:
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+_LINKS = [
+    "https://patents.google.com/patent/CN11{i:07d}A/zh",
+    "https://scholar.google.com/citations?user={i}",
+    "https://arxiv.org/abs/2301.{i:05d}",
+    "https://www.example.com/news/{i}.html",
+]
+
+
+def serp_app(latency: LatencyDistribution, payload_path: Optional[str] = None) -> Starlette:
+    """SerpAPI替身：GET /search 返回organic_results"""
+    payload = _load_payload(payload_path)
+    calls = {"count": 0}
+
+    async def search(request: Request):
+        calls["count"] += 1
+        await latency.wait()
+        if payload is not None:
+            return JSONResponse(payload)
+        query = request.query_params.get("q", "")
+        num = int(request.query_params.get("num", "10"))
+        base = int(hashlib.md5(query.encode()).hexdigest()[:6], 16)
+        patent_only = "site:patents.google.com" in query
+        return JSONResponse({"organic_results": [{
+            "title": f"{query[:40]} 相关技术 {i}",
+            "link": _LINKS[0 if patent_only else i % len(_LINKS)].format(i=base + i),
+            "snippet": "本发明公开了一种电池热管理系统，包括冷却回路、加热模块与控制单元……",
+            "position": i + 1,
+            "date": "2023-05-01",
+            "publication_info": {"summary": f"张三, 李四 - 电池学报, {2000 + i % 24} - example.com"},
+        } for i in range(num)]})
+
+    app = Starlette(routes=[Route("/search", search)])
+    app.state.calls = calls
+    return app
+
+
+DEFAULT_ANALYSIS = {
+    "技术特征对比": "发明与现有技术在控制策略上存在差异",
+    "区别技术特征": ["分区温控", "自适应功率分配"],
+    "评估": "中",
+    "建议": "补充实验数据",
+}
+
+
+def _embedding(text: str, dims: int = 768) -> List[float]:
+    """按文本哈希生成确定性的单位向量"""
+    rng = random.Random(hashlib.md5(text.encode("utf-8")).hexdigest())
+    values = [rng.gauss(0.0, 1.0) for _ in range(dims)]
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+
+def gemini_app(latency: LatencyDistribution, payload_path: Optional[str] = None,
+               embed_latency: Optional[LatencyDistribution] = None) -> Starlette:
+    """Gemini替身：generateContent / embedContent / batchEmbedContents"""
+    payload = _load_payload(payload_path)
+    embed_latency = embed_latency or LatencyDistribution("fixed:20")
+    calls = {"generate": 0, "embed": 0}
+
+    async def model_method(request: Request):
+        method = request.path_params["method"]
+        body = await request.json()
+        if method == "generateContent":
+            calls["generate"] += 1
+            await latency.wait()
+            text = payload if isinstance(payload, str) else json.dumps(payload or DEFAULT_ANALYSIS, ensure_ascii=False)
+            prompt = body["contents"][0]["parts"][0]["text"]
+            return JSONResponse({
+                "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}],
+                # 粗略按4字符/token估算
+                "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4},
+            })
+        calls["embed"] += 1
+        await embed_latency.wait()
+        if method == "embedContent":
+            return JSONResponse({"embedding": {"values": _embedding(body["content"]["parts"][0]["text"])}})
+        if method == "batchEmbedContents":
+            return JSONResponse({"embeddings": [
+                {"values": _embedding(item["content"]["parts"][0]["text"])} for item in body["requests"]
+            ]})
+        return JSONResponse({"error": {"message": f"unknown method {method}"}}, status_code=404)
+
+    app = Starlette(routes=[Route("/v1beta/models/{model}:{method}", model_method, methods=["POST"])])
+    app.state.calls = calls
+    return app
+
+
+class _Table:
+    """内存表，支持PostgREST常用的过滤、排序与分页参数"""
+
+    _OPERATORS: Dict[str, Callable[[Any, str], bool]] = {
+        "eq": lambda v, arg: str(v) == arg,
+        "neq": lambda v, arg: str(v) != arg,
+        "gt": lambda v, arg: v is not None and str(v) > arg,
+        "gte": lambda v, arg: v is not None and str(v) >= arg,
+        "lt": lambda v, arg: v is not None and str(v) < arg,
+        "lte": lambda v, arg: v is not None and str(v) <= arg,
+        "in": lambda v, arg: str(v) in [x.strip('"') for x in arg.strip("()").split(",")],
+    }
+
+    def __init__(self):
+        self.rows: List[Dict[str, Any]] = []
+
+    def match(self, params) -> List[Dict[str, Any]]:
+        rows = self.rows
+        for key, value in params.multi_items():
+            if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            operator, _, arg = value.partition(".")
+            check = self._OPERATORS.get(operator)
+            if check:
+                rows = [row for row in rows if check(row.get(key), arg)]
+        return rows
+
+    def query(self, params) -> List[Dict[str, Any]]:
+        rows = list(self.match(params))
+        order = params.get("order")
+        if order:
+            for clause in reversed(order.split(",")):
+                column, _, direction = clause.partition(".")
+                rows.sort(key=lambda row: (row.get(column) is None, str(row.get(column))),
+                          reverse=direction.startswith("desc"))
+        offset = int(params.get("offset", "0"))
+        limit = params.get("limit")
+        return rows[offset:offset + int(limit)] if limit else rows[offset:]
+
+    def insert(self, records: List[Dict[str, Any]], conflict: Optional[List[str]]) -> List[Dict[str, Any]]:
+        """插入记录；与已有行的冲突列（默认id）相同时更新该行（upsert）"""
+        keys = conflict or ["id"]
+        written = []
+        for record in records:
+            existing = None
+            if all(k in record for k in keys):
+                existing = next((row for row in self.rows
+                                 if all(row.get(k) == record.get(k) for k in keys)), None)
+            if existing is not None:
+                existing.update(record)
+                written.append(existing)
+                continue
+            row = {"id": str(uuid.uuid4()), "created_at": datetime.utcnow().isoformat(), **record}
+            self.rows.append(row)
+            written.append(row)
+        return written
+
+
+def supabase_app(latency: LatencyDistribution) -> Starlette:
+    """Supabase替身：/rest/v1（PostgREST）与/storage/v1"""
+    tables: Dict[str, _Table] = {}
+    objects: Dict[str, bytes] = {}
+    calls = {"rest": 0, "rpc": 0, "storage": 0}
+
+    async def rest(request: Request):
+        calls["rest"] += 1
+        await latency.wait()
+        table = tables.setdefault(request.path_params["table"], _Table())
+        if request.method == "GET":
+            return JSONResponse(table.query(request.query_params))
+        if request.method == "POST":
+            body = await request.json()
+            records = body if isinstance(body, list) else [body]
+            conflict = request.query_params.get("on_conflict")
+            rows = table.insert(records, conflict.split(",") if conflict else None)
+            return JSONResponse(rows, status_code=201)
+        if request.method == "PATCH":
+            body = await request.json()
+            rows = table.match(request.query_params)
+            for row in rows:
+                row.update(body)
+            return JSONResponse(rows)
+        if request.method == "DELETE":
+            rows = table.match(request.query_params)
+            ids = {id(row) for row in rows}
+            table.rows = [row for row in table.rows if id(row) not in ids]
+            return JSONResponse(rows)
+        return Response(status_code=405)
+
+    async def rpc(request: Request):
+        calls["rpc"] += 1
+        await latency.wait()
+        return JSONResponse([])
+
+    async def storage(request: Request):
+        calls["storage"] += 1
+        await latency.wait()
+        key = request.path_params["path"]
+        if request.method in ("POST", "PUT"):
+            objects[key] = await request.body()
+            return JSONResponse({"Key": key})
+        if request.method == "DELETE":
+            body = await request.json() if await request.body() else {}
+            for prefix in body.get("prefixes", []):
+                objects.pop(f"{key}/{prefix}", None)
+            return JSONResponse([])
+        if key in objects:
+            return Response(objects[key])
+        return JSONResponse({"error": "not_found"}, status_code=404)
+
+    app = Starlette(routes=[
+        Route("/rest/v1/rpc/{name}", rpc, methods=["POST"]),
+        Route("/rest/v1/{table}", rest, methods=["GET", "POST", "PATCH", "DELETE"]),
+        Route("/storage/v1/object/{path:path}", storage, methods=["GET", "POST", "PUT", "DELETE"]),
+    ])
+    app.state.calls = calls
+    app.state.tables = tables
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class BackgroundServer:
+    """在后台线程中运行ASGI应用（独立事件循环）"""
+
+    def __init__(self, app, port: Optional[int] = None):
+        self.app = app
+        self.port = port or free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port,
+                                                   log_level="warning", lifespan="on"))
+        self._thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout: float = 10.0) -> "BackgroundServer":
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError(f"服务启动失败: {self.url}")
+            time.sleep(0.02)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self._thread.join(timeout=10)
@@ -0,0 +1,78 @@
+"""导入耗时预算检查
+
+在干净的子进程中用 `python -X importtime` 导入应用入口，统计总导入耗时与最慢的模块，
+超过预算或导入了应延迟加载的重量级库时返回非零退出码（可用于CI，防止冷启动变慢）。
+子进程不带任何服务密钥：服务单例延迟构造，缺少配置时导入也必须成功。
+
+用法（在api目录下）：
+  python -m benchmarks.import_budget
+  python -m benchmarks.import_budget --budget-ms 900 --repeat 5 --top 15
+"""
+import os
+import sys
+import argparse
+import subprocess
+from typing import Dict, Any, List, Optional, Tuple
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 只应在首次使用时导入的模块
+LAZY_MODULES = ("supabase", "google.generativeai", "langgraph", "langchain_google_genai")
+
+# 不传给子进程的配置，确保导入不依赖服务密钥
+_SECRET_ENV = ("NEXT_PUBLIC_SUPABASE_URL", "SUPABASE_SERVICE_ROLE_KEY", "SERPAPI_KEY", "GEMINI_API_KEY")
+
+
+def measure(module: str) -> Tuple[float, List[Dict[str, Any]]]:
+    """导入一次，返回 (总耗时ms, 各模块 [{module, self_ms, cumulative_ms}])"""
+    env = {k: v for k, v in os.environ.items() if k not in _SECRET_ENV}
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=API_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({
+            "module": name.strip(),
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    # 子进程中其余模块都在入口模块之内导入，入口的累计耗时即总导入耗时
+    total = next((m["cumulative_ms"] for m in modules if m["module"] == module), 0.0)
+    return total, modules
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="导入耗时预算检查")
+    parser.add_argument("--module", default="main", help="应用入口模块")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET_MS", "1000")))
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数，取最小值以降低噪声")
+    parser.add_argument("--top", type=int, default=10, help="列出最慢的模块数")
+    args = parser.parse_args(argv)
+
+    runs = [measure(args.module) for _ in range(max(args.repeat, 1))]
+    total, modules = min(runs, key=lambda run: run[0])
+
+    print(f"导入 {args.module}: {total:.0f}ms（预算 {args.budget_ms:.0f}ms，{len(runs)}次取最小）")
+    print("自身耗时最多的模块：")
+    for m in sorted(modules, key=lambda m: m["self_ms"], reverse=True)[:args.top]:
+        print(f"  {m['module']:<48} self={m['self_ms']:>8.1f}ms  cumulative={m['cumulative_ms']:>8.1f}ms")
+
+    failed = False
+    eager = sorted({m["module"] for m in modules
+                    for lazy in LAZY_MODULES if m["module"] == lazy or m["module"].startswith(lazy + ".")})
+    if eager:
+        failed = True
+        print(f"应延迟导入的模块在启动时被导入: {', '.join(eager[:10])}")
+    if total > args.budget_ms:
+        failed = True
+        print(f"导入耗时超出预算 {total - args.budget_ms:.0f}ms")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
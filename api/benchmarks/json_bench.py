@@ -0,0 +1,122 @@
+"""JSON编码基准：标准库/jsonable_encoder 与 fast_json（orjson）对比
+
+载荷按真实大小构造：带4份报告（大JSONB content）的get_analysis响应、100条结果的搜索响应、
+检查点写入前的to_jsonable转换，以及嵌入提示词的分析结果。
+
+用法（在api目录下）：python -m benchmarks.json_bench [--scale 1] [--repeat 200]
+"""
+import json
+import time
+import random
+import argparse
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+import fast_json
+from fast_json import FastJSONResponse
+
+_SENTENCE = "本发明通过分区温控与自适应功率分配，在低温环境下将电池包温差控制在3℃以内，显著提升了快充效率与循环寿命。"
+
+
+def _prior_art(n: int, rng: random.Random) -> List[Dict[str, Any]]:
+    return [{
+        "title": f"一种电池热管理系统及其控制方法 {i}",
+        "link": f"https://patents.google.com/patent/CN11{i:07d}A/zh",
+        "snippet": _SENTENCE * 2,
+        "source": "google_patents",
+        "similarity": rng.random(),
+        "year": 2010 + i % 14,
+    } for i in range(n)]
+
+
+def _report(kind: str, scale: int, rng: random.Random) -> Dict[str, Any]:
+    return {
+        "id": f"report-{kind}",
+        "analysis_id": "0f8c2a8e-5d1b-4a5e-9a3f-2b7c6d9e1f00",
+        "report_type": kind,
+        "score": round(rng.random(), 3),
+        "summary": _SENTENCE * 3,
+        "created_at": datetime(2026, 10, 19, 8, 30).isoformat(),
+        "content": {
+            "analysis": {
+                "技术特征对比": _SENTENCE * 12 * scale,
+                "区别技术特征": [_SENTENCE for _ in range(8 * scale)],
+                "评估": "中",
+                "建议": [_SENTENCE for _ in range(5 * scale)],
+            },
+            "prior_art": _prior_art(15 * scale, rng),
+            "prescreen": {
+                "decision": "llm",
+                "max_similarity": 0.71,
+                "similarities": [round(rng.random(), 6) for _ in range(50 * scale)],
+            },
+            "model": "gemini-1.5-pro",
+            "timestamp": datetime(2026, 10, 19, 8, 30).isoformat(),
+        },
+    }
+
+
+def build_payloads(scale: int = 1, seed: int = 42) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    reports = [_report(kind, scale, rng) for kind in ("novelty", "inventiveness", "utility", "comprehensive")]
+    analysis = {
+        "id": "0f8c2a8e-5d1b-4a5e-9a3f-2b7c6d9e1f00",
+        "user_id": "user-1",
+        "title": "一种电池热管理系统",
+        "status": "completed",
+        "metadata": {"technical_field": "新能源汽车电池管理", "technical_content": _SENTENCE * 10},
+        "reports": reports,
+    }
+    search = {"results": {"query": "电池热管理", "source": "google_patent",
+                          "results": _prior_art(100 * scale, rng), "count": 100 * scale}, "cached": False}
+    return {"analysis": analysis, "search": search, "report_content": reports[0]["content"]}
+
+
+def _best(func: Callable[[], Any], repeat: int) -> float:
+    """重复执行取最快一轮（每轮10次）的单次耗时，单位毫秒"""
+    best = float("inf")
+    for _ in range(max(repeat // 10, 1)):
+        start = time.perf_counter()
+        for _ in range(10):
+            func()
+        best = min(best, (time.perf_counter() - start) / 10)
+    return best * 1000
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="JSON编码基准")
+    parser.add_argument("--scale", type=int, default=1, help="报告与结果列表的放大倍数")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    if not fast_json.ENABLED:
+        print("fast_json未启用（未设置FAST_JSON=true或未安装orjson），两列均为标准库")
+    payloads = build_payloads(args.scale)
+    analysis, search, content = payloads["analysis"], payloads["search"], payloads["report_content"]
+    plain = JSONResponse(None)
+    fast = FastJSONResponse(None)
+
+    cases = [
+        ("get_analysis响应", len(fast.render(analysis)),
+         lambda: plain.render(jsonable_encoder(analysis)), lambda: fast.render(analysis)),
+        ("search响应", len(fast.render(search)),
+         lambda: plain.render(jsonable_encoder(search)), lambda: fast.render(search)),
+        ("报告写库载荷", len(fast_json.dumps_bytes(content)),
+         lambda: json.dumps(content, ensure_ascii=False).encode("utf-8"), lambda: fast_json.dumps_bytes(content)),
+        ("检查点to_jsonable", len(fast_json.dumps_bytes(content)),
+         lambda: json.loads(json.dumps(content, ensure_ascii=False)), lambda: fast_json.to_jsonable(content)),
+        ("提示词嵌入(indent)", len(fast_json.dumps_bytes(content["analysis"], indent=True)),
+         lambda: json.dumps(content["analysis"], ensure_ascii=False, indent=2),
+         lambda: fast_json.dumps(content["analysis"], indent=True)),
+    ]
+
+    print(f"{'场景':<20}{'大小(KB)':>10}{'标准库(ms)':>14}{'fast_json(ms)':>16}{'加速':>8}")
+    for name, size, baseline, candidate in cases:
+        base_ms = _best(baseline, args.repeat)
+        fast_ms = _best(candidate, args.repeat)
+        print(f"{name:<20}{size / 1024:>10.1f}{base_ms:>14.3f}{fast_ms:>16.3f}{base_ms / fast_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""离线负载基准：FastAPI应用 + 本地上游替身 + 脚本化负载
+
+不需要任何真实密钥：SerpAPI、Gemini与Supabase（PostgREST/Storage）均由
+benchmarks.fake_upstreams在本地模拟，延迟分布与返回内容可配置。
+
+用法（在api目录下）：
+  python -m benchmarks.load_bench --profile search-heavy --users 20 --duration 20
+  python -m benchmarks.load_bench --profile analysis-heavy --gemini-latency lognormal:800:0.6
+  python -m benchmarks.load_bench --profile polling-heavy --save-baseline
+  python -m benchmarks.load_bench --profile search-heavy --compare --fail-on-regression
+  python -m benchmarks.load_bench --profile polling-heavy --db-backend sqlite
+
+每次运行的结果写入benchmarks/results/<profile>-<时间>.json；
+--save-baseline同时写入benchmarks/baselines/<profile>.json，--compare与该基线对比。
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from .fake_upstreams import (LatencyDistribution, BackgroundServer,
+                             serp_app, gemini_app, supabase_app)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+BASELINES_DIR = os.path.join(BENCH_DIR, "baselines")
+
+# 场景权重；seed为计时前预先完成的分析数（供轮询场景使用）
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "search-heavy": {"mix": {"search": 70, "similar": 20, "list": 10}, "seed": 0},
+    "analysis-heavy": {"mix": {"analyze": 80, "progress": 20}, "seed": 2},
+    "polling-heavy": {"mix": {"progress": 60, "get": 30, "analyze": 10}, "seed": 5},
+}
+
+_FIELDS = ["新能源汽车电池管理", "锂电池热管理", "储能变流器", "光伏逆变器", "充电桩功率分配",
+           "电机控制", "车载通信", "智能座舱", "激光雷达点云处理", "燃料电池系统"]
+_QUERIES = [f"{field} {topic}" for field in _FIELDS for topic in ("控制方法", "系统结构", "故障诊断", "优化算法", "安全保护")]
+
+
+class LoopLagProbe:
+    """在被测应用的事件循环中周期性休眠，记录实际唤醒的延迟"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(time.perf_counter() - started - self.interval, 0.0))
+
+    async def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def reset(self):
+        self.samples = []
+
+
+class LoadState:
+    """虚拟用户共享的状态（已创建的分析ID等）"""
+
+    def __init__(self, seed: int):
+        self.random = random.Random(seed)
+        self.analysis_ids: List[str] = []
+        self.counter = 0
+
+    def invention(self) -> Dict[str, str]:
+        self.counter += 1
+        field = self.random.choice(_FIELDS)
+        return {
+            "title": f"一种{field}方法及装置 #{self.counter}",
+            "description": f"本发明涉及{field}领域。" * 5,
+            "technical_field": field,
+            "technical_content": f"所述{field}系统包括采集模块、处理模块与执行模块，" * 20,
+            "user_id": "bench-user",
+        }
+
+
+async def _search(client, state: LoadState):
+    source = state.random.choice(["serp", "serp", "google_patent", "scholar"])
+    return "POST /api/search", await client.post("/api/search", json={
+        "query": state.random.choice(_QUERIES), "source": source, "user_id": "bench-user"})
+
+
+async def _similar(client, state: LoadState):
+    return "POST /api/similar-patents", await client.post("/api/similar-patents", json={
+        "query": state.random.choice(_QUERIES), "user_id": "bench-user", "top_k": 10})
+
+
+async def _list(client, state: LoadState):
+    return "GET /api/analyses", await client.get("/api/analyses", params={"user_id": "bench-user"})
+
+
+async def _analyze(client, state: LoadState):
+    response = await client.post("/api/analyze-patent", json=state.invention())
+    if response.status_code == 200:
+        state.analysis_ids.append(response.json()["analysis_id"])
+    return "POST /api/analyze-patent", response
+
+
+async def _progress(client, state: LoadState):
+    if not state.analysis_ids:
+        return await _analyze(client, state)
+    analysis_id = state.random.choice(state.analysis_ids)
+    return "GET /api/analysis/{id}/progress", await client.get(f"/api/analysis/{analysis_id}/progress")
+
+
+async def _get(client, state: LoadState):
+    if not state.analysis_ids:
+        return await _analyze(client, state)
+    analysis_id = state.random.choice(state.analysis_ids)
+    return "GET /api/analyses/{id}", await client.get(f"/api/analyses/{analysis_id}",
+                                                      params={"user_id": "bench-user"})
+
+
+SCENARIOS: Dict[str, Callable[[Any, LoadState], Awaitable[Any]]] = {
+    "search": _search,
+    "similar": _similar,
+    "list": _list,
+    "analyze": _analyze,
+    "progress": _progress,
+    "get": _get,
+}
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """最近秩百分位"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def _summary_ms(values: List[float]) -> Dict[str, Optional[float]]:
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+    return {
+        "p50": ms(percentile(values, 0.50)),
+        "p95": ms(percentile(values, 0.95)),
+        "p99": ms(percentile(values, 0.99)),
+        "max": ms(max(values) if values else None),
+    }
+
+
+async def run_load(base_url: str, profile: Dict[str, Any], users: int, duration: float,
+                   think_time: float, seed: int, probe: LoopLagProbe) -> Dict[str, Any]:
+    """预热后以固定数量的虚拟用户闭环施压duration秒"""
+    import httpx
+
+    state = LoadState(seed)
+    names = list(profile["mix"])
+    weights = [profile["mix"][name] for name in names]
+    samples: Dict[str, List[float]] = {}
+    statuses: Dict[str, Dict[str, int]] = {}
+
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+        for _ in range(profile["seed"]):
+            await _analyze(client, state)
+        probe.reset()
+
+        deadline = time.perf_counter() + duration
+
+        async def user():
+            while time.perf_counter() < deadline:
+                scenario = SCENARIOS[state.random.choices(names, weights)[0]]
+                started = time.perf_counter()
+                try:
+                    route, response = await scenario(client, state)
+                    status = str(response.status_code)
+                except Exception as e:
+                    route, status = "error", type(e).__name__
+                samples.setdefault(route, []).append(time.perf_counter() - started)
+                counts = statuses.setdefault(route, {})
+                counts[status] = counts.get(status, 0) + 1
+                if think_time:
+                    await asyncio.sleep(state.random.expovariate(1.0 / think_time))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(users)))
+        elapsed = time.perf_counter() - started
+
+    all_samples = [v for values in samples.values() for v in values]
+    errors = sum(n for counts in statuses.values() for status, n in counts.items() if not status.startswith("2"))
+    return {
+        "duration_s": round(elapsed, 2),
+        "requests": len(all_samples),
+        "errors": errors,
+        "throughput_rps": round(len(all_samples) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": _summary_ms(all_samples),
+        "routes": {
+            route: dict(_summary_ms(values), count=len(values), statuses=statuses.get(route, {}))
+            for route, values in sorted(samples.items())
+        },
+        "event_loop_lag_ms": _summary_ms(list(probe.samples)),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """打印与基线的差异，返回超过阈值的退化项"""
+    regressions = []
+    rows = [("throughput_rps", result["throughput_rps"], baseline["throughput_rps"], False)]
+    for key in ("p50", "p95", "p99"):
+        rows.append((f"latency {key}", result["latency_ms"][key], baseline["latency_ms"][key], True))
+    rows.append(("loop lag p99", result["event_loop_lag_ms"]["p99"], baseline["event_loop_lag_ms"]["p99"], True))
+    for route, stats in result["routes"].items():
+        base = baseline["routes"].get(route)
+        if base:
+            rows.append((f"{route} p95", stats["p95"], base["p95"], True))
+
+    print(f"\n与基线对比（{baseline.get('git_commit')} @ {baseline.get('started_at')}）：")
+    for name, current, previous, lower_is_better in rows:
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        worse = change > threshold if lower_is_better else change < -threshold
+        flag = "  <-- 退化" if worse else ""
+        print(f"  {name:<40} {previous:>10} -> {current:>10} ({change:+.1%}){flag}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="离线负载基准")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="search-heavy")
+    parser.add_argument("--users", type=int, default=10, help="并发虚拟用户数")
+    parser.add_argument("--duration", type=float, default=15.0, help="计时阶段秒数")
+    parser.add_argument("--think-time", type=float, default=0.0, help="每个用户两次请求间的平均间隔（秒）")
+    parser.add_argument("--serp-latency", default="lognormal:400:0.4")
+    parser.add_argument("--gemini-latency", default="lognormal:1500:0.5")
+    parser.add_argument("--embed-latency", default="fixed:30")
+    parser.add_argument("--db-latency", default="uniform:5:20")
+    parser.add_argument("--db-backend", choices=["supabase", "sqlite"], default="supabase",
+                        help="supabase经PostgREST替身；sqlite使用临时目录中的本地数据库")
+    parser.add_argument("--serp-payload", help="SerpAPI替身返回的JSON文件")
+    parser.add_argument("--gemini-payload", help="Gemini替身生成内容的JSON文件")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--compare", nargs="?", const="", default=None,
+                        help="与基线对比（默认benchmarks/baselines/<profile>.json）")
+    parser.add_argument("--threshold", type=float, default=0.10, help="判定退化的相对变化")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    fakes = {
+        "serpapi": BackgroundServer(serp_app(LatencyDistribution(args.serp_latency, args.seed),
+                                             args.serp_payload)).start(),
+        "gemini": BackgroundServer(gemini_app(LatencyDistribution(args.gemini_latency, args.seed),
+                                              args.gemini_payload,
+                                              LatencyDistribution(args.embed_latency, args.seed))).start(),
+        "supabase": BackgroundServer(supabase_app(LatencyDistribution(args.db_latency, args.seed))).start(),
+    }
+
+    # 应用在导入时读取配置，必须先设置环境变量；显式设置的变量优先
+    os.environ.update({
+        "NEXT_PUBLIC_SUPABASE_URL": fakes["supabase"].url,
+        "SUPABASE_SERVICE_ROLE_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.bench",
+        "SERPAPI_KEY": "bench",
+        "GEMINI_API_KEY": "bench",
+        "DB_BACKEND": args.db_backend,
+    })
+    if args.db_backend == "sqlite":
+        os.environ["SQLITE_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="load_bench_"), "bench.db")
+    for key, value in {
+        "RATE_LIMIT_ENABLED": "false",
+        "SERPAPI_RATE_PER_SEC": "10000", "SERPAPI_BURST": "10000",
+        "GEMINI_RATE_PER_SEC": "10000", "GEMINI_BURST": "10000",
+        "ANALYSIS_CHECKPOINT_BACKEND": "db",
+    }.items():
+        os.environ.setdefault(key, value)
+
+    import logging
+    logging.disable(logging.WARNING)
+    import main as app_module
+    from services import serp, gemini
+
+    serp.base_url = f"{fakes['serpapi'].url}/search"
+    gemini.generate_url = f"{fakes['gemini'].url}/v1beta/models/{{model}}:generateContent"
+    gemini.embedding_url = f"{fakes['gemini'].url}/v1beta/models/text-embedding-004:embedContent"
+
+    probe = LoopLagProbe()
+    app_module.app.router.on_startup.append(probe.start)
+    app_module.app.router.on_shutdown.append(probe.stop)
+    server = BackgroundServer(app_module.app).start()
+
+    profile = PROFILES[args.profile]
+    print(f"运行 {args.profile}: {args.users} 用户 × {args.duration}s，权重 {profile['mix']}")
+    try:
+        result = asyncio.run(run_load(server.url, profile, args.users, args.duration,
+                                      args.think_time, args.seed, probe))
+    finally:
+        server.stop()
+        for fake in fakes.values():
+            fake.stop()
+
+    result = {
+        "profile": args.profile,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "config": {
+            "users": args.users, "duration_s": args.duration, "think_time_s": args.think_time,
+            "serp_latency": args.serp_latency, "gemini_latency": args.gemini_latency,
+            "embed_latency": args.embed_latency, "db_latency": args.db_latency, "db_backend": args.db_backend,
+            "mix": profile["mix"], "seed": args.seed,
+        },
+        **result,
+        "upstream_calls": {name: dict(fake.app.state.calls) for name, fake in fakes.items()},
+    }
+
+    print(f"\n请求 {result['requests']}（错误 {result['errors']}），吞吐 {result['throughput_rps']} req/s")
+    print(f"延迟(ms) {result['latency_ms']}")
+    print(f"事件循环延迟(ms) {result['event_loop_lag_ms']}")
+    for route, stats in result["routes"].items():
+        print(f"  {route:<36} n={stats['count']:<6} p50={stats['p50']} p95={stats['p95']} "
+              f"p99={stats['p99']} {stats['statuses']}")
+    print(f"上游调用 {result['upstream_calls']}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{args.profile}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存: {path}")
+
+    baseline_path = os.path.join(BASELINES_DIR, f"{args.profile}.json")
+    regressions: List[str] = []
+    if args.compare is not None:
+        compare_path = args.compare or baseline_path
+        if os.path.exists(compare_path):
+            with open(compare_path, encoding="utf-8") as f:
+                regressions = compare(result, json.load(f), args.threshold)
+        else:
+            print(f"基线不存在: {compare_path}")
+    if args.save_baseline:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"基线已更新: {baseline_path}")
+
+    return 1 if (regressions and args.fail_on_regression) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""SERP结果解析基准：预编译规则与批量解析 vs 原实现
+
+用法（在api目录下）：python -m benchmarks.serp_parsing_bench [结果条数]
+"""
+import re
+import sys
+import time
+from services.serp_service import SerpService, identify_sources, extract_patent_ids, extract_year
+from services.serp_records import PatentRecord, PriorArtRecord
+
+_LINKS = [
+    "https://patents.google.com/patent/CN11{i:07d}A/zh",
+    "https://scholar.google.com/citations?user={i}",
+    "https://github.com/example/battery-{i}",
+    "https://arxiv.org/abs/2301.{i:05d}",
+    "https://www.mit.edu/research/{i}",
+    "https://baike.baidu.com/item/{i}",
+    "https://zh.wikipedia.org/wiki/{i}",
+    "https://www.example.com/news/{i}.html",
+]
+
+
+def _make_results(n: int):
+    return [{
+        "title": f"一种电池热管理系统及其控制方法 {i}",
+        "link": _LINKS[i % len(_LINKS)].format(i=i),
+        "snippet": "本发明公开了一种电池热管理系统，包括冷却回路、加热模块与控制单元……",
+        "position": i % 10 + 1,
+        "date": "2023-05-01",
+        "publication_info": {"summary": f"张三, 李四 - 电池学报, {2000 + i % 24} - example.com"},
+    } for i in range(n)]
+
+
+# ========== 原实现（对照组） ==========
+
+def _legacy_identify_source(url: str) -> str:
+    if "patents.google.com" in url:
+        return "google_patents"
+    elif "scholar.google.com" in url:
+        return "google_scholar"
+    elif "github.com" in url:
+        return "github"
+    elif "arxiv.org" in url:
+        return "arxiv"
+    elif any(domain in url for domain in [".edu", "university", "academic"]):
+        return "academic"
+    elif any(domain in url for domain in ["wikipedia", "baike.baidu"]):
+        return "encyclopedia"
+    else:
+        return "web"
+
+
+def _legacy_patent_id(link: str):
+    if "patents.google.com/patent/" in link:
+        return link.split("/patent/")[1].split("/")[0]
+    return None
+
+
+def _legacy_extract_year(publication_info):
+    summary = publication_info.get("summary", "")
+    import re
+    year_match = re.search(r"\b(19|20)\d{2}\b", summary)
+    if year_match:
+        return int(year_match.group())
+    return None
+
+
+def _legacy_parse_patents(results):
+    parsed_results = []
+    for result in results:
+        parsed = PatentRecord(result.get("title", ""), result.get("link", ""),
+                              result.get("snippet", ""), result.get("position", 0))
+        if "patents.google.com/patent/" in parsed.link:
+            parsed.patent_id = parsed.link.split("/patent/")[1].split("/")[0]
+        parsed_results.append(parsed)
+    return parsed_results
+
+
+def _legacy_parse_prior_art(results):
+    parsed_results = []
+    for result in results:
+        link = result.get("link", "")
+        parsed_results.append(PriorArtRecord(
+            result.get("title", ""), link, result.get("snippet", ""),
+            _legacy_identify_source(link), result.get("date", ""), result.get("position", 0)
+        ))
+    return parsed_results
+
+
+def _best_of(func, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(n: int = 50000):
+    results = _make_results(n)
+    links = [r["link"] for r in results]
+    infos = [r["publication_info"] for r in results]
+
+    # 先确认结果一致
+    assert identify_sources(links) == [_legacy_identify_source(link) for link in links]
+    assert extract_patent_ids(links) == [_legacy_patent_id(link) for link in links]
+    assert [extract_year(i["summary"]) for i in infos] == [_legacy_extract_year(i) for i in infos]
+
+    cases = [
+        ("来源识别", lambda: [_legacy_identify_source(link) for link in links],
+         lambda: identify_sources(links)),
+        ("专利号提取", lambda: [_legacy_patent_id(link) for link in links],
+         lambda: extract_patent_ids(links)),
+        ("年份提取", lambda: [_legacy_extract_year(i) for i in infos],
+         lambda: [extract_year(i["summary"]) for i in infos]),
+        ("专利结果解析", lambda: _legacy_parse_patents(results),
+         lambda: SerpService.parse_patent_results(results)),
+        ("现有技术解析", lambda: _legacy_parse_prior_art(results),
+         lambda: SerpService.parse_prior_art_results(results)),
+    ]
+
+    print(f"结果条数: {n}")
+    print(f"{'步骤':<14}{'原实现(ms)':>14}{'新实现(ms)':>14}{'加速比':>10}")
+    for name, legacy, current in cases:
+        new_time = _best_of(current)
+        old_time = _best_of(legacy)
+        print(f"{name:<14}{old_time * 1000:>14.2f}{new_time * 1000:>14.2f}{old_time / new_time:>9.2f}x")
+
+    # re模块的模式缓存会掩盖原实现的重复编译开销，逐次清空以模拟缓存被其它模式挤出的情况
+    re.purge()
+    cold = _best_of(lambda: [(_legacy_extract_year(i), re.purge()) for i in infos[:2000]], repeat=3)
+    warm = _best_of(lambda: [extract_year(i["summary"]) for i in infos[:2000]], repeat=3)
+    print(f"{'年份提取(冷缓存)':<14}{cold * 1000:>14.2f}{warm * 1000:>14.2f}{cold / warm:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
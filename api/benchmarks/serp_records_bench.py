@@ -0,0 +1,63 @@
+"""SERP结果记录内存与JSON编码基准
+
+用法（在api目录下）：python -m benchmarks.serp_records_bench [结果条数]
+"""
+import sys
+import json
+import time
+import tracemalloc
+from services.serp_records import PatentRecord, ResultBatch
+
+
+def _make_rows(n: int):
+    return [{
+        "title": f"一种电池热管理系统及其控制方法 {i}",
+        "link": f"https://patents.google.com/patent/CN11{i:07d}A/zh",
+        "snippet": "本发明公开了一种电池热管理系统，包括冷却回路、加热模块与控制单元……",
+        "position": i % 10 + 1,
+        "patent_id": f"CN11{i:07d}A",
+    } for i in range(n)]
+
+
+def _measure_memory(build):
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    obj = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(snapshot, "filename"))
+    return obj, size
+
+
+def _time_encode(payload, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        json.dumps(payload, ensure_ascii=False)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(n: int = 20000):
+    rows = _make_rows(n)
+    # 字符串取自同一来源，只比较容器开销
+    dicts, dict_bytes = _measure_memory(lambda: [dict(r) for r in rows])
+    records, record_bytes = _measure_memory(
+        lambda: [PatentRecord(r["title"], r["link"], r["snippet"], r["position"], r["patent_id"]) for r in rows]
+    )
+    batch, batch_bytes = _measure_memory(lambda: ResultBatch.from_records(records))
+
+    dict_time = _time_encode(dicts)
+    batch_time = _time_encode(batch.to_payload())
+    dict_json = len(json.dumps(dicts, ensure_ascii=False).encode("utf-8"))
+    batch_json = len(json.dumps(batch.to_payload(), ensure_ascii=False).encode("utf-8"))
+
+    print(f"结果条数: {n}")
+    print(f"{'表示':<16}{'内存(KB)':>12}{'JSON编码(ms)':>16}{'JSON大小(KB)':>16}")
+    print(f"{'dict行':<16}{dict_bytes / 1024:>12.1f}{dict_time * 1000:>16.2f}{dict_json / 1024:>16.1f}")
+    print(f"{'slots记录':<16}{record_bytes / 1024:>12.1f}{'-':>16}{'-':>16}")
+    print(f"{'列式批量':<16}{batch_bytes / 1024:>12.1f}{batch_time * 1000:>16.2f}{batch_json / 1024:>16.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -1,3 +1,5 @@
-from .supabase_client import db, SupabaseDB
+from .repository import AnalysisRepository
+from .supabase_client import supabase_db, SupabaseDB
+from .backend import db, create_repository
 
-__all__ = ['db', 'SupabaseDB']
\ No newline at end of file
+__all__ = ['db', 'AnalysisRepository', 'create_repository', 'supabase_db', 'SupabaseDB']
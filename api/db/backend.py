@@ -0,0 +1,26 @@
+"""数据库后端选择
+
+DB_BACKEND=supabase（默认）使用远程Supabase；DB_BACKEND=sqlite使用本地SQLite文件（SQLITE_DB_PATH），
+本地开发、基准测试与大批量任务不经过网络。认证始终使用Supabase（supabase_db）。
+"""
+import os
+from service_registry import registry
+from .repository import AnalysisRepository
+
+BACKENDS = ("supabase", "sqlite")
+
+
+def create_repository() -> AnalysisRepository:
+    """按DB_BACKEND构造数据访问实现"""
+    backend = os.getenv("DB_BACKEND", "supabase").lower()
+    if backend == "sqlite":
+        from .sqlite_backend import SQLiteDB
+        return SQLiteDB(os.getenv("SQLITE_DB_PATH", "patent_analysis.db"), os.getenv("SQLITE_STORAGE_DIR") or None)
+    if backend == "supabase":
+        # 与认证共用同一个Supabase客户端
+        return registry.get("supabase")
+    raise ValueError(f"未知的DB_BACKEND: {backend}（可选: {', '.join(BACKENDS)}）")
+
+
+# 创建全局实例（首次使用时构造）
+db = registry.register("db", create_repository)
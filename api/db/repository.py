@@ -0,0 +1,185 @@
+"""数据访问接口
+
+SupabaseDB（远程Supabase，经PostgREST）与SQLiteDB（本地SQLite，WAL模式）都实现该接口，
+业务代码只依赖这里列出的方法，由DB_BACKEND配置选择实现。
+"""
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, Any, List, Iterable, Tuple
+
+
+def summarize_usage(records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """按服务汇总使用量记录（service, tokens_used, cost）"""
+    summary = {
+        "total_cost": 0,
+        "total_tokens": 0,
+        "by_service": {}
+    }
+
+    for record in records:
+        service = record["service"]
+        if service not in summary["by_service"]:
+            summary["by_service"][service] = {"cost": 0, "tokens": 0, "calls": 0}
+
+        summary["by_service"][service]["calls"] += 1
+        if record["cost"]:
+            summary["total_cost"] += record["cost"]
+            summary["by_service"][service]["cost"] += record["cost"]
+        if record["tokens_used"]:
+            summary["total_tokens"] += record["tokens_used"]
+            summary["by_service"][service]["tokens"] += record["tokens_used"]
+
+    return summary
+
+
+class AnalysisRepository(ABC):
+    """专利分析数据访问接口"""
+
+    def warm_up(self):
+        """启动预热（预建连接等），默认无操作"""
+
+    # ========== 专利分析相关 ==========
+
+    @abstractmethod
+    async def create_analysis(self, user_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """创建新的专利分析"""
+
+    @abstractmethod
+    async def get_analysis(self, analysis_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """获取分析详情"""
+
+    @abstractmethod
+    async def get_analysis_versions(self, analysis_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """只读取分析与各报告的版本字段（不含报告内容），用于计算ETag"""
+
+    @abstractmethod
+    async def update_analysis_status(self, analysis_id: str, status: str, error_message: Optional[str] = None):
+        """更新分析状态"""
+
+    @abstractmethod
+    async def list_user_analyses(self, user_id: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """获取用户的分析列表"""
+
+    # ========== 搜索缓存相关 ==========
+
+    @abstractmethod
+    async def get_cached_search(self, query_hash: str) -> Optional[Dict[str, Any]]:
+        """获取缓存的搜索结果"""
+
+    @abstractmethod
+    async def cache_search_result(self, query_hash: str, query_text: str, results: Dict[str, Any],
+                                  source: str, cache_hours: int = 24):
+        """缓存搜索结果"""
+
+    @abstractmethod
+    async def record_search_cache_hits(self, hits: Dict[str, int], hit_at: Optional[str] = None) -> int:
+        """批量累加搜索缓存命中次数（query_hash -> 次数）并更新最近命中时间"""
+
+    @abstractmethod
+    async def delete_expired_search_cache(self, batch_size: int = 100) -> int:
+        """删除一批已过期的搜索缓存，返回删除行数"""
+
+    @abstractmethod
+    async def evict_search_cache(self, count: int) -> int:
+        """删除最久未命中的count行搜索缓存，返回删除行数"""
+
+    @abstractmethod
+    async def get_search_cache_stats(self) -> Dict[str, Any]:
+        """搜索缓存行数、已过期行数与占用空间（rows, expired, table_bytes, index_bytes）"""
+
+    # ========== 使用量记录相关 ==========
+
+    @abstractmethod
+    async def log_usage(self, user_id: str, analysis_id: Optional[str], service: str,
+                        tokens_used: Optional[int] = None, cost: Optional[float] = None):
+        """记录API使用量"""
+
+    @abstractmethod
+    async def get_user_usage_summary(self, user_id: str, days: int = 30) -> Dict[str, Any]:
+        """获取用户使用量汇总"""
+
+    # ========== 用户订阅相关 ==========
+
+    @abstractmethod
+    async def get_user_subscription(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """获取用户订阅信息"""
+
+    @abstractmethod
+    async def increment_subscription_usage(self, user_id: str, delta: int):
+        """累加用户本月已用分析次数"""
+
+    @abstractmethod
+    async def start_subscription_period(self, user_id: str, expected_end: str, period_start: str,
+                                        period_end: str) -> Optional[Dict[str, Any]]:
+        """当前周期仍以expected_end结束时清零已用次数并进入新周期，返回更新后的订阅；已被其他进程顺延时返回None"""
+
+    # ========== 专利向量相关 ==========
+
+    @abstractmethod
+    async def search_similar_patents(self, embedding: List[float], top_k: int = 10,
+                                     filters: Optional[Dict[str, Any]] = None,
+                                     min_similarity: float = 0.0) -> List[Dict[str, Any]]:
+        """按余弦相似度检索最相近的专利，filters按metadata字段精确匹配"""
+
+    @abstractmethod
+    async def get_existing_patent_ids(self, patent_ids: List[str]) -> set:
+        """返回已存在于patent_embeddings中的专利号"""
+
+    @abstractmethod
+    async def upsert_patent_embeddings(self, rows: List[Dict[str, Any]]) -> int:
+        """批量写入专利向量，按patent_id去重"""
+
+    @abstractmethod
+    async def list_patent_embeddings(self, after: Optional[Tuple[str, str]] = None,
+                                     limit: int = 1000) -> List[Dict[str, Any]]:
+        """按 (updated_at, patent_id) 顺序拉取after之后新增或更新的专利向量，用于本地索引增量同步"""
+
+    # ========== 分析检查点相关 ==========
+
+    @abstractmethod
+    async def get_analysis_checkpoint(self, scope: str, node: str,
+                                      input_fingerprint: str) -> Optional[Dict[str, Any]]:
+        """按阶段输入指纹获取检查点"""
+
+    @abstractmethod
+    async def get_latest_analysis_checkpoint(self, scope: str, node: str) -> Optional[Dict[str, Any]]:
+        """获取某阶段最近一次检查点的逐字段输入指纹"""
+
+    @abstractmethod
+    async def save_analysis_checkpoint(self, scope: str, node: str, input_fingerprint: str,
+                                       output: Dict[str, Any], analysis_id: Optional[str] = None,
+                                       input_fields: Optional[Dict[str, str]] = None):
+        """保存阶段检查点"""
+
+    @abstractmethod
+    async def list_analysis_checkpoints(self, analysis_id: str) -> List[Dict[str, Any]]:
+        """按完成顺序列出某次分析的检查点"""
+
+    @abstractmethod
+    async def delete_expired_analysis_checkpoints(self, before: str, batch_size: int = 100) -> int:
+        """删除一批created_at早于before的分析检查点，返回删除行数"""
+
+    # ========== 文件存储相关 ==========
+
+    @abstractmethod
+    async def upload_file(self, bucket: str, file_path: str, file_data: bytes,
+                          content_type: str = "application/octet-stream") -> str:
+        """上传文件，返回访问地址"""
+
+    @abstractmethod
+    async def download_file(self, bucket: str, file_path: str) -> bytes:
+        """下载文件"""
+
+    @abstractmethod
+    async def delete_file(self, bucket: str, file_path: str):
+        """删除文件"""
+
+    # ========== 分析报告相关 ==========
+
+    @abstractmethod
+    async def save_analysis_report(self, analysis_id: str, report_type: str,
+                                   content: Dict[str, Any], score: Optional[float] = None):
+        """保存分析报告"""
+
+    @abstractmethod
+    async def get_analysis_reports(self, analysis_id: str) -> List[Dict[str, Any]]:
+        """获取分析的所有报告"""
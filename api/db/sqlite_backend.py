@@ -0,0 +1,646 @@
+"""本地SQLite数据库模块
+
+与SupabaseDB相同的接口，直接读写本地SQLite文件（WAL模式，读写互不阻塞），不经过网络与PostgREST，
+用于本地开发、基准测试与大批量离线任务。表结构与database/schema.sql对应：
+JSONB列以JSON文本保存，UUID与时间戳以字符串保存（时间为UTC ISO格式，可直接按字符串比较）。
+文件存储写入本地目录。需要SQLite 3.35+（RETURNING）。
+"""
+import os
+import uuid
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Iterator, Sequence, Tuple
+import numpy as np
+import fast_json
+from .repository import AnalysisRepository, summarize_usage
+
+logger = logging.getLogger(__name__)
+
+# 以JSON文本保存的列
+JSON_COLUMNS = {"metadata", "results", "content", "input_fields", "output", "embedding"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patent_analyses (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    title TEXT NOT NULL,
+    description TEXT,
+    status TEXT DEFAULT 'pending',
+    input_file_url TEXT,
+    report_url TEXT,
+    metadata TEXT DEFAULT '{}',
+    error_message TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS search_cache (
+    id TEXT PRIMARY KEY,
+    query_hash TEXT UNIQUE NOT NULL,
+    query_text TEXT NOT NULL,
+    results TEXT NOT NULL,
+    source TEXT,
+    created_at TEXT,
+    expires_at TEXT NOT NULL,
+    hit_count INTEGER DEFAULT 0,
+    last_hit_at TEXT
+);
+CREATE TABLE IF NOT EXISTS usage_logs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    analysis_id TEXT,
+    service TEXT NOT NULL,
+    tokens_used INTEGER,
+    api_calls INTEGER DEFAULT 1,
+    cost REAL,
+    metadata TEXT DEFAULT '{}',
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS patent_embeddings (
+    id TEXT PRIMARY KEY,
+    patent_id TEXT UNIQUE NOT NULL,
+    title TEXT NOT NULL,
+    abstract TEXT,
+    embedding TEXT,
+    metadata TEXT DEFAULT '{}',
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS analysis_reports (
+    id TEXT PRIMARY KEY,
+    analysis_id TEXT,
+    report_type TEXT,
+    content TEXT NOT NULL,
+    summary TEXT,
+    score REAL,
+    created_at TEXT,
+    UNIQUE(analysis_id, report_type)
+);
+CREATE TABLE IF NOT EXISTS user_subscriptions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT UNIQUE,
+    plan_type TEXT DEFAULT 'starter',
+    status TEXT DEFAULT 'active',
+    current_period_start TEXT,
+    current_period_end TEXT,
+    monthly_analyses_limit INTEGER,
+    monthly_analyses_used INTEGER DEFAULT 0,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS analysis_checkpoints (
+    id TEXT PRIMARY KEY,
+    scope TEXT NOT NULL,
+    node TEXT NOT NULL,
+    input_fingerprint TEXT NOT NULL,
+    input_fields TEXT DEFAULT '{}',
+    output TEXT NOT NULL,
+    analysis_id TEXT,
+    created_at TEXT,
+    UNIQUE(scope, node, input_fingerprint)
+);
+CREATE INDEX IF NOT EXISTS idx_patent_analyses_user_id ON patent_analyses(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_patent_analyses_status ON patent_analyses(status);
+CREATE INDEX IF NOT EXISTS idx_search_cache_expires ON search_cache(expires_at);
+CREATE INDEX IF NOT EXISTS idx_search_cache_last_hit ON search_cache(last_hit_at);
+CREATE INDEX IF NOT EXISTS idx_analysis_checkpoints_analysis_id ON analysis_checkpoints(analysis_id);
+CREATE INDEX IF NOT EXISTS idx_analysis_checkpoints_latest ON analysis_checkpoints(scope, node, created_at);
+CREATE INDEX IF NOT EXISTS idx_analysis_checkpoints_created_at ON analysis_checkpoints(created_at);
+CREATE INDEX IF NOT EXISTS idx_usage_logs_user_id ON usage_logs(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_patent_embeddings_created_at ON patent_embeddings(created_at);
+CREATE INDEX IF NOT EXISTS idx_patent_embeddings_sync ON patent_embeddings(updated_at, patent_id);
+"""
+
+# 建表之后新增的列：已有的数据库文件在打开时补上
+ADDED_COLUMNS = [
+    ("search_cache", "hit_count", "INTEGER DEFAULT 0"),
+    ("search_cache", "last_hit_at", "TEXT"),
+    ("patent_embeddings", "updated_at", "TEXT"),
+]
+
+# 新增列补上后对已有行的回填
+BACKFILLS = {
+    ("patent_embeddings", "updated_at"): "UPDATE patent_embeddings SET updated_at = created_at",
+}
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def _encode(column: str, value: Any) -> Any:
+    if column in JSON_COLUMNS and value is not None:
+        return fast_json.dumps(value)
+    return value
+
+
+def _decode(row: sqlite3.Row) -> Dict[str, Any]:
+    record = dict(row)
+    for column in JSON_COLUMNS.intersection(record):
+        if record[column] is not None:
+            record[column] = fast_json.loads(record[column])
+    return record
+
+
+class SQLiteDB(AnalysisRepository):
+    """本地SQLite数据库操作封装类
+
+    单个连接由锁串行化；本地查询通常在亚毫秒级，直接在调用方线程执行。
+    """
+
+    def __init__(self, path: str = "patent_analysis.db", storage_dir: Optional[str] = None):
+        self.path = path
+        self.storage_dir = Path(storage_dir or f"{os.path.splitext(path)[0]}_storage")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL模式下NORMAL只在检查点时fsync，崩溃不会损坏数据库，最多丢失最近的事务
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._migrate()
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        logger.info(f"使用本地SQLite数据库: {path}")
+
+    def warm_up(self):
+        """启动预热：执行一个轻量查询"""
+        self._query("SELECT id FROM patent_analyses LIMIT 1")
+
+    def _migrate(self):
+        for table, column, declaration in ADDED_COLUMNS:
+            existing = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if existing and column not in existing:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+                if (table, column) in BACKFILLS:
+                    self._conn.execute(BACKFILLS[(table, column)])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ========== SQL辅助 ==========
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            try:
+                yield self._conn
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def _query(self, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [_decode(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def _write(self, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        with self._transaction() as conn:
+            return [_decode(row) for row in conn.execute(sql, params).fetchall()]
+
+    def _upsert(self, table: str, values: Dict[str, Any],
+                conflict: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
+        """插入一行；conflict给出唯一键时冲突则更新其余列（保留原id）。返回写入后的行"""
+        values = {"id": str(uuid.uuid4()), **values}
+        columns = list(values)
+        sql = (f"INSERT INTO {table} ({', '.join(columns)}) "
+               f"VALUES ({', '.join('?' for _ in columns)})")
+        if conflict:
+            updates = [c for c in columns if c != "id" and c not in conflict]
+            sql += (f" ON CONFLICT({', '.join(conflict)}) DO UPDATE SET "
+                    + ", ".join(f"{c} = excluded.{c}" for c in updates))
+        rows = self._write(sql + " RETURNING *", [_encode(c, values[c]) for c in columns])
+        return rows[0] if rows else None
+
+    # ========== 专利分析相关 ==========
+
+    async def create_analysis(self, user_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """创建新的专利分析"""
+        try:
+            now = _now()
+            return self._upsert("patent_analyses", {
+                "user_id": user_id,
+                "title": data.get("title"),
+                "description": data.get("description"),
+                "status": "pending",
+                "metadata": data.get("metadata", {}),
+                "created_at": now,
+                "updated_at": now
+            })
+        except Exception as e:
+            logger.error(f"创建分析失败: {e}")
+            raise
+
+    async def get_analysis(self, analysis_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """获取分析详情"""
+        try:
+            sql, params = "SELECT * FROM patent_analyses WHERE id = ?", [analysis_id]
+            if user_id:
+                sql, params = sql + " AND user_id = ?", params + [user_id]
+            rows = self._query(sql, params)
+            return rows[0] if rows else None
+        except Exception as e:
+            logger.error(f"获取分析失败: {e}")
+            raise
+
+    async def get_analysis_versions(self, analysis_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """只读取分析与各报告的版本字段（不含报告内容），用于计算ETag"""
+        try:
+            sql, params = "SELECT id, user_id, status, updated_at FROM patent_analyses WHERE id = ?", [analysis_id]
+            if user_id:
+                sql, params = sql + " AND user_id = ?", params + [user_id]
+            rows = self._query(sql, params)
+            if not rows:
+                return None
+            reports = self._query("SELECT id, report_type, created_at, score FROM analysis_reports "
+                                  "WHERE analysis_id = ?", [analysis_id])
+            return {"analysis": rows[0], "reports": reports}
+        except Exception as e:
+            logger.error(f"获取分析版本失败: {e}")
+            raise
+
+    async def update_analysis_status(self, analysis_id: str, status: str, error_message: Optional[str] = None):
+        """更新分析状态"""
+        try:
+            sql, params = "UPDATE patent_analyses SET status = ?, updated_at = ?", [status, _now()]
+            if error_message:
+                sql, params = sql + ", error_message = ?", params + [error_message]
+            rows = self._write(sql + " WHERE id = ? RETURNING *", params + [analysis_id])
+            return rows[0] if rows else None
+        except Exception as e:
+            logger.error(f"更新分析状态失败: {e}")
+            raise
+
+    async def list_user_analyses(self, user_id: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """获取用户的分析列表"""
+        try:
+            return self._query("SELECT * FROM patent_analyses WHERE user_id = ? "
+                               "ORDER BY created_at DESC LIMIT ? OFFSET ?", [user_id, limit, offset])
+        except Exception as e:
+            logger.error(f"获取分析列表失败: {e}")
+            raise
+
+    # ========== 搜索缓存相关 ==========
+
+    async def get_cached_search(self, query_hash: str) -> Optional[Dict[str, Any]]:
+        """获取缓存的搜索结果"""
+        try:
+            rows = self._query("SELECT * FROM search_cache WHERE query_hash = ? AND expires_at > ?",
+                               [query_hash, _now()])
+            return rows[0] if rows else None
+        except Exception as e:
+            logger.error(f"获取搜索缓存失败: {e}")
+            return None
+
+    async def cache_search_result(self, query_hash: str, query_text: str, results: Dict[str, Any],
+                                  source: str, cache_hours: int = 24):
+        """缓存搜索结果"""
+        try:
+            now = datetime.utcnow()
+            return self._upsert("search_cache", {
+                "query_hash": query_hash,
+                "query_text": query_text,
+                "results": results,
+                "source": source,
+                "created_at": now.isoformat(),
+                "expires_at": (now + timedelta(hours=cache_hours)).isoformat(),
+                "last_hit_at": now.isoformat()
+            }, conflict=["query_hash"])
+        except Exception as e:
+            logger.error(f"缓存搜索结果失败: {e}")
+            raise
+
+    async def record_search_cache_hits(self, hits: Dict[str, int], hit_at: Optional[str] = None) -> int:
+        """批量累加搜索缓存命中次数（query_hash -> 次数）并更新最近命中时间"""
+        if not hits:
+            return 0
+        try:
+            hit_at = hit_at or _now()
+            with self._transaction() as conn:
+                before = conn.total_changes
+                conn.executemany("UPDATE search_cache SET hit_count = COALESCE(hit_count, 0) + ?, "
+                                 "last_hit_at = MAX(COALESCE(last_hit_at, ''), ?) WHERE query_hash = ?",
+                                 [(count, hit_at, query_hash) for query_hash, count in hits.items()])
+                return conn.total_changes - before
+        except Exception as e:
+            logger.error(f"记录搜索缓存命中失败: {e}")
+            raise
+
+    async def delete_expired_search_cache(self, batch_size: int = 100) -> int:
+        """删除一批已过期的搜索缓存，返回删除行数"""
+        try:
+            with self._transaction() as conn:
+                return conn.execute("DELETE FROM search_cache WHERE id IN (SELECT id FROM search_cache "
+                                    "WHERE expires_at <= ? ORDER BY expires_at LIMIT ?)",
+                                    [_now(), batch_size]).rowcount
+        except Exception as e:
+            logger.error(f"清理过期搜索缓存失败: {e}")
+            raise
+
+    async def evict_search_cache(self, count: int) -> int:
+        """删除最久未命中的count行搜索缓存，返回删除行数"""
+        if count <= 0:
+            return 0
+        try:
+            with self._transaction() as conn:
+                return conn.execute("DELETE FROM search_cache WHERE id IN (SELECT id FROM search_cache "
+                                    "ORDER BY last_hit_at LIMIT ?)", [count]).rowcount
+        except Exception as e:
+            logger.error(f"淘汰搜索缓存失败: {e}")
+            raise
+
+    async def get_search_cache_stats(self) -> Dict[str, Any]:
+        """搜索缓存行数、已过期行数与占用空间（rows, expired, table_bytes, index_bytes）"""
+        try:
+            counts = self._query("SELECT COUNT(*) AS rows, COUNT(CASE WHEN expires_at <= ? THEN 1 END) AS expired "
+                                 "FROM search_cache", [_now()])[0]
+            try:
+                # dbstat虚拟表需要SQLITE_ENABLE_DBSTAT_VTAB编译选项，不可用时不报告占用空间
+                sizes = {row["name"]: row["bytes"] for row in self._query(
+                    "SELECT name, SUM(pgsize) AS bytes FROM dbstat WHERE name = 'search_cache' "
+                    "OR name IN (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'search_cache') "
+                    "GROUP BY name")}
+                table_bytes = sizes.pop("search_cache", 0)
+                index_bytes = sum(sizes.values())
+            except sqlite3.OperationalError:
+                table_bytes = index_bytes = None
+            return dict(counts, table_bytes=table_bytes, index_bytes=index_bytes)
+        except Exception as e:
+            logger.error(f"获取搜索缓存统计失败: {e}")
+            raise
+
+    # ========== 使用量记录相关 ==========
+
+    async def log_usage(self, user_id: str, analysis_id: Optional[str], service: str,
+                        tokens_used: Optional[int] = None, cost: Optional[float] = None):
+        """记录API使用量"""
+        try:
+            return self._upsert("usage_logs", {
+                "user_id": user_id,
+                "analysis_id": analysis_id,
+                "service": service,
+                "tokens_used": tokens_used or None,
+                "cost": cost or None,
+                "metadata": {},
+                "created_at": _now()
+            })
+        except Exception as e:
+            logger.error(f"记录使用量失败: {e}")
+            raise
+
+    async def get_user_usage_summary(self, user_id: str, days: int = 30) -> Dict[str, Any]:
+        """获取用户使用量汇总"""
+        try:
+            start_date = (datetime.utcnow() - timedelta(days=days)).isoformat()
+            records = self._query("SELECT service, tokens_used, cost FROM usage_logs "
+                                  "WHERE user_id = ? AND created_at >= ?", [user_id, start_date])
+            return summarize_usage(records)
+        except Exception as e:
+            logger.error(f"获取使用量汇总失败: {e}")
+            raise
+
+    # ========== 用户订阅相关 ==========
+
+    async def get_user_subscription(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """获取用户订阅信息"""
+        try:
+            rows = self._query("SELECT plan_type, status, monthly_analyses_limit, monthly_analyses_used, "
+                               "current_period_end FROM user_subscriptions WHERE user_id = ?", [user_id])
+            return rows[0] if rows else None
+        except Exception as e:
+            logger.error(f"获取用户订阅失败: {e}")
+            raise
+
+    async def increment_subscription_usage(self, user_id: str, delta: int):
+        """累加用户本月已用分析次数（单条UPDATE完成读改写）"""
+        try:
+            rows = self._write("UPDATE user_subscriptions "
+                               "SET monthly_analyses_used = MAX(COALESCE(monthly_analyses_used, 0) + ?, 0), "
+                               "updated_at = ? WHERE user_id = ? RETURNING *", [delta, _now(), user_id])
+            return rows[0] if rows else None
+        except Exception as e:
+            logger.error(f"更新订阅用量失败: {e}")
+            raise
+
+    async def start_subscription_period(self, user_id: str, expected_end: str, period_start: str,
+                                        period_end: str) -> Optional[Dict[str, Any]]:
+        """当前周期仍以expected_end结束时清零已用次数并进入新周期（条件更新，多个worker只顺延一次）"""
+        try:
+            rows = self._write("UPDATE user_subscriptions SET monthly_analyses_used = 0, current_period_start = ?, "
+                               "current_period_end = ?, updated_at = ? WHERE user_id = ? AND current_period_end = ? "
+                               "RETURNING *", [period_start, period_end, _now(), user_id, expected_end])
+            return rows[0] if rows else None
+        except Exception as e:
+            logger.error(f"顺延订阅周期失败: {e}")
+            raise
+
+    # ========== 专利向量相关 ==========
+
+    async def search_similar_patents(self, embedding: List[float], top_k: int = 10,
+                                     filters: Optional[Dict[str, Any]] = None,
+                                     min_similarity: float = 0.0) -> List[Dict[str, Any]]:
+        """按余弦相似度检索最相近的专利，filters按metadata字段精确匹配（与match_patent_embeddings一致）"""
+        try:
+            rows = self._query("SELECT patent_id, title, abstract, embedding, metadata FROM patent_embeddings "
+                               "WHERE embedding IS NOT NULL")
+            if filters:
+                rows = [row for row in rows
+                        if all((row["metadata"] or {}).get(k) == v for k, v in filters.items())]
+            rows = [row for row in rows if len(row["embedding"]) == len(embedding)]
+            if not rows:
+                return []
+
+            matrix = np.asarray([row.pop("embedding") for row in rows], dtype=np.float32)
+            query = np.asarray(embedding, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+            norms[norms == 0] = 1.0
+            similarities = matrix @ query / norms
+
+            results = []
+            for i in np.argsort(-similarities)[:top_k]:
+                if similarities[i] < min_similarity:
+                    break
+                results.append({**rows[i], "similarity": float(similarities[i])})
+            return results
+        except Exception as e:
+            logger.error(f"专利相似度检索失败: {e}")
+            raise
+
+    async def get_existing_patent_ids(self, patent_ids: List[str]) -> set:
+        """返回已存在于patent_embeddings中的专利号"""
+        if not patent_ids:
+            return set()
+        try:
+            placeholders = ", ".join("?" for _ in patent_ids)
+            rows = self._query(f"SELECT patent_id FROM patent_embeddings WHERE patent_id IN ({placeholders})",
+                               list(patent_ids))
+            return {row["patent_id"] for row in rows}
+        except Exception as e:
+            logger.error(f"查询已有专利向量失败: {e}")
+            raise
+
+    async def upsert_patent_embeddings(self, rows: List[Dict[str, Any]]) -> int:
+        """批量写入专利向量，按patent_id去重（单个事务）；已存在的行保留created_at，更新updated_at"""
+        if not rows:
+            return 0
+        try:
+            now = _now()
+            params = [(str(uuid.uuid4()), row["patent_id"], row.get("title"), row.get("abstract"),
+                       _encode("embedding", row.get("embedding")), _encode("metadata", row.get("metadata") or {}),
+                       row.get("created_at") or now, now) for row in rows]
+            with self._transaction() as conn:
+                conn.executemany(
+                    "INSERT INTO patent_embeddings (id, patent_id, title, abstract, embedding, metadata, created_at, "
+                    "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(patent_id) DO UPDATE SET "
+                    "title = excluded.title, abstract = excluded.abstract, embedding = excluded.embedding, "
+                    "metadata = excluded.metadata, updated_at = excluded.updated_at", params)
+            return len(rows)
+        except Exception as e:
+            logger.error(f"批量写入专利向量失败: {e}")
+            raise
+
+    async def list_patent_embeddings(self, after: Optional[Tuple[str, str]] = None,
+                                     limit: int = 1000) -> List[Dict[str, Any]]:
+        """按 (updated_at, patent_id) 顺序拉取after之后新增或更新的专利向量，用于本地索引增量同步"""
+        try:
+            sql, params = ("SELECT patent_id, title, abstract, embedding, metadata, created_at, updated_at "
+                           "FROM patent_embeddings"), []
+            if after:
+                sql, params = sql + " WHERE (updated_at, patent_id) > (?, ?)", list(after)
+            return self._query(sql + " ORDER BY updated_at, patent_id LIMIT ?", params + [limit])
+        except Exception as e:
+            logger.error(f"拉取专利向量失败: {e}")
+            raise
+
+    # ========== 分析检查点相关 ==========
+
+    async def get_analysis_checkpoint(self, scope: str, node: str,
+                                      input_fingerprint: str) -> Optional[Dict[str, Any]]:
+        """按阶段输入指纹获取检查点"""
+        try:
+            rows = self._query("SELECT output, analysis_id, created_at FROM analysis_checkpoints "
+                               "WHERE scope = ? AND node = ? AND input_fingerprint = ?",
+                               [scope, node, input_fingerprint])
+            return rows[0] if rows else None
+        except Exception as e:
+            logger.error(f"获取分析检查点失败: {e}")
+            raise
+
+    async def get_latest_analysis_checkpoint(self, scope: str, node: str) -> Optional[Dict[str, Any]]:
+        """获取某阶段最近一次检查点的逐字段输入指纹"""
+        try:
+            rows = self._query("SELECT input_fields, created_at FROM analysis_checkpoints "
+                               "WHERE scope = ? AND node = ? ORDER BY created_at DESC LIMIT 1", [scope, node])
+            return rows[0] if rows else None
+        except Exception as e:
+            logger.error(f"获取最近分析检查点失败: {e}")
+            raise
+
+    async def save_analysis_checkpoint(self, scope: str, node: str, input_fingerprint: str,
+                                       output: Dict[str, Any], analysis_id: Optional[str] = None,
+                                       input_fields: Optional[Dict[str, str]] = None):
+        """保存阶段检查点"""
+        try:
+            return self._upsert("analysis_checkpoints", {
+                "scope": scope,
+                "node": node,
+                "input_fingerprint": input_fingerprint,
+                "input_fields": input_fields or {},
+                "output": output,
+                "analysis_id": analysis_id,
+                "created_at": _now()
+            }, conflict=["scope", "node", "input_fingerprint"])
+        except Exception as e:
+            logger.error(f"保存分析检查点失败: {e}")
+            raise
+
+    async def list_analysis_checkpoints(self, analysis_id: str) -> List[Dict[str, Any]]:
+        """按完成顺序列出某次分析的检查点"""
+        try:
+            return self._query("SELECT node, input_fingerprint, created_at FROM analysis_checkpoints "
+                               "WHERE analysis_id = ? ORDER BY created_at", [analysis_id])
+        except Exception as e:
+            logger.error(f"获取分析检查点列表失败: {e}")
+            raise
+
+    async def delete_expired_analysis_checkpoints(self, before: str, batch_size: int = 100) -> int:
+        """删除一批created_at早于before的分析检查点，返回删除行数"""
+        try:
+            with self._transaction() as conn:
+                return conn.execute("DELETE FROM analysis_checkpoints WHERE id IN (SELECT id FROM "
+                                    "analysis_checkpoints WHERE created_at < ? ORDER BY created_at LIMIT ?)",
+                                    [before, batch_size]).rowcount
+        except Exception as e:
+            logger.error(f"清理过期分析检查点失败: {e}")
+            raise
+
+    # ========== 文件存储相关 ==========
+
+    def _storage_path(self, bucket: str, file_path: str) -> Path:
+        root = (self.storage_dir / bucket).resolve()
+        path = (root / file_path).resolve()
+        if root not in path.parents:
+            raise ValueError(f"非法的文件路径: {file_path}")
+        return path
+
+    async def upload_file(self, bucket: str, file_path: str, file_data: bytes,
+                          content_type: str = "application/octet-stream") -> str:
+        """上传文件到本地存储目录，返回file:// URL"""
+        try:
+            path = self._storage_path(bucket, file_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(file_data)
+            return path.as_uri()
+        except Exception as e:
+            logger.error(f"文件上传失败: {e}")
+            raise
+
+    async def download_file(self, bucket: str, file_path: str) -> bytes:
+        """从本地存储目录读取文件"""
+        try:
+            return self._storage_path(bucket, file_path).read_bytes()
+        except Exception as e:
+            logger.error(f"文件下载失败: {e}")
+            raise
+
+    async def delete_file(self, bucket: str, file_path: str):
+        """删除本地存储目录中的文件"""
+        try:
+            path = self._storage_path(bucket, file_path)
+            if path.exists():
+                path.unlink()
+            return [file_path]
+        except Exception as e:
+            logger.error(f"文件删除失败: {e}")
+            raise
+
+    # ========== 分析报告相关 ==========
+
+    async def save_analysis_report(self, analysis_id: str, report_type: str,
+                                   content: Dict[str, Any], score: Optional[float] = None):
+        """保存分析报告（同一分析同一类型的报告覆盖写入）"""
+        try:
+            report_data = {
+                "analysis_id": analysis_id,
+                "report_type": report_type,
+                "content": content,
+                "score": score,
+                "summary": content.get("summary") if isinstance(content.get("summary"), str) else None,
+                "created_at": _now()
+            }
+            return self._upsert("analysis_reports", report_data, conflict=["analysis_id", "report_type"])
+        except Exception as e:
+            logger.error(f"保存分析报告失败: {e}")
+            raise
+
+    async def get_analysis_reports(self, analysis_id: str) -> List[Dict[str, Any]]:
+        """获取分析的所有报告"""
+        try:
+            return self._query("SELECT * FROM analysis_reports WHERE analysis_id = ?", [analysis_id])
+        except Exception as e:
+            logger.error(f"获取分析报告失败: {e}")
+            raise
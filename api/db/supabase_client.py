@@ -1,17 +1,23 @@
 """Supabase客户端模块"""
-from supabase import create_client, Client
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable, Tuple, TYPE_CHECKING
 import os
+import asyncio
 from datetime import datetime, timedelta
 import logging
 from dotenv import load_dotenv
+from service_registry import registry
+from fast_json import fast_json_requests
+from .repository import AnalysisRepository, summarize_usage
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 # 加载环境变量
 load_dotenv(dotenv_path="../.env.local")
 
 logger = logging.getLogger(__name__)
 
-class SupabaseDB:
+class SupabaseDB(AnalysisRepository):
     """Supabase数据库操作封装类"""
     
     def __init__(self):
@@ -21,7 +27,37 @@ class SupabaseDB:
         if not url or not key:
             raise ValueError("Supabase URL和Service Role Key必须配置")
         
-        self.client: Client = create_client(url, key)
+        # supabase（含httpx/gotrue/storage等）导入较慢，推迟到首次构造
+        from supabase import create_client
+        self.client: "Client" = create_client(url, key)
+        
+        # PostgREST请求的HTTP事件钩子（如指标统计）；登录/刷新令牌后客户端会重建，重建时重新挂上
+        # 请求体（报告内容、检查点等大JSONB）用fast_json编码
+        self.http_event_hooks: Dict[str, List[Callable]] = {"request": [], "response": []}
+        init_postgrest = self.client._init_postgrest_client
+        
+        def init_postgrest_with_hooks(*args, **kwargs):
+            postgrest = init_postgrest(*args, **kwargs)
+            postgrest.session.event_hooks = self.http_event_hooks
+            fast_json_requests(postgrest.session)
+            return postgrest
+        
+        self.client._init_postgrest_client = init_postgrest_with_hooks
+    
+    def add_http_event_hook(self, event: str, hook: Callable):
+        """注册PostgREST请求钩子，event为request或response"""
+        self.http_event_hooks[event].append(hook)
+        if self.client._postgrest is not None:
+            self.client._postgrest.session.event_hooks = self.http_event_hooks
+    
+    def warm_up(self):
+        """启动预热：发一个轻量查询，预先建立PostgREST连接"""
+        self.client.table("patent_analyses").select("id").limit(1).execute()
+    
+    @staticmethod
+    async def _in_thread(func: Callable, *args) -> Any:
+        """在默认线程池中执行阻塞的PostgREST请求，用于后台维护任务，不占用事件循环"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
     
     # ========== 专利分析相关 ==========
     
@@ -55,6 +91,24 @@ class SupabaseDB:
             logger.error(f"获取分析失败: {e}")
             raise
     
+    async def get_analysis_versions(self, analysis_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """只读取分析与各报告的版本字段（不含报告内容），用于计算ETag"""
+        try:
+            query = self.client.table("patent_analyses").select("id,user_id,status,updated_at").eq("id", analysis_id)
+            if user_id:
+                query = query.eq("user_id", user_id)
+            result = query.execute()
+            if not result.data:
+                return None
+            reports = self.client.table("analysis_reports")\
+                .select("id,report_type,created_at,score")\
+                .eq("analysis_id", analysis_id)\
+                .execute()
+            return {"analysis": result.data[0], "reports": reports.data}
+        except Exception as e:
+            logger.error(f"获取分析版本失败: {e}")
+            raise
+    
     async def update_analysis_status(self, analysis_id: str, status: str, error_message: Optional[str] = None):
         """更新分析状态"""
         try:
@@ -111,7 +165,9 @@ class SupabaseDB:
                 "query_text": query_text,
                 "results": results,
                 "source": source,
-                "expires_at": expires_at.isoformat()
+                "expires_at": expires_at.isoformat(),
+                # 写入也算一次使用，新条目不会被LRU立即淘汰
+                "last_hit_at": datetime.utcnow().isoformat()
             }).execute()
             
             return result.data[0] if result.data else None
@@ -119,6 +175,75 @@ class SupabaseDB:
             logger.error(f"缓存搜索结果失败: {e}")
             raise
     
+    async def record_search_cache_hits(self, hits: Dict[str, int], hit_at: Optional[str] = None) -> int:
+        """批量累加搜索缓存命中次数（query_hash -> 次数）并更新最近命中时间"""
+        if not hits:
+            return 0
+        try:
+            result = await self._in_thread(self.client.rpc("record_search_cache_hits", {
+                "hashes": list(hits),
+                "counts": list(hits.values()),
+                "hit_at": hit_at or datetime.utcnow().isoformat()
+            }).execute)
+            
+            return result.data or 0
+        except Exception as e:
+            logger.error(f"记录搜索缓存命中失败: {e}")
+            raise
+    
+    def _delete_search_cache_ids(self, ids: List[str]) -> int:
+        # 按id删除，每批的请求URL长度有上限
+        if not ids:
+            return 0
+        result = self.client.table("search_cache").delete().in_("id", ids).execute()
+        return len(result.data or [])
+    
+    async def delete_expired_search_cache(self, batch_size: int = 100) -> int:
+        """删除一批已过期的搜索缓存，返回删除行数"""
+        try:
+            query = self.client.table("search_cache")\
+                .select("id")\
+                .lte("expires_at", datetime.utcnow().isoformat())\
+                .order("expires_at")\
+                .limit(batch_size)
+            result = await self._in_thread(query.execute)
+            
+            return await self._in_thread(self._delete_search_cache_ids, [row["id"] for row in result.data])
+        except Exception as e:
+            logger.error(f"清理过期搜索缓存失败: {e}")
+            raise
+    
+    async def evict_search_cache(self, count: int) -> int:
+        """删除最久未命中的count行搜索缓存，返回删除行数"""
+        if count <= 0:
+            return 0
+        try:
+            query = self.client.table("search_cache")\
+                .select("id")\
+                .order("last_hit_at", nullsfirst=True)\
+                .limit(count)
+            result = await self._in_thread(query.execute)
+            
+            return await self._in_thread(self._delete_search_cache_ids, [row["id"] for row in result.data])
+        except Exception as e:
+            logger.error(f"淘汰搜索缓存失败: {e}")
+            raise
+    
+    async def get_search_cache_stats(self) -> Dict[str, Any]:
+        """搜索缓存行数、已过期行数与占用空间（rows, expired, table_bytes, index_bytes）"""
+        try:
+            result = await self._in_thread(self.client.rpc("search_cache_stats", {}).execute)
+            row = result.data[0] if result.data else {}
+            return {
+                "rows": row.get("row_count") or 0,
+                "expired": row.get("expired_count") or 0,
+                "table_bytes": row.get("table_bytes"),
+                "index_bytes": row.get("index_bytes")
+            }
+        except Exception as e:
+            logger.error(f"获取搜索缓存统计失败: {e}")
+            raise
+    
     # ========== 使用量记录相关 ==========
     
     async def log_usage(self, user_id: str, analysis_id: Optional[str], service: str, 
@@ -155,29 +280,209 @@ class SupabaseDB:
                 .gte("created_at", start_date)\
                 .execute()
             
-            # 汇总数据
-            summary = {
-                "total_cost": 0,
-                "total_tokens": 0,
-                "by_service": {}
-            }
+            return summarize_usage(result.data)
+        except Exception as e:
+            logger.error(f"获取使用量汇总失败: {e}")
+            raise
+    
+    # ========== 用户订阅相关 ==========
+    
+    async def get_user_subscription(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """获取用户订阅信息"""
+        try:
+            result = self.client.table("user_subscriptions")\
+                .select("plan_type, status, monthly_analyses_limit, monthly_analyses_used, current_period_end")\
+                .eq("user_id", user_id)\
+                .execute()
             
-            for record in result.data:
-                service = record["service"]
-                if service not in summary["by_service"]:
-                    summary["by_service"][service] = {"cost": 0, "tokens": 0, "calls": 0}
-                
-                summary["by_service"][service]["calls"] += 1
-                if record["cost"]:
-                    summary["total_cost"] += record["cost"]
-                    summary["by_service"][service]["cost"] += record["cost"]
-                if record["tokens_used"]:
-                    summary["total_tokens"] += record["tokens_used"]
-                    summary["by_service"][service]["tokens"] += record["tokens_used"]
+            return result.data[0] if result.data else None
+        except Exception as e:
+            logger.error(f"获取用户订阅失败: {e}")
+            raise
+    
+    async def increment_subscription_usage(self, user_id: str, delta: int):
+        """累加用户本月已用分析次数（increment_subscription_usage函数内单条UPDATE完成读改写）"""
+        try:
+            result = self.client.rpc("increment_subscription_usage", {
+                "p_user_id": user_id,
+                "delta": delta
+            }).execute()
             
-            return summary
+            return result.data[0] if result.data else None
         except Exception as e:
-            logger.error(f"获取使用量汇总失败: {e}")
+            logger.error(f"更新订阅用量失败: {e}")
+            raise
+    
+    async def start_subscription_period(self, user_id: str, expected_end: str, period_start: str,
+                                        period_end: str) -> Optional[Dict[str, Any]]:
+        """当前周期仍以expected_end结束时清零已用次数并进入新周期（条件更新，多个worker只顺延一次）"""
+        try:
+            result = self.client.table("user_subscriptions")\
+                .update({
+                    "monthly_analyses_used": 0,
+                    "current_period_start": period_start,
+                    "current_period_end": period_end
+                })\
+                .eq("user_id", user_id)\
+                .eq("current_period_end", expected_end)\
+                .execute()
+            
+            return result.data[0] if result.data else None
+        except Exception as e:
+            logger.error(f"顺延订阅周期失败: {e}")
+            raise
+    
+    # ========== 专利向量相关 ==========
+    
+    async def search_similar_patents(self, embedding: List[float], top_k: int = 10,
+                                   filters: Optional[Dict[str, Any]] = None,
+                                   min_similarity: float = 0.0) -> List[Dict[str, Any]]:
+        """按余弦相似度检索最相近的专利，filters按metadata字段精确匹配"""
+        try:
+            result = self.client.rpc("match_patent_embeddings", {
+                "query_embedding": embedding,
+                "match_count": top_k,
+                "min_similarity": min_similarity,
+                "filter": filters or {}
+            }).execute()
+            
+            return result.data or []
+        except Exception as e:
+            logger.error(f"专利相似度检索失败: {e}")
+            raise
+    
+    async def get_existing_patent_ids(self, patent_ids: List[str]) -> set:
+        """返回已存在于patent_embeddings中的专利号"""
+        if not patent_ids:
+            return set()
+        try:
+            result = self.client.table("patent_embeddings")\
+                .select("patent_id")\
+                .in_("patent_id", patent_ids)\
+                .execute()
+            
+            return {row["patent_id"] for row in result.data}
+        except Exception as e:
+            logger.error(f"查询已有专利向量失败: {e}")
+            raise
+    
+    async def upsert_patent_embeddings(self, rows: List[Dict[str, Any]]) -> int:
+        """批量写入专利向量，按patent_id去重"""
+        if not rows:
+            return 0
+        try:
+            result = self.client.table("patent_embeddings")\
+                .upsert(rows, on_conflict="patent_id")\
+                .execute()
+            
+            return len(result.data or [])
+        except Exception as e:
+            logger.error(f"批量写入专利向量失败: {e}")
+            raise
+    
+    async def list_patent_embeddings(self, after: Optional[Tuple[str, str]] = None,
+                                   limit: int = 1000) -> List[Dict[str, Any]]:
+        """按 (updated_at, patent_id) 顺序拉取after之后新增或更新的专利向量，用于本地索引增量同步"""
+        try:
+            # 键集分页：同一时间戳的大批行（同一事务写入）也能逐页取完
+            result = self.client.rpc("list_patent_embeddings_after", {
+                "after_updated_at": after[0] if after else None,
+                "after_patent_id": after[1] if after else "",
+                "page_size": limit
+            }).execute()
+            return result.data or []
+        except Exception as e:
+            logger.error(f"拉取专利向量失败: {e}")
+            raise
+    
+    # ========== 分析检查点相关 ==========
+    
+    async def get_analysis_checkpoint(self, scope: str, node: str,
+                                      input_fingerprint: str) -> Optional[Dict[str, Any]]:
+        """按阶段输入指纹获取检查点"""
+        try:
+            result = self.client.table("analysis_checkpoints")\
+                .select("output, analysis_id, created_at")\
+                .eq("scope", scope)\
+                .eq("node", node)\
+                .eq("input_fingerprint", input_fingerprint)\
+                .execute()
+            
+            return result.data[0] if result.data else None
+        except Exception as e:
+            logger.error(f"获取分析检查点失败: {e}")
+            raise
+    
+    async def get_latest_analysis_checkpoint(self, scope: str, node: str) -> Optional[Dict[str, Any]]:
+        """获取某阶段最近一次检查点的逐字段输入指纹"""
+        try:
+            result = self.client.table("analysis_checkpoints")\
+                .select("input_fields, created_at")\
+                .eq("scope", scope)\
+                .eq("node", node)\
+                .order("created_at", desc=True)\
+                .limit(1)\
+                .execute()
+            
+            return result.data[0] if result.data else None
+        except Exception as e:
+            logger.error(f"获取最近分析检查点失败: {e}")
+            raise
+    
+    async def save_analysis_checkpoint(self, scope: str, node: str, input_fingerprint: str,
+                                       output: Dict[str, Any], analysis_id: Optional[str] = None,
+                                       input_fields: Optional[Dict[str, str]] = None):
+        """保存阶段检查点"""
+        try:
+            result = self.client.table("analysis_checkpoints")\
+                .upsert({
+                    "scope": scope,
+                    "node": node,
+                    "input_fingerprint": input_fingerprint,
+                    "input_fields": input_fields or {},
+                    "output": output,
+                    "analysis_id": analysis_id,
+                    "created_at": datetime.utcnow().isoformat()
+                }, on_conflict="scope,node,input_fingerprint")\
+                .execute()
+            
+            return result.data[0] if result.data else None
+        except Exception as e:
+            logger.error(f"保存分析检查点失败: {e}")
+            raise
+    
+    async def list_analysis_checkpoints(self, analysis_id: str) -> List[Dict[str, Any]]:
+        """按完成顺序列出某次分析的检查点"""
+        try:
+            result = self.client.table("analysis_checkpoints")\
+                .select("node, input_fingerprint, created_at")\
+                .eq("analysis_id", analysis_id)\
+                .order("created_at")\
+                .execute()
+            
+            return result.data
+        except Exception as e:
+            logger.error(f"获取分析检查点列表失败: {e}")
+            raise
+    
+    async def delete_expired_analysis_checkpoints(self, before: str, batch_size: int = 100) -> int:
+        """删除一批created_at早于before的分析检查点，返回删除行数"""
+        try:
+            query = self.client.table("analysis_checkpoints")\
+                .select("id")\
+                .lt("created_at", before)\
+                .order("created_at")\
+                .limit(batch_size)
+            result = await self._in_thread(query.execute)
+            ids = [row["id"] for row in result.data]
+            if not ids:
+                return 0
+            
+            query = self.client.table("analysis_checkpoints").delete().in_("id", ids)
+            result = await self._in_thread(query.execute)
+            return len(result.data or [])
+        except Exception as e:
+            logger.error(f"清理过期分析检查点失败: {e}")
             raise
     
     # ========== 文件存储相关 ==========
@@ -255,5 +560,5 @@ class SupabaseDB:
             logger.error(f"获取分析报告失败: {e}")
             raise
 
-# 创建全局实例
-db = SupabaseDB()
\ No newline at end of file
+# 创建全局实例（首次使用时构造）；认证等Supabase专有功能始终使用该实例
+supabase_db = registry.register("supabase", SupabaseDB)
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""JSON编解码
+
+设置FAST_JSON=true且已安装orjson时使用orjson（默认关闭），否则使用标准库json，输出语义保持一致：
+非ASCII字符原样输出、紧凑分隔符。用于API响应、提示词中嵌入的结构化数据与数据库写入载荷。
+"""
+import os
+import json
+import logging
+from typing import Any, Callable, Optional, Union
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENABLED = orjson is not None and os.getenv("FAST_JSON", "false").lower() == "true"
+
+if orjson is not None:
+    # 数据类交给default处理（如SearchRecord.to_dict），非字符串键与numpy数组直接支持
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+def default(value: Any) -> Any:
+    """通用的非JSON类型转换：记录对象、pydantic模型、集合与numpy标量"""
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if hasattr(value, "item"):  # numpy标量
+        return value.item()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps_bytes(value: Any, default: Optional[Callable[[Any], Any]] = default,
+                indent: bool = False, sort_keys: bool = False) -> bytes:
+    """序列化为UTF-8字节"""
+    if ENABLED:
+        option = _OPTIONS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(value, default=default, option=option)
+    return json.dumps(value, ensure_ascii=False, default=default, indent=2 if indent else None,
+                      separators=None if indent else (",", ":"), sort_keys=sort_keys).encode("utf-8")
+
+
+def dumps(value: Any, default: Optional[Callable[[Any], Any]] = default,
+          indent: bool = False, sort_keys: bool = False) -> str:
+    """序列化为字符串（用于提示词、NDJSON行等）"""
+    return dumps_bytes(value, default, indent, sort_keys).decode("utf-8")
+
+
+def loads(data: Union[bytes, bytearray, str]) -> Any:
+    """反序列化"""
+    if ENABLED:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def to_jsonable(value: Any, default: Optional[Callable[[Any], Any]] = default) -> Any:
+    """转换为可写入JSON/JSONB的普通结构（序列化后再解析）"""
+    return loads(dumps_bytes(value, default))
+
+
+class FastJSONResponse(JSONResponse):
+    """使用上面编码器的JSON响应
+
+    直接返回该响应的端点跳过FastAPI的jsonable_encoder逐字段转换；
+    作为应用默认响应类时只替换最后的序列化步骤。
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
+
+
+def fast_json_requests(session):
+    """让httpx客户端（如Supabase PostgREST会话）用上面的编码器序列化json=请求体"""
+    import httpx
+    build_request = session.build_request
+
+    def build(method, url, *, json=None, **kwargs):
+        if json is not None and kwargs.get("content") is None:
+            kwargs["content"] = dumps_bytes(json)
+            headers = httpx.Headers(kwargs.get("headers"))
+            if "content-type" not in headers:
+                headers["Content-Type"] = "application/json"
+            kwargs["headers"] = headers
+            json = None
+        return build_request(method, url, json=json, **kwargs)
+
+    session.build_request = build
+    return session
@@ -1,14 +1,31 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, status
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Header, Query, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel, EmailStr
 from typing import Optional, Dict, Any, List
 import os
 from dotenv import load_dotenv
-from db import db
-from services import serp, gemini, auth
+from db import db, supabase_db
+from services import serp, gemini, auth, auth_executor, token_executor, ExecutorOverloaded
+from services import rate_limiter, RateLimitExceeded, prior_art_search, embedding_ingestor, vector_index
+from services import novelty_prescreen, portfolio_scanner, upstream_governor, UpstreamQuotaExceeded, CircuitOpenError
+from services import model_router, analysis_checkpoints, batch_analyzer
+from services.upstream_governor import run_upstream
+from services.analysis_checkpoints import RecomputeDiff
+from services.batch_analysis import BatchContext
+from services.http_cache import report_cache, analysis_etag, etag_matches, CompressionMiddleware
+from services.idempotency import submissions, IdempotencyKeyReused
+from services.search_cache_sweeper import search_cache_sweeper
+from services.metrics import (metrics, ASGIMetricsMiddleware, HTTP_LATENCY, HTTP_REQUESTS, SEARCH_CACHE,
+                              loop_lag_monitor, http_client_hooks)
+from services.tracing import tracer, trace_http_hooks
+from service_registry import registry
+from fast_json import FastJSONResponse
+import fast_json
+from services.serp_records import to_dicts, pack_search_results, unpack_search_results
+import asyncio
 import hashlib
-import json
 import logging
 
 # 配置日志
@@ -24,7 +41,7 @@ else:
     logger.info("No .env.local file found, using environment variables")
 
 # Initialize FastAPI app
-app = FastAPI(title="Patent Analysis API", version="1.0.0")
+app = FastAPI(title="Patent Analysis API", version="1.0.0", default_response_class=FastJSONResponse)
 
 # Configure CORS
 app.add_middleware(
@@ -35,6 +52,83 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 较大的完整响应按Accept-Encoding压缩（gzip/br）
+app.add_middleware(CompressionMiddleware, minimum_size=report_cache.min_compress_size)
+
+# 请求延迟指标（按路由模板）
+app.add_middleware(ASGIMetricsMiddleware, latency=HTTP_LATENCY, requests=HTTP_REQUESTS)
+
+# Supabase PostgREST调用延迟与错误，并记入当前分析的trace（Supabase客户端首次使用时挂上）
+_on_db_request, _on_db_response = http_client_hooks("supabase")
+_trace_db_request, _trace_db_response = trace_http_hooks("supabase")
+
+def _install_db_hooks(instance):
+    instance.add_http_event_hook("request", _on_db_request)
+    instance.add_http_event_hook("response", _on_db_response)
+    instance.add_http_event_hook("request", _trace_db_request)
+    instance.add_http_event_hook("response", _trace_db_response)
+
+# DB_BACKEND=sqlite时业务读写不经过PostgREST，这里只统计认证相关的请求
+registry.when_ready("supabase", _install_db_hooks)
+
+def _queue_depths() -> Dict[tuple, float]:
+    """各队列当前排队数（抓取/metrics时读取）"""
+    depths = {
+        ("auth_executor",): auth_executor.queue_depth,
+        ("token_executor",): token_executor.queue_depth,
+        ("embedding_ingestion",): embedding_ingestor.stats()["buffered"],
+        ("batch_analysis",): batch_analyzer.stats()["queued_items"],
+    }
+    for provider, stats in upstream_governor.stats().items():
+        for lane, waiting in stats["waiting"].items():
+            depths[(f"upstream_{provider}_{lane}",)] = waiting
+    return depths
+
+metrics.gauge("queue_depth", "各队列当前排队数", ("queue",), callback=_queue_depths)
+
+# search_cache大小（最近一次清理时读取）
+metrics.gauge("search_cache_rows", "search_cache行数，state为total/expired", ("state",),
+              callback=lambda: {(state,): search_cache_sweeper.table[key]
+                                for state, key in (("total", "rows"), ("expired", "expired"))
+                                if key in search_cache_sweeper.table})
+metrics.gauge("search_cache_bytes", "search_cache占用空间，kind为table/index", ("kind",),
+              callback=lambda: {(kind,): search_cache_sweeper.table[key]
+                                for kind, key in (("table", "table_bytes"), ("index", "index_bytes"))
+                                if search_cache_sweeper.table.get(key) is not None})
+
+@app.on_event("startup")
+async def startup():
+    rate_limiter.start()
+    # 专利搜索结果后台批量入库patent_embeddings
+    registry.when_ready("serp", lambda instance: instance.result_listeners.append(embedding_ingestor.submit))
+    embedding_ingestor.start()
+    # 本地向量索引（配置VECTOR_INDEX_PATH时从快照加载并增量刷新）
+    vector_index.start()
+    # 事件循环延迟指标
+    loop_lag_monitor.start()
+    # search_cache过期清理与LRU淘汰
+    search_cache_sweeper.start()
+    # 过期分析检查点清理
+    analysis_checkpoints.start()
+    # 服务预热（构造客户端、预建连接）：blocking等预热完成（或超时）再接收请求，
+    # background不阻塞启动（首批请求可能自行构造客户端），off关闭
+    warm_up = os.getenv("SERVICE_WARMUP", "blocking").lower()
+    timeout = float(os.getenv("SERVICE_WARMUP_TIMEOUT", "10"))
+    if warm_up == "blocking":
+        await registry.warm_up(timeout=timeout)
+    elif warm_up == "background":
+        asyncio.ensure_future(registry.warm_up(timeout=timeout))
+
+@app.on_event("shutdown")
+async def shutdown():
+    await rate_limiter.stop()
+    await embedding_ingestor.stop()
+    await vector_index.stop()
+    await batch_analyzer.stop()
+    await loop_lag_monitor.stop()
+    await search_cache_sweeper.stop()
+    await analysis_checkpoints.stop()
+
 # Models
 class AnalysisRequest(BaseModel):
     title: str
@@ -43,6 +137,10 @@ class AnalysisRequest(BaseModel):
     technical_content: str
     user_id: str
 
+class BatchAnalysisRequest(BaseModel):
+    user_id: str
+    items: List[AnalysisRequest]
+
 class AnalysisResponse(BaseModel):
     analysis_id: str
     status: str
@@ -53,6 +151,13 @@ class SearchRequest(BaseModel):
     source: str = "serp"  # serp, google_patent, scholar
     user_id: str
 
+class SimilarPatentsRequest(BaseModel):
+    query: str
+    user_id: str
+    top_k: int = 10
+    min_similarity: float = 0.0
+    filters: Optional[Dict[str, Any]] = None
+
 class UserRegister(BaseModel):
     email: EmailStr
     password: str
@@ -69,9 +174,42 @@ class Token(BaseModel):
 # OAuth2 配置
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
+def _overloaded_response(e: ExecutorOverloaded) -> HTTPException:
+    """执行器过载时返回503，提示客户端稍后重试"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="服务繁忙，请稍后重试",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+# 上游额度不足、排队超时或熔断
+UPSTREAM_UNAVAILABLE = (UpstreamQuotaExceeded, CircuitOpenError)
+
+def _upstream_response(e: Exception) -> HTTPException:
+    """上游API不可用时返回503，提示客户端稍后重试"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=e.reason,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+async def enforce_rate_limit(user_id: str, action: str, count: int = 1):
+    """检查用户限流与配额，超出时返回429"""
+    try:
+        await rate_limiter.check(user_id, action, count)
+    except RateLimitExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
 # 获取当前用户的依赖
 async def get_current_user(token: str = Depends(oauth2_scheme)):
-    user = await auth.get_current_user(token)
+    try:
+        user = await auth.get_current_user(token)
+    except ExecutorOverloaded as e:
+        raise _overloaded_response(e)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -94,13 +232,35 @@ async def health_check():
     """健康检查端点"""
     from datetime import datetime
     return {
-        "status": "healthy",
+        "status": "degraded" if upstream_governor.degraded() else "healthy",
         "timestamp": datetime.now().isoformat(),
         "service": "Patent Analysis API",
         "version": "1.0.1",
-        "supabase": "connected"
+        "supabase": "connected",
+        "executors": {
+            "auth": auth_executor.stats(),
+            "auth_token": token_executor.stats()
+        },
+        "rate_limiter": rate_limiter.stats(),
+        "embedding_ingestion": embedding_ingestor.stats(),
+        "vector_index": vector_index.index.stats(),
+        "upstream": upstream_governor.stats(),
+        "model_router": model_router.stats(),
+        "analysis_checkpoints": analysis_checkpoints.stats(),
+        "batch_analysis": batch_analyzer.stats(),
+        "tracing": tracer.stats(),
+        "services": registry.status(),
+        "report_cache": report_cache.stats(),
+        "submissions": submissions.stats(),
+        "search_cache": search_cache_sweeper.stats()
     }
 
+# Prometheus metrics
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus指标（文本格式）"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # Create new analysis
 @app.post("/api/analyses", response_model=AnalysisResponse)
 async def create_analysis(request: AnalysisRequest):
@@ -134,8 +294,23 @@ async def create_analysis(request: AnalysisRequest):
 
 # Get analysis status
 @app.get("/api/analyses/{analysis_id}")
-async def get_analysis(analysis_id: str, user_id: Optional[str] = None):
+async def get_analysis(analysis_id: str, user_id: Optional[str] = None,
+                       if_none_match: Optional[str] = Header(None),
+                       accept_encoding: Optional[str] = Header(None)):
     try:
+        # 已完成的分析不再变化：命中进程内缓存时不访问数据库，直接返回预压缩的字节或304
+        cached = report_cache.get(analysis_id)
+        if cached and (not user_id or cached.user_id == user_id):
+            return report_cache.respond(cached, if_none_match, accept_encoding)
+        
+        # 条件请求但缓存未命中（如其他worker）：先只查版本字段，ETag未变化时不读取报告内容
+        if if_none_match:
+            versions = await db.get_analysis_versions(analysis_id, user_id)
+            if versions and versions["analysis"]["status"] == "completed":
+                etag = analysis_etag(versions["analysis"], versions["reports"])
+                if etag_matches(if_none_match, etag):
+                    return report_cache.not_modified(etag)
+        
         analysis = await db.get_analysis(analysis_id, user_id)
         
         if not analysis:
@@ -145,7 +320,12 @@ async def get_analysis(analysis_id: str, user_id: Optional[str] = None):
         reports = await db.get_analysis_reports(analysis_id)
         analysis["reports"] = reports
         
-        return analysis
+        if analysis["status"] == "completed":
+            entry = report_cache.put(analysis, analysis_etag(analysis, reports))
+            return report_cache.respond(entry, if_none_match, accept_encoding, hit=False)
+        
+        # 报告content为大JSONB，直接编码，跳过jsonable_encoder的逐字段转换
+        return FastJSONResponse(analysis, headers={"Cache-Control": "no-cache"})
     except Exception as e:
         logger.error(f"Error getting analysis: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -155,11 +335,11 @@ async def get_analysis(analysis_id: str, user_id: Optional[str] = None):
 async def list_analyses(user_id: str, limit: int = 20, offset: int = 0):
     try:
         analyses = await db.list_user_analyses(user_id, limit, offset)
-        return {
+        return FastJSONResponse({
             "data": analyses,
             "limit": limit,
             "offset": offset
-        }
+        })
     except Exception as e:
         logger.error(f"Error listing analyses: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -167,40 +347,43 @@ async def list_analyses(user_id: str, limit: int = 20, offset: int = 0):
 # Search with caching
 @app.post("/api/search")
 async def search_with_cache(request: SearchRequest):
+    await enforce_rate_limit(request.user_id, "search")
     try:
         # 生成查询哈希
         query_hash = hashlib.md5(f"{request.query}:{request.source}".encode()).hexdigest()
         
         # 检查缓存
         cached = await db.get_cached_search(query_hash)
+        SEARCH_CACHE.inc(("hit" if cached else "miss",))
         if cached:
+            search_cache_sweeper.record_hit(query_hash)
             logger.info(f"返回缓存的搜索结果: {query_hash}")
-            return {
-                "results": cached["results"],
+            return FastJSONResponse({
+                "results": unpack_search_results(cached["results"]),
                 "cached": True
-            }
+            })
         
-        # 执行实际搜索
-        results = None
+        # 执行实际搜索（在线程池中执行，限流排队不阻塞事件循环）
         if request.source == "google_patent":
-            results = serp.search_patents(request.query)
+            search = serp.search_patents
         elif request.source == "scholar":
-            results = serp.search_scholar(request.query)
+            search = serp.search_scholar
         else:  # 默认使用常规搜索
-            results = serp.search_prior_art(request.query)
+            search = serp.search_prior_art
+        results = await run_upstream(search, request.query)
         
         search_results = {
             "query": request.query,
             "source": request.source,
-            "results": results,
+            "results": to_dicts(results),
             "count": len(results)
         }
         
-        # 缓存结果
+        # 缓存结果（列式存储，字段名只保存一次）
         await db.cache_search_result(
             query_hash=query_hash,
             query_text=request.query,
-            results=search_results,
+            results=pack_search_results(request.query, request.source, results),
             source=request.source
         )
         
@@ -212,14 +395,70 @@ async def search_with_cache(request: SearchRequest):
             cost=0.01  # SERP API成本
         )
         
-        return {
+        return FastJSONResponse({
             "results": search_results,
             "cached": False
-        }
+        })
+    except UPSTREAM_UNAVAILABLE as e:
+        logger.warning(f"Search throttled: {e}")
+        raise _upstream_response(e)
     except Exception as e:
         logger.error(f"Error in search: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Vector similarity search over patent_embeddings
+@app.post("/api/similar-patents")
+async def similar_patents(request: SimilarPatentsRequest):
+    await enforce_rate_limit(request.user_id, "search")
+    try:
+        results = await prior_art_search.search_local(
+            request.query,
+            top_k=min(max(request.top_k, 1), 50),
+            filters=request.filters,
+            min_similarity=request.min_similarity
+        )
+        return {
+            "query": request.query,
+            "results": results,
+            "count": len(results)
+        }
+    except UPSTREAM_UNAVAILABLE as e:
+        raise _upstream_response(e)
+    except Exception as e:
+        logger.error(f"Error in similar patents search: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Streaming company patent portfolio scan
+@app.get("/api/company-patents/scan")
+async def scan_company_patents(company: str, user_id: str,
+                               max_results: int = Query(1000, ge=1, le=portfolio_scanner.max_results),
+                               resume: bool = True):
+    """分页扫描公司专利组合，以NDJSON逐条返回；每拉取一页SerpAPI扣减一次搜索限额"""
+    # 第一页在开始流式返回前扣减，超限时直接返回429
+    await enforce_rate_limit(user_id, "search")
+    
+    async def charge_page(page: int):
+        if page:
+            await rate_limiter.check(user_id, "search")
+    
+    async def stream():
+        count = 0
+        try:
+            async for record in portfolio_scanner.scan(company, max_results=max_results, resume=resume,
+                                                       user_id=user_id, before_page=charge_page):
+                count += 1
+                yield fast_json.dumps(record.to_dict()) + "\n"
+            yield fast_json.dumps({"done": True, "count": count}) + "\n"
+        except RateLimitExceeded as e:
+            # 已产出的结果有效，检查点保留，稍后带resume重试即可继续
+            yield fast_json.dumps({"done": False, "count": count, "error": e.reason,
+                                   "retry_after": e.retry_after}) + "\n"
+        except Exception as e:
+            logger.error(f"公司专利扫描失败: {e}")
+            yield fast_json.dumps({"done": False, "count": count, "error": str(e)}) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 # File upload endpoint
 @app.post("/api/upload")
 async def upload_file(file: UploadFile = File(...), user_id: str = None):
@@ -265,7 +504,7 @@ async def get_usage_stats(user_id: str, days: int = 30):
 async def test_supabase():
     try:
         # 尝试查询一条记录来测试连接
-        result = db.client.table("patent_analyses").select("id").limit(1).execute()
+        result = supabase_db.client.table("patent_analyses").select("id").limit(1).execute()
         return {
             "status": "success",
             "message": "Supabase connection successful",
@@ -282,11 +521,11 @@ async def test_supabase():
 async def test_serp_api():
     try:
         # 测试专利搜索
-        results = serp.search_patents("battery technology", num_results=3)
+        results = await run_upstream(serp.search_patents, "battery technology", 3)
         return {
             "status": "success",
             "message": "SERP API connection successful",
-            "sample_results": results[:2] if results else [],
+            "sample_results": to_dicts(results[:2]),
             "total_found": len(results)
         }
     except Exception as e:
@@ -300,7 +539,7 @@ async def test_serp_api():
 async def test_gemini_api():
     try:
         # 测试文本生成
-        response = gemini.generate_content("Hello, please respond with: 'Gemini API is working!'")
+        response = await run_upstream(gemini.generate_content, "Hello, please respond with: 'Gemini API is working!'")
         return {
             "status": "success",
             "message": "Gemini API connection successful",
@@ -312,58 +551,118 @@ async def test_gemini_api():
             "message": str(e)
         }
 
-# Full patent analysis endpoint
-@app.post("/api/analyze-patent")
-async def analyze_patent(request: AnalysisRequest):
+async def run_patent_analysis(request: AnalysisRequest, batch: Optional[BatchContext] = None,
+                              analysis_id: Optional[str] = None) -> Dict[str, Any]:
+    """完整专利分析流程（单次与批量分析共用），失败时标记分析记录并抛出异常
+
+    batch为批量分析的共享上下文：批次内检索去重，实用性分析合并提示。
+    analysis_id给出时在该分析记录上恢复：已完成且输入未变的阶段复用检查点，从第一个未完成的阶段继续。
+    """
+    # 每次分析记为一条trace，创建分析记录后绑定analysis_id
+    with tracer.start_trace("analyze_patent", user_id=request.user_id):
+        return await _run_patent_analysis(request, batch, analysis_id)
+
+async def _run_patent_analysis(request: AnalysisRequest, batch: Optional[BatchContext],
+                               analysis_id: Optional[str]) -> Dict[str, Any]:
     try:
-        # 1. 创建分析记录
-        analysis = await db.create_analysis(
-            user_id=request.user_id,
-            data={
-                "title": request.title,
-                "description": request.description,
-                "metadata": {
-                    "technical_field": request.technical_field,
-                    "technical_content": request.technical_content
+        # 1. 创建分析记录（恢复时沿用原记录）
+        if analysis_id is None:
+            analysis = await db.create_analysis(
+                user_id=request.user_id,
+                data={
+                    "title": request.title,
+                    "description": request.description,
+                    "metadata": {
+                        "technical_field": request.technical_field,
+                        "technical_content": request.technical_content
+                    }
                 }
-            }
-        )
+            )
+            analysis_id = analysis["id"]
+        else:
+            await db.update_analysis_status(analysis_id, "processing")
+            report_cache.invalidate(analysis_id)
+        tracer.bind(analysis_id=analysis_id)
         
-        analysis_id = analysis["id"]
+        invention_info = {
+            "title": request.title,
+            "technical_field": request.technical_field,
+            "technical_content": request.technical_content
+        }
+        # 按用户套餐选择各阶段模型
+        plan_type = rate_limiter.plan_type(request.user_id)
+        
+        # 各阶段按输入指纹复用上次的结果，只重新计算输入发生变化的阶段
+        diff = RecomputeDiff()
+        
+        async def run_stage(stage: str, inputs: Dict[str, Any], compute, by_plan: bool = True):
+            # 检索阶段与套餐无关，by_plan=False时指纹不含plan_type
+            return await analysis_checkpoints.stage(
+                request.user_id, f"analyze:{stage}", {**inputs, "plan_type": plan_type} if by_plan else inputs,
+                compute, analysis_id=analysis_id, diff=diff
+            )
         
-        # 2. 搜索现有技术
+        # 2. 搜索现有技术（优先本地向量近邻，召回不足时使用SERP）
+        # 本地检索按完整发明内容复用；SERP检索词只取标题与技术领域，只改技术内容时复用SERP结果
         logger.info(f"开始搜索现有技术: {request.title}")
-        prior_art = serp.search_prior_art(f"{request.technical_field} {request.title}", num_results=10)
-        patents = serp.search_patents(request.title, num_results=5)
+        try:
+            local_prior_art = await run_stage(
+                "prior_art_local", invention_info,
+                lambda: prior_art_search.search_local_prior_art(invention_info), by_plan=False
+            )
+        except Exception as e:
+            # 失败不写检查点，下次重新检索
+            logger.warning(f"本地向量检索失败，回退SERP: {e}")
+            local_prior_art = {"results": [], "local_hits": 0, "sufficient": False}
+        serp_prior_art = None
+        if local_prior_art["sufficient"]:
+            logger.info(f"本地向量检索命中 {local_prior_art['local_hits']} 条，跳过SERP")
+        else:
+            serp_prior_art = await run_stage(
+                "prior_art_serp", prior_art_search.serp_inputs(invention_info),
+                lambda: prior_art_search.search_serp(invention_info, searches=batch.searches if batch else None),
+                by_plan=False
+            )
+        prior_art_result = prior_art_search.merge(local_prior_art, serp_prior_art)
         
-        # 3. 进行新颖性分析
+        # 3. 进行新颖性分析（向量预筛结论明确时跳过或缩小LLM分析）
         logger.info("开始新颖性分析")
-        novelty_result = await gemini.analyze_patent_novelty(
-            {
-                "title": request.title,
-                "technical_field": request.technical_field,
-                "technical_content": request.technical_content
-            },
-            prior_art + patents
+        
+        async def compute_novelty():
+            prescreen = await novelty_prescreen.screen(invention_info, prior_art_result["results"])
+            if prescreen and prescreen["decision"] == "anticipated":
+                logger.info(f"新颖性预筛命中高度相似现有技术，跳过LLM: {prescreen['max_similarity']}")
+                novelty_result = novelty_prescreen.shortcut_result(prescreen)
+            else:
+                novelty_result = await gemini.analyze_patent_novelty(
+                    invention_info,
+                    novelty_prescreen.select_prior_art(prior_art_result["results"], prescreen),
+                    plan_type=plan_type
+                )
+                novelty_result["prescreen"] = prescreen
+            return novelty_result
+        
+        novelty_result = await run_stage(
+            "novelty", {**invention_info, "prior_art": prior_art_result["results"]}, compute_novelty
         )
+        prescreen = novelty_result.get("prescreen")
         
         # 保存新颖性分析结果
+        novelty_content = novelty_result["analysis"]
+        if prescreen:
+            novelty_content = {**novelty_content, "prescreen": prescreen}
         await db.save_analysis_report(
             analysis_id=analysis_id,
             report_type="novelty",
-            content=novelty_result["analysis"],
+            content=novelty_content,
             score=novelty_result["score"]
         )
         
         # 4. 进行创造性分析
         logger.info("开始创造性分析")
-        inventiveness_result = await gemini.analyze_patent_inventiveness(
-            {
-                "title": request.title,
-                "technical_field": request.technical_field,
-                "technical_content": request.technical_content
-            },
-            novelty_result
+        inventiveness_result = await run_stage(
+            "inventiveness", {**invention_info, "novelty": novelty_result},
+            lambda: gemini.analyze_patent_inventiveness(invention_info, novelty_result, plan_type=plan_type)
         )
         
         # 保存创造性分析结果
@@ -376,11 +675,11 @@ async def analyze_patent(request: AnalysisRequest):
         
         # 5. 进行实用性分析
         logger.info("开始实用性分析")
-        utility_result = await gemini.analyze_patent_utility({
-            "title": request.title,
-            "technical_field": request.technical_field,
-            "technical_content": request.technical_content
-        })
+        utility_result = await run_stage(
+            "utility", invention_info,
+            lambda: batch.utility.submit(plan_type, invention_info) if batch
+            else gemini.analyze_patent_utility(invention_info, plan_type=plan_type)
+        )
         
         # 保存实用性分析结果
         await db.save_analysis_report(
@@ -392,11 +691,15 @@ async def analyze_patent(request: AnalysisRequest):
         
         # 6. 生成综合报告
         logger.info("生成综合报告")
-        final_report = await gemini.generate_patent_report({
+        analysis_results = {
             "novelty": novelty_result,
             "inventiveness": inventiveness_result,
             "utility": utility_result
-        })
+        }
+        final_report = await run_stage(
+            "report", analysis_results,
+            lambda: gemini.generate_patent_report(analysis_results, plan_type=plan_type)
+        )
         
         # 保存综合报告
         await db.save_analysis_report(
@@ -409,35 +712,157 @@ async def analyze_patent(request: AnalysisRequest):
         # 更新分析状态
         await db.update_analysis_status(analysis_id, "completed")
         
-        # 记录使用量
-        await db.log_usage(
-            user_id=request.user_id,
-            analysis_id=analysis_id,
-            service="gemini",
-            tokens_used=1000,  # 估算
-            cost=0.05  # 估算成本
-        )
+        # 记录使用量（按重新计算的LLM阶段比例估算，全部复用时不产生调用）
+        llm_stages = {"analyze:novelty", "analyze:inventiveness", "analyze:utility", "analyze:report"}
+        recomputed_llm = len(llm_stages.intersection(diff.recomputed_stages()))
+        if recomputed_llm:
+            await db.log_usage(
+                user_id=request.user_id,
+                analysis_id=analysis_id,
+                service="gemini",
+                tokens_used=250 * recomputed_llm,  # 估算
+                cost=0.0125 * recomputed_llm  # 估算成本
+            )
         
         return {
             "analysis_id": analysis_id,
             "status": "completed",
             "overall_score": final_report["overall_score"],
             "recommendation": final_report["recommendation"],
+            "prior_art": {
+                "local_hits": prior_art_result["local_hits"],
+                "used_serp": prior_art_result["used_serp"],
+                "duplicates_removed": prior_art_result["duplicates_removed"]
+            },
+            "novelty_prescreen": prescreen,
+            "models": {
+                "novelty": novelty_result.get("model"),
+                "inventiveness": inventiveness_result["model"],
+                "utility": utility_result["model"],
+                "report": final_report["model"]
+            },
+            "recompute": diff.to_dict(),
             "message": "Patent analysis completed successfully"
         }
         
     except Exception as e:
         logger.error(f"专利分析失败: {e}")
-        if 'analysis_id' in locals():
+        rate_limiter.refund(request.user_id, "analyze")
+        if analysis_id:
             await db.update_analysis_status(analysis_id, "failed", str(e))
+        raise
+
+# Full patent analysis endpoint
+@app.post("/api/analyze-patent")
+async def analyze_patent(request: AnalysisRequest, response: Response,
+                         idempotency_key: Optional[str] = Header(None)):
+    """同一Idempotency-Key的重试、以及内容相同的重复提交附着到已有的分析，不再重复执行"""
+    async def run():
+        # 配额只在真正执行时扣减，附着的重复提交不消耗配额
+        await enforce_rate_limit(request.user_id, "analyze")
+        return await run_patent_analysis(request)
+    
+    try:
+        result, replayed = await submissions.run(request.user_id, "analyze-patent", request.model_dump(), run,
+                                                 key=idempotency_key)
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
+        return result
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except HTTPException:
+        raise
+    except UPSTREAM_UNAVAILABLE as e:
+        raise _upstream_response(e)
+    except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Resume an interrupted or failed analysis from its stage checkpoints
+@app.post("/api/analyze-patent/{analysis_id}/resume")
+async def resume_patent_analysis(analysis_id: str, user_id: str):
+    """在原分析记录上重新运行：已完成的阶段直接复用，从第一个未完成的阶段继续"""
+    analysis = await db.get_analysis(analysis_id, user_id=user_id)
+    if not analysis:
+        raise HTTPException(status_code=404, detail="分析不存在")
+    if analysis.get("status") == "completed":
+        raise HTTPException(status_code=409, detail="分析已完成，无需恢复")
+    
+    metadata = analysis.get("metadata") or {}
+    request = AnalysisRequest(
+        title=analysis["title"],
+        description=analysis.get("description") or "",
+        technical_field=metadata.get("technical_field", ""),
+        technical_content=metadata.get("technical_content", ""),
+        user_id=analysis["user_id"]
+    )
+    
+    async def run():
+        await enforce_rate_limit(request.user_id, "analyze")
+        return await run_patent_analysis(request, analysis_id=analysis_id)
+    
+    try:
+        # 同一分析的并发恢复请求只执行一次
+        result, _ = await submissions.run(request.user_id, "resume-analysis", {"analysis_id": analysis_id}, run)
+        return result
+    except HTTPException:
+        raise
+    except UPSTREAM_UNAVAILABLE as e:
+        raise _upstream_response(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Batch patent analysis
+@app.post("/api/analyze-batch")
+async def analyze_batch(request: BatchAnalysisRequest):
+    """提交批量分析，返回批次ID；条目在全局并发上限下后台执行"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="批量分析至少需要一项")
+    if len(request.items) > batch_analyzer.max_items:
+        raise HTTPException(status_code=400, detail=f"单个批次最多{batch_analyzer.max_items}项")
+    if any(item.user_id != request.user_id for item in request.items):
+        raise HTTPException(status_code=400, detail="批次内所有条目必须属于同一用户")
+    # 整个批次一次扣减月度配额，失败的条目在run_patent_analysis中退还
+    await enforce_rate_limit(request.user_id, "analyze", count=len(request.items))
+    
+    async def run(item: AnalysisRequest, batch: BatchContext) -> Dict[str, Any]:
+        return {"title": item.title, **(await run_patent_analysis(item, batch))}
+    
+    job = batch_analyzer.submit(request.user_id, request.items, run)
+    return {
+        **job.progress(),
+        "message": "批量分析已提交，可通过进度或结果流接口获取结果"
+    }
+
+def _get_batch(batch_id: str, user_id: str):
+    job = batch_analyzer.get(batch_id)
+    if not job or job.user_id != user_id:
+        raise HTTPException(status_code=404, detail="批次不存在")
+    return job
+
+@app.get("/api/analyze-batch/{batch_id}")
+async def get_batch_progress(batch_id: str, user_id: str):
+    """批量分析汇总进度"""
+    return _get_batch(batch_id, user_id).progress()
+
+@app.get("/api/analyze-batch/{batch_id}/results")
+async def stream_batch_results(batch_id: str, user_id: str):
+    """以NDJSON按完成顺序返回批量分析结果，最后一行为汇总进度"""
+    job = _get_batch(batch_id, user_id)
+    
+    async def stream():
+        async for result in job.stream():
+            yield fast_json.dumps(result, default=str) + "\n"
+        yield fast_json.dumps({"done": True, **job.progress()}) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 # Advanced patent analysis with LangGraph
 @app.post("/api/analyze-patent-advanced")
 async def analyze_patent_advanced(request: AnalysisRequest):
     """使用 LangGraph 进行高级专利分析"""
     # Temporarily disabled for deployment
     raise HTTPException(status_code=503, detail="Advanced analysis temporarily unavailable")
+    await enforce_rate_limit(request.user_id, "analyze")
     try:
         # 1. 创建分析记录
         analysis = await db.create_analysis(
@@ -480,10 +905,45 @@ async def analyze_patent_advanced(request: AnalysisRequest):
         
     except Exception as e:
         logger.error(f"高级分析启动失败: {e}")
+        rate_limiter.refund(request.user_id, "analyze")
         if 'analysis_id' in locals():
             await db.update_analysis_status(analysis_id, "failed", str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
+# Resume an interrupted advanced analysis from its checkpoints
+@app.post("/api/analyze-patent-advanced/{analysis_id}/resume")
+async def resume_analysis_advanced(analysis_id: str):
+    """从检查点恢复高级分析：已完成的节点直接复用，从第一个未完成的节点继续
+
+    与高级分析接口一同停用（LangGraph工作流尚不能在部署环境中导入）；
+    标准分析使用 /api/analyze-patent/{analysis_id}/resume 恢复。
+    """
+    # Temporarily disabled for deployment
+    raise HTTPException(status_code=503, detail="Advanced analysis temporarily unavailable")
+    try:
+        analysis = await db.get_analysis(analysis_id)
+        if not analysis:
+            raise HTTPException(status_code=404, detail="分析不存在")
+        
+        from workflows.langgraph_analysis import patent_workflow
+        
+        import asyncio
+        await db.update_analysis_status(analysis_id, "processing")
+        report_cache.invalidate(analysis_id)
+        asyncio.create_task(patent_workflow.resume(analysis_id))
+        
+        return {
+            "analysis_id": analysis_id,
+            "status": "processing",
+            "completed_nodes": await analysis_checkpoints.completed_nodes(analysis_id),
+            "message": "高级专利分析已从检查点恢复"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"恢复高级分析失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Get analysis progress
 @app.get("/api/analysis/{analysis_id}/progress")
 async def get_analysis_progress(analysis_id: str):
@@ -514,6 +974,15 @@ async def get_analysis_progress(analysis_id: str):
         logger.error(f"获取进度失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Get analysis trace waterfall
+@app.get("/api/analysis/{analysis_id}/trace")
+async def get_analysis_trace(analysis_id: str):
+    """分析的span瀑布图：各阶段/节点与SerpAPI、Gemini、Supabase调用及排队的起止时间"""
+    waterfall = tracer.waterfall(analysis_id)
+    if waterfall is None:
+        raise HTTPException(status_code=404, detail="未找到该分析的追踪记录")
+    return waterfall
+
 # ========== 认证相关端点 ==========
 
 # 用户注册
@@ -537,6 +1006,11 @@ async def register(user_data: UserRegister):
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=result["message"]
             )
+    except HTTPException:
+        raise
+    except ExecutorOverloaded as e:
+        logger.warning(f"注册请求被限流: {e}")
+        raise _overloaded_response(e)
     except Exception as e:
         logger.error(f"注册失败: {e}")
         raise HTTPException(
@@ -568,6 +1042,11 @@ async def login(form_data: LoginRequest):
                 detail=result["message"],
                 headers={"WWW-Authenticate": "Bearer"},
             )
+    except HTTPException:
+        raise
+    except ExecutorOverloaded as e:
+        logger.warning(f"登录请求被限流: {e}")
+        raise _overloaded_response(e)
     except Exception as e:
         logger.error(f"登录失败: {e}")
         raise HTTPException(
@@ -0,0 +1,133 @@
+"""服务单例注册表
+
+db、serp、gemini、auth等客户端在首次使用时才构造：导入模块不再触发客户端构造，
+缺少某个服务的环境变量也只影响用到该服务的接口，不会让整个worker启动失败。
+模块级的全局实例是LazyService代理，调用方照常 `from services import serp` 使用；
+registry.override()可注入替代实现（如本地替身），所有引用同一代理的模块都会使用注入的实例。
+"""
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, Optional, List, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class LazyService:
+    """首次访问属性时才构造实例的代理"""
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_error", None)
+        object.__setattr__(self, "_init_seconds", None)
+        object.__setattr__(self, "_callbacks", [])
+        object.__setattr__(self, "_lock", threading.RLock())
+
+    def _resolve(self) -> Any:
+        instance = self._instance
+        if instance is not None:
+            return instance
+        with self._lock:
+            if self._instance is None:
+                started = time.perf_counter()
+                try:
+                    instance = self._factory()
+                except Exception as e:
+                    # 不缓存失败，配置修复后（如override）下次访问重新构造
+                    object.__setattr__(self, "_error", f"{type(e).__name__}: {e}")
+                    raise
+                object.__setattr__(self, "_init_seconds", time.perf_counter() - started)
+                object.__setattr__(self, "_error", None)
+                self._set(instance)
+            return self._instance
+
+    def _set(self, instance: Any):
+        object.__setattr__(self, "_instance", instance)
+        for callback in self._callbacks:
+            callback(instance)
+
+    def _when_ready(self, callback: Callable[[Any], None]):
+        with self._lock:
+            self._callbacks.append(callback)
+            if self._instance is not None:
+                callback(self._instance)
+
+    def __getattr__(self, item: str) -> Any:
+        return getattr(self._resolve(), item)
+
+    def __setattr__(self, key: str, value: Any):
+        setattr(self._resolve(), key, value)
+
+    def __repr__(self) -> str:
+        state = "ready" if self._instance is not None else "lazy"
+        return f"<LazyService {self._name} ({state})>"
+
+
+class ServiceRegistry:
+    """按名称管理延迟构造的服务单例，支持注入替代实例与启动预热"""
+
+    def __init__(self):
+        self._services: Dict[str, LazyService] = {}
+        self._warm_up: Dict[str, Dict[str, Any]] = {}
+
+    def register(self, name: str, factory: Callable[[], Any]) -> LazyService:
+        """登记服务并返回其代理（模块级全局实例）"""
+        service = LazyService(name, factory)
+        self._services[name] = service
+        return service
+
+    def get(self, name: str) -> Any:
+        """取实际实例，未构造时立即构造"""
+        return self._services[name]._resolve()
+
+    def override(self, name: str, instance: Any):
+        """注入替代实例（测试、本地替身），之后经代理的访问都落到该实例"""
+        self._services[name]._set(instance)
+
+    def when_ready(self, name: str, callback: Callable[[Any], None]):
+        """实例构造（或注入）后调用callback(instance)；已构造时立即调用"""
+        self._services[name]._when_ready(callback)
+
+    async def warm_up(self, names: Optional[List[str]] = None, timeout: float = 10.0) -> Dict[str, Dict[str, Any]]:
+        """在线程池中构造服务并调用其warm_up()（预建连接、预解析域名），失败只记录不抛出"""
+        loop = asyncio.get_running_loop()
+
+        def warm(name: str) -> Dict[str, Any]:
+            started = time.perf_counter()
+            try:
+                instance = self.get(name)
+                if hasattr(instance, "warm_up"):
+                    instance.warm_up()
+                return {"ok": True, "seconds": round(time.perf_counter() - started, 3)}
+            except Exception as e:
+                logger.warning(f"服务 {name} 预热失败: {e}")
+                return {"ok": False, "error": str(e), "seconds": round(time.perf_counter() - started, 3)}
+
+        names = names or list(self._services)
+        futures = [loop.run_in_executor(None, warm, name) for name in names]
+        done, _ = await asyncio.wait(futures, timeout=timeout)
+        for name, future in zip(names, futures):
+            self._warm_up[name] = future.result() if future in done else {"ok": False, "error": "timeout"}
+        logger.info(f"服务预热完成: {self._warm_up}")
+        return dict(self._warm_up)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """各服务的构造状态（/health）"""
+        result = {}
+        for name, service in self._services.items():
+            entry: Dict[str, Any] = {"ready": service._instance is not None}
+            if service._init_seconds is not None:
+                entry["init_seconds"] = round(service._init_seconds, 3)
+            if service._error:
+                entry["error"] = service._error
+            if name in self._warm_up:
+                entry["warm_up"] = self._warm_up[name]
+            result[name] = entry
+        return result
+
+
+# 创建全局实例
+registry = ServiceRegistry()
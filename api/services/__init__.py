@@ -1,5 +1,39 @@
 from .serp_service import serp, SerpService
 from .gemini_service_simple import gemini, GeminiService
 from .auth_service import auth, AuthService
+from .blocking_executor import auth_executor, token_executor, BlockingExecutor, ExecutorOverloaded
+from .rate_limiter import rate_limiter, RateLimiter, RateLimitExceeded
+from .prior_art_service import prior_art_search, PriorArtService
+from .embedding_ingestion import embedding_ingestor, EmbeddingIngestor
+from .vector_index import vector_index, PatentVectorIndex
+from .novelty_prescreen import novelty_prescreen, NoveltyPrescreen
+from .dedup_service import deduplicator, MinHashDeduplicator
+from .portfolio_scan import portfolio_scanner, PortfolioScanner
+from .upstream_governor import upstream_governor, UpstreamQuotaExceeded, upstream_lane
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .model_router import model_router, ModelRouter
+from .analysis_checkpoints import analysis_checkpoints, AnalysisCheckpointer
+from .batch_analysis import batch_analyzer, BatchAnalysisRunner
+from .tracing import tracer, Tracer
+from .http_cache import report_cache, CompletedReportCache
+from .idempotency import submissions, SubmissionCollapser, IdempotencyKeyReused
+from .search_cache_sweeper import search_cache_sweeper, SearchCacheSweeper
 
-__all__ = ['serp', 'SerpService', 'gemini', 'GeminiService', 'auth', 'AuthService']
\ No newline at end of file
+__all__ = ['serp', 'SerpService', 'gemini', 'GeminiService', 'auth', 'AuthService',
+           'auth_executor', 'token_executor', 'BlockingExecutor', 'ExecutorOverloaded',
+           'rate_limiter', 'RateLimiter', 'RateLimitExceeded',
+           'prior_art_search', 'PriorArtService',
+           'embedding_ingestor', 'EmbeddingIngestor',
+           'vector_index', 'PatentVectorIndex',
+           'novelty_prescreen', 'NoveltyPrescreen',
+           'deduplicator', 'MinHashDeduplicator',
+           'portfolio_scanner', 'PortfolioScanner',
+           'upstream_governor', 'UpstreamQuotaExceeded', 'upstream_lane',
+           'CircuitBreaker', 'CircuitOpenError',
+           'model_router', 'ModelRouter',
+           'analysis_checkpoints', 'AnalysisCheckpointer',
+           'batch_analyzer', 'BatchAnalysisRunner',
+           'tracer', 'Tracer',
+           'report_cache', 'CompletedReportCache',
+           'submissions', 'SubmissionCollapser', 'IdempotencyKeyReused',
+           'search_cache_sweeper', 'SearchCacheSweeper']
\ No newline at end of file
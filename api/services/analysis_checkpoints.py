@@ -0,0 +1,322 @@
+"""分析阶段检查点模块"""
+import os
+import json
+import time
+import asyncio
+import calendar
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, List, Callable, Awaitable
+from db import db
+from .serp_records import SearchRecord
+from .metrics import NODE_DURATION
+from .tracing import tracer
+import fast_json
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, SearchRecord):
+        return value.to_dict()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, "item"):  # numpy标量
+        return value.item()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return str(value)
+
+
+def to_jsonable(value: Any) -> Any:
+    """转换为可写入JSON/JSONB的普通结构"""
+    return fast_json.to_jsonable(value, default=_json_default)
+
+
+def fingerprint(inputs: Any) -> str:
+    """阶段输入指纹：输入内容相同则指纹相同
+
+    固定使用标准库编码：指纹需与已保存的检查点一致，切换编码器会让全部检查点失效。
+    """
+    payload = json.dumps(inputs, ensure_ascii=False, sort_keys=True, default=_json_default)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def field_fingerprints(inputs: Dict[str, Any]) -> Dict[str, str]:
+    """逐字段指纹，用于说明阶段为什么需要重新计算"""
+    return {key: fingerprint(value)[:16] for key, value in inputs.items()}
+
+
+class RecomputeDiff:
+    """一次分析中各阶段复用/重新计算的记录"""
+
+    def __init__(self):
+        self.reused: List[str] = []
+        self.recomputed: List[Dict[str, Any]] = []
+
+    def mark_reused(self, stage: str):
+        self.reused.append(stage)
+
+    def mark_recomputed(self, stage: str, changed_inputs: Optional[List[str]]):
+        """changed_inputs为None表示此前没有该阶段的检查点"""
+        self.recomputed.append({"stage": stage, "changed_inputs": changed_inputs})
+
+    def recomputed_stages(self) -> List[str]:
+        return [item["stage"] for item in self.recomputed]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"reused": list(self.reused), "recomputed": list(self.recomputed)}
+
+
+class LocalCheckpointBackend:
+    """本地文件检查点（单机开发或未建表时使用）"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _stage_path(self, scope: str, node: str, input_fingerprint: str) -> str:
+        scope_dir = hashlib.md5(scope.encode()).hexdigest()
+        return os.path.join(self.directory, scope_dir, f"{node}.{input_fingerprint[:32]}.json")
+
+    def _run_path(self, analysis_id: str) -> str:
+        return os.path.join(self.directory, "runs", f"{analysis_id}.json")
+
+    def _latest_path(self, scope: str, node: str) -> str:
+        scope_dir = hashlib.md5(scope.encode()).hexdigest()
+        return os.path.join(self.directory, scope_dir, f"{node}.latest.json")
+
+    async def get(self, scope: str, node: str, input_fingerprint: str) -> Optional[Dict[str, Any]]:
+        return self._read(self._stage_path(scope, node, input_fingerprint))
+
+    async def latest_input_fields(self, scope: str, node: str) -> Optional[Dict[str, str]]:
+        data = self._read(self._latest_path(scope, node))
+        return data["input_fields"] if data else None
+
+    async def put(self, scope: str, node: str, input_fingerprint: str, output: Dict[str, Any],
+                  analysis_id: Optional[str], input_fields: Dict[str, str]):
+        self._write(self._stage_path(scope, node, input_fingerprint), {
+            "output": output,
+            "analysis_id": analysis_id,
+            "created_at": datetime.utcnow().isoformat(),
+        })
+        self._write(self._latest_path(scope, node), {"input_fields": input_fields})
+        if analysis_id:
+            nodes = await self.completed_nodes(analysis_id)
+            if node not in nodes:
+                self._write(self._run_path(analysis_id), {"nodes": nodes + [node]})
+
+    async def completed_nodes(self, analysis_id: str) -> List[str]:
+        data = self._read(self._run_path(analysis_id))
+        return data["nodes"] if data else []
+
+    async def purge(self, before: datetime) -> int:
+        """删除修改时间早于before（UTC）的检查点文件"""
+        cutoff = calendar.timegm(before.timetuple())
+        deleted = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        deleted += 1
+                except FileNotFoundError:
+                    pass
+        return deleted
+
+    @staticmethod
+    def _read(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _write(path: str, data: Dict[str, Any]):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+class SupabaseCheckpointBackend:
+    """analysis_checkpoints表，多实例共享，进程重启后仍可恢复"""
+
+    def __init__(self, batch_size: int = 100, max_batches: int = 50):
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+
+    async def get(self, scope: str, node: str, input_fingerprint: str) -> Optional[Dict[str, Any]]:
+        return await db.get_analysis_checkpoint(scope, node, input_fingerprint)
+
+    async def latest_input_fields(self, scope: str, node: str) -> Optional[Dict[str, str]]:
+        row = await db.get_latest_analysis_checkpoint(scope, node)
+        return row["input_fields"] if row else None
+
+    async def put(self, scope: str, node: str, input_fingerprint: str, output: Dict[str, Any],
+                  analysis_id: Optional[str], input_fields: Dict[str, str]):
+        await db.save_analysis_checkpoint(scope, node, input_fingerprint, output, analysis_id, input_fields)
+
+    async def completed_nodes(self, analysis_id: str) -> List[str]:
+        rows = await db.list_analysis_checkpoints(analysis_id)
+        return [row["node"] for row in rows]
+
+    async def purge(self, before: datetime) -> int:
+        """按批删除created_at早于before的检查点，单次最多max_batches批"""
+        deleted = 0
+        for _ in range(self.max_batches):
+            count = await db.delete_expired_analysis_checkpoints(before.isoformat(), self.batch_size)
+            deleted += count
+            if count < self.batch_size:
+                break
+            await asyncio.sleep(0)
+        return deleted
+
+
+class AnalysisCheckpointer:
+    """按 (scope, 阶段, 输入指纹) 保存阶段输出
+
+    每个阶段完成后写入检查点；重跑时输入指纹未变的阶段直接复用输出，
+    因此失败或重启后重新运行会从第一个未完成（或输入已变化）的阶段继续；
+    用户修改发明内容后重新分析时，也只有输入受影响的阶段会重新计算。
+    检查点读写失败只记录日志，不影响分析本身。
+    超过ttl_days的检查点不再复用（重新计算后覆盖），后台任务每purge_interval秒删除过期检查点；
+    ttl_days为0时永久保留。
+    """
+
+    def __init__(self, backend, ttl_days: float = 30.0, purge_interval: float = 3600.0):
+        self.backend = backend
+        self.ttl_days = ttl_days
+        self.purge_interval = purge_interval
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "saved": 0, "errors": 0, "purged": 0}
+
+    def _cutoff(self) -> Optional[datetime]:
+        """早于该时间（UTC）创建的检查点视为过期"""
+        return datetime.utcnow() - timedelta(days=self.ttl_days) if self.ttl_days > 0 else None
+
+    async def lookup(self, scope: str, node: str, input_fingerprint: str) -> Optional[Dict[str, Any]]:
+        """返回已保存且未过期的阶段输出，没有时返回None"""
+        try:
+            record = await self.backend.get(scope, node, input_fingerprint)
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"读取分析检查点失败: {e}")
+            return None
+        cutoff = self._cutoff()
+        # 两种后端都以UTC的ISO格式保存created_at，按到秒的前缀比较
+        if record is not None and cutoff and str(record.get("created_at") or "")[:19] < cutoff.isoformat()[:19]:
+            self._stats["expired"] += 1
+            record = None
+        self._stats["hits" if record is not None else "misses"] += 1
+        return record["output"] if record is not None else None
+
+    async def changed_inputs(self, scope: str, node: str,
+                             input_fields: Dict[str, str]) -> Optional[List[str]]:
+        """与该阶段最近一次检查点相比发生变化的输入字段，没有历史时返回None"""
+        try:
+            previous = await self.backend.latest_input_fields(scope, node)
+        except Exception as e:
+            logger.error(f"读取分析检查点失败: {e}")
+            return None
+        if previous is None:
+            return None
+        return sorted(key for key in set(previous) | set(input_fields)
+                      if previous.get(key) != input_fields.get(key))
+
+    async def save(self, scope: str, node: str, input_fingerprint: str,
+                   output: Dict[str, Any], analysis_id: Optional[str] = None,
+                   input_fields: Optional[Dict[str, str]] = None):
+        """保存阶段输出"""
+        try:
+            await self.backend.put(scope, node, input_fingerprint, to_jsonable(output),
+                                   analysis_id, input_fields or {})
+            self._stats["saved"] += 1
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"保存分析检查点失败: {e}")
+
+    async def stage(self, scope: str, node: str, inputs: Dict[str, Any],
+                    compute: Callable[[], Awaitable[Dict[str, Any]]],
+                    analysis_id: Optional[str] = None,
+                    diff: Optional[RecomputeDiff] = None) -> Dict[str, Any]:
+        """输入未变化时复用阶段输出，否则调用compute()计算并保存"""
+        with tracer.span(node, "stage"):
+            started = time.perf_counter()
+            input_fingerprint = fingerprint(inputs)
+            saved = await self.lookup(scope, node, input_fingerprint)
+            if saved is not None:
+                if diff:
+                    diff.mark_reused(node)
+                tracer.set_attribute("reused", True)
+                NODE_DURATION.observe((node, "reused"), time.perf_counter() - started)
+                return saved
+
+            input_fields = field_fingerprints(inputs)
+            if diff:
+                diff.mark_recomputed(node, await self.changed_inputs(scope, node, input_fields))
+            output = await compute()
+            await self.save(scope, node, input_fingerprint, output, analysis_id, input_fields)
+            tracer.set_attribute("reused", False)
+            NODE_DURATION.observe((node, "computed"), time.perf_counter() - started)
+            return output
+
+    async def completed_nodes(self, analysis_id: str) -> List[str]:
+        """某次分析已完成并保存的阶段"""
+        try:
+            return await self.backend.completed_nodes(analysis_id)
+        except Exception as e:
+            logger.error(f"读取分析进度失败: {e}")
+            return []
+
+    async def purge(self) -> int:
+        """删除过期检查点，返回删除数量"""
+        cutoff = self._cutoff()
+        if cutoff is None:
+            return 0
+        deleted = await self.backend.purge(cutoff)
+        self._stats["purged"] += deleted
+        if deleted:
+            logger.info(f"清理过期分析检查点 {deleted} 条")
+        return deleted
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                await self.purge()
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"清理分析检查点失败: {e}")
+
+    def start(self):
+        """启动后台清理任务"""
+        if self.ttl_days > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """停止后台清理任务"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, backend=type(self.backend).__name__, ttl_days=self.ttl_days)
+
+
+def _create_backend():
+    """ANALYSIS_CHECKPOINT_BACKEND=db（默认）或 local"""
+    if os.getenv("ANALYSIS_CHECKPOINT_BACKEND", "db").lower() == "local":
+        return LocalCheckpointBackend(os.getenv("ANALYSIS_CHECKPOINT_DIR", ".analysis_checkpoints"))
+    return SupabaseCheckpointBackend()
+
+
+# 创建全局实例
+analysis_checkpoints = AnalysisCheckpointer(
+    _create_backend(),
+    ttl_days=float(os.getenv("ANALYSIS_CHECKPOINT_TTL_DAYS", "30")),
+    purge_interval=float(os.getenv("ANALYSIS_CHECKPOINT_PURGE_INTERVAL", "3600")),
+)
@@ -4,7 +4,9 @@ import logging
 from datetime import datetime, timedelta
 import jwt
 from passlib.context import CryptContext
-from db import db
+from db import supabase_db
+from .blocking_executor import auth_executor, token_executor, ExecutorOverloaded
+from service_registry import registry
 import os
 
 logger = logging.getLogger(__name__)
@@ -21,7 +23,8 @@ class AuthService:
     """认证服务封装"""
     
     def __init__(self):
-        self.db = db
+        # 认证依赖Supabase Auth，与DB_BACKEND无关
+        self.db = supabase_db
     
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
         """验证密码"""
@@ -55,7 +58,7 @@ class AuthService:
         """注册新用户"""
         try:
             # 使用Supabase Auth注册
-            result = self.db.client.auth.sign_up({
+            result = await auth_executor.run(self.db.client.auth.sign_up, {
                 "email": email,
                 "password": password,
                 "options": {
@@ -81,6 +84,8 @@ class AuthService:
                     "message": "注册失败"
                 }
                 
+        except ExecutorOverloaded:
+            raise
         except Exception as e:
             logger.error(f"用户注册失败: {e}")
             # 检查是否是邮箱已存在
@@ -95,7 +100,7 @@ class AuthService:
         """用户登录"""
         try:
             # 使用Supabase Auth登录
-            result = self.db.client.auth.sign_in_with_password({
+            result = await auth_executor.run(self.db.client.auth.sign_in_with_password, {
                 "email": email,
                 "password": password
             })
@@ -122,6 +127,8 @@ class AuthService:
                     "message": "邮箱或密码错误"
                 }
                 
+        except ExecutorOverloaded:
+            raise
         except Exception as e:
             logger.error(f"用户登录失败: {e}")
             return {
@@ -133,7 +140,7 @@ class AuthService:
         """用户登出"""
         try:
             # 使用Supabase Auth登出
-            self.db.client.auth.sign_out()
+            await auth_executor.run(self.db.client.auth.sign_out)
             # TODO: 可以将token加入黑名单
             return True
         except Exception as e:
@@ -152,8 +159,8 @@ class AuthService:
             if not user_id:
                 return None
             
-            # 获取用户信息
-            result = self.db.client.auth.get_user(token)
+            # 获取用户信息（令牌校验执行器，不与登录注册共用排队）
+            result = await token_executor.run(self.db.client.auth.get_user, token)
             if result.user:
                 return {
                     "user_id": result.user.id,
@@ -164,6 +171,8 @@ class AuthService:
             
             return None
             
+        except ExecutorOverloaded:
+            raise
         except Exception as e:
             logger.error(f"获取用户信息失败: {e}")
             return None
@@ -172,7 +181,7 @@ class AuthService:
         """请求重置密码"""
         try:
             # 发送重置密码邮件
-            self.db.client.auth.reset_password_for_email(email)
+            await auth_executor.run(self.db.client.auth.reset_password_for_email, email)
             
             return {
                 "success": True,
@@ -189,7 +198,7 @@ class AuthService:
         """更新密码"""
         try:
             # 更新密码
-            result = self.db.client.auth.update_user({
+            result = await auth_executor.run(self.db.client.auth.update_user, {
                 "password": new_password
             })
             
@@ -215,7 +224,7 @@ class AuthService:
         """创建用户订阅记录"""
         try:
             # 创建免费套餐订阅
-            self.db.client.table("user_subscriptions").insert({
+            query = self.db.client.table("user_subscriptions").insert({
                 "user_id": user_id,
                 "plan_type": "starter",
                 "status": "active",
@@ -223,9 +232,10 @@ class AuthService:
                 "monthly_analyses_used": 0,
                 "current_period_start": datetime.utcnow().isoformat(),
                 "current_period_end": (datetime.utcnow() + timedelta(days=30)).isoformat()
-            }).execute()
+            })
+            await auth_executor.run(query.execute)
         except Exception as e:
             logger.error(f"创建用户订阅失败: {e}")
 
-# 创建全局实例
-auth = AuthService()
\ No newline at end of file
+# 创建全局实例（首次使用时构造）
+auth = registry.register("auth", AuthService)
\ No newline at end of file
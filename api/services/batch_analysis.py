@@ -0,0 +1,279 @@
+"""批量专利分析模块"""
+import os
+import time
+import uuid
+import asyncio
+import logging
+from typing import Dict, Any, Optional, List, Callable, Awaitable, AsyncIterator, Tuple
+from .gemini_service_simple import gemini
+from .upstream_governor import upstream_lane, run_upstream, BATCH
+
+logger = logging.getLogger(__name__)
+
+
+class SharedSearches:
+    """批次内相同的检索只执行一次，并发条目共享同一个结果"""
+
+    def __init__(self):
+        self._results: Dict[str, asyncio.Future] = {}
+        self.calls = 0
+        self.reused = 0
+
+    async def get(self, key: str, func: Callable, *args) -> Any:
+        future = self._results.get(key)
+        if future is None:
+            self.calls += 1
+            future = asyncio.ensure_future(run_upstream(func, *args))
+            self._results[key] = future
+
+            def forget_failed(done: asyncio.Future):
+                # 失败的检索不保留，后续条目重新请求
+                if (done.cancelled() or done.exception()) and self._results.get(key) is done:
+                    del self._results[key]
+
+            future.add_done_callback(forget_failed)
+        else:
+            self.reused += 1
+        return await asyncio.shield(future)
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "reused": self.reused}
+
+
+class PromptBatcher:
+    """把短时间内到达的同组提示合并为一次调用，合并失败时逐条调用"""
+
+    def __init__(self, batch_call: Callable[[List[Any], Any], Awaitable[List[Any]]],
+                 single_call: Callable[[Any, Any], Awaitable[Any]],
+                 max_size: int = 5, max_wait: float = 0.5):
+        self.batch_call = batch_call
+        self.single_call = single_call
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._pending: Dict[Any, List[Tuple[Any, asyncio.Future]]] = {}
+        self._timers: Dict[Any, asyncio.TimerHandle] = {}
+        self._stats = {"prompts": 0, "items": 0, "fallbacks": 0}
+
+    async def submit(self, group: Any, item: Any) -> Any:
+        """提交一项，返回该项的结果；group相同（如同一套餐）的项才会合并"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(group, [])
+        pending.append((item, future))
+        if len(pending) >= self.max_size:
+            self._flush(group)
+        elif len(pending) == 1:
+            self._timers[group] = loop.call_later(self.max_wait, self._flush, group)
+        return await future
+
+    def _flush(self, group: Any):
+        timer = self._timers.pop(group, None)
+        if timer:
+            timer.cancel()
+        pending = self._pending.pop(group, None)
+        if pending:
+            asyncio.ensure_future(self._run(group, pending))
+
+    async def _run(self, group: Any, pending: List[Tuple[Any, asyncio.Future]]):
+        items = [item for item, _ in pending]
+        results: Optional[List[Any]] = None
+        if len(items) > 1:
+            try:
+                results = await self.batch_call(items, group)
+                self._stats["prompts"] += 1
+                self._stats["items"] += len(items)
+            except Exception as e:
+                self._stats["fallbacks"] += 1
+                logger.warning(f"合并提示失败，逐条调用: {e}")
+        if results is None:
+            results = await asyncio.gather(*(self.single_call(item, group) for item in items),
+                                           return_exceptions=True)
+
+        for (_, future), result in zip(pending, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+
+class BatchContext:
+    """一个批次内共享的检索与合并提示"""
+
+    def __init__(self, utility_batch_size: int = 5, batch_window: float = 0.5):
+        self.searches = SharedSearches()
+        # 实用性分析只依赖发明本身，适合把多项发明合并到一个提示中
+        self.utility = PromptBatcher(
+            lambda inventions, plan_type: gemini.analyze_patent_utility_batch(inventions, plan_type=plan_type),
+            lambda invention, plan_type: gemini.analyze_patent_utility(invention, plan_type=plan_type),
+            max_size=utility_batch_size,
+            max_wait=batch_window,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"searches": self.searches.stats(), "utility_prompts": self.utility.stats()}
+
+
+class BatchJob:
+    """一个批次的进度，结果按完成顺序追加"""
+
+    def __init__(self, batch_id: str, user_id: str, total: int, context: BatchContext):
+        self.batch_id = batch_id
+        self.user_id = user_id
+        self.total = total
+        self.context: Optional[BatchContext] = context
+        self.results: List[Dict[str, Any]] = []
+        self.status = "running"
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._shared_stats: Dict[str, Any] = {}
+        self._changed = asyncio.Condition()
+
+    async def add_result(self, result: Dict[str, Any]):
+        async with self._changed:
+            self.results.append(result)
+            self._changed.notify_all()
+
+    async def finish(self, status: str):
+        async with self._changed:
+            self.status = status
+            self.finished_at = time.time()
+            # 批次结束后释放共享检索结果，只保留统计
+            if self.context:
+                self._shared_stats = self.context.stats()
+                self.context = None
+            self._changed.notify_all()
+
+    async def stream(self) -> AsyncIterator[Dict[str, Any]]:
+        """先产出已完成的结果，再随新结果完成逐条产出，批次结束后停止"""
+        index = 0
+        while True:
+            while index < len(self.results):
+                yield self.results[index]
+                index += 1
+            if self.finished_at is not None:
+                return
+            async with self._changed:
+                await self._changed.wait_for(
+                    lambda: len(self.results) > index or self.finished_at is not None
+                )
+
+    def progress(self) -> Dict[str, Any]:
+        """批次汇总进度"""
+        completed = sum(1 for r in self.results if r["status"] == "completed")
+        done = len(self.results)
+        return {
+            "batch_id": self.batch_id,
+            "status": self.status,
+            "total": self.total,
+            "completed": completed,
+            "failed": done - completed,
+            "pending": self.total - done,
+            "progress": int(done / self.total * 100) if self.total else 100,
+            "elapsed_s": round((self.finished_at or time.time()) - self.created_at, 1),
+            "shared": self.context.stats() if self.context else self._shared_stats,
+        }
+
+
+class BatchAnalysisRunner:
+    """批量专利分析调度
+
+    所有批次共享一个全局并发上限，条目以BATCH优先级调用上游API（交互请求优先）。
+    批次内检索词相同的检索只执行一次，实用性分析按套餐合并提示；
+    结果按完成顺序追加，可随时查询汇总进度或以流的方式读取。
+    """
+
+    def __init__(self, concurrency: int = 4, max_items: int = 500, utility_batch_size: int = 5,
+                 batch_window: float = 0.5, retention: float = 3600.0):
+        self.concurrency = concurrency
+        self.max_items = max_items
+        self.utility_batch_size = utility_batch_size
+        self.batch_window = batch_window
+        self.retention = retention
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._jobs: Dict[str, BatchJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._running = 0
+
+    def submit(self, user_id: str, items: List[Any],
+               run: Callable[[Any, BatchContext], Awaitable[Dict[str, Any]]]) -> BatchJob:
+        """登记批次并在后台开始调度，run(item, context)负责单个条目的完整分析"""
+        self._expire()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        context = BatchContext(self.utility_batch_size, self.batch_window)
+        job = BatchJob(uuid.uuid4().hex, user_id, len(items), context)
+        self._jobs[job.batch_id] = job
+        # 任务创建时复制上下文，条目内的上游调用都走BATCH优先级
+        with upstream_lane(BATCH):
+            self._tasks[job.batch_id] = asyncio.ensure_future(self._run(job, items, run))
+        logger.info(f"批量分析 {job.batch_id} 已提交: {len(items)} 项")
+        return job
+
+    async def _run(self, job: BatchJob, items: List[Any],
+                   run: Callable[[Any, BatchContext], Awaitable[Dict[str, Any]]]):
+        async def analyze(index: int, item: Any):
+            async with self._semaphore:
+                self._running += 1
+                try:
+                    result = {"index": index, **(await run(item, job.context)), "status": "completed"}
+                except Exception as e:
+                    logger.error(f"批量分析 {job.batch_id} 第{index}项失败: {e}")
+                    result = {"index": index, "status": "failed", "error": str(e)}
+                finally:
+                    self._running -= 1
+            await job.add_result(result)
+
+        status = "completed"
+        try:
+            await asyncio.gather(*(analyze(i, item) for i, item in enumerate(items)))
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            self._tasks.pop(job.batch_id, None)
+            await job.finish(status)
+            logger.info(f"批量分析 {job.batch_id} 结束: {job.progress()}")
+
+    def get(self, batch_id: str) -> Optional[BatchJob]:
+        self._expire()
+        return self._jobs.get(batch_id)
+
+    def _expire(self):
+        """清理超过保留时间的已结束批次"""
+        now = time.time()
+        for batch_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > self.retention:
+                del self._jobs[batch_id]
+
+    async def stop(self):
+        """取消未完成的批次"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        active = [job for job in self._jobs.values() if job.finished_at is None]
+        pending = sum(job.total - len(job.results) for job in active)
+        return {
+            "concurrency": self.concurrency,
+            "active_batches": len(active),
+            "running_items": self._running,
+            "queued_items": pending - self._running,
+        }
+
+
+# 创建全局实例
+batch_analyzer = BatchAnalysisRunner(
+    concurrency=int(os.getenv("BATCH_ANALYSIS_CONCURRENCY", "4")),
+    max_items=int(os.getenv("BATCH_ANALYSIS_MAX_ITEMS", "500")),
+    utility_batch_size=int(os.getenv("BATCH_ANALYSIS_UTILITY_BATCH_SIZE", "5")),
+    batch_window=float(os.getenv("BATCH_ANALYSIS_BATCH_WINDOW", "0.5")),
+    retention=float(os.getenv("BATCH_ANALYSIS_RETENTION_SECONDS", "3600")),
+)
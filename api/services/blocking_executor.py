@@ -0,0 +1,128 @@
+"""阻塞任务执行器模块"""
+import os
+import time
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorOverloaded(Exception):
+    """执行器排队已满，请求被拒绝"""
+
+    def __init__(self, name: str, retry_after: int = 1):
+        super().__init__(f"{name}执行器繁忙，请稍后重试")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class BlockingExecutor:
+    """有界线程池，用于CPU密集或阻塞I/O的调用
+
+    独立于事件循环默认线程池，排队数超过上限时直接拒绝（负载削减），
+    避免登录高峰把分析请求所需的线程和事件循环一起拖垮。
+    """
+
+    def __init__(self, name: str, max_workers: int = 4, max_queue: int = 64):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix=f"{name}-executor")
+        self._lock = threading.Lock()
+        self._pending = 0  # 已提交未完成（排队+执行中）
+        self._running = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._max_depth = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        """排队等待执行的任务数"""
+        return max(self._pending - self._running, 0)
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在执行器中运行阻塞函数，排队已满时抛出ExecutorOverloaded"""
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise ExecutorOverloaded(self.name, retry_after=self._estimate_retry_after())
+            self._pending += 1
+            self._submitted += 1
+            self._max_depth = max(self._max_depth, self._pending - self._running)
+
+        enqueued_at = time.monotonic()
+
+        def _call():
+            started_at = time.monotonic()
+            with self._lock:
+                self._running += 1
+                self._total_wait += started_at - enqueued_at
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._total_run += time.monotonic() - started_at
+
+        future = self._executor.submit(_call)
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future: Future):
+        """线程中的任务结束后才释放名额；等待方被取消时，已在执行的任务仍占用名额直到结束"""
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+            if future.cancelled() or future.exception() is not None:
+                self._failed += 1
+
+    def _estimate_retry_after(self) -> int:
+        """按平均执行耗时估算排空队列所需秒数"""
+        done = max(self._completed, 1)
+        avg_run = self._total_run / done if self._completed else 0.2
+        return max(1, int(avg_run * self._pending / self.max_workers) + 1)
+
+    def stats(self) -> Dict[str, Any]:
+        """执行器指标"""
+        with self._lock:
+            done = max(self._completed, 1)
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queue_depth": max(self._pending - self._running, 0),
+                "max_queue_depth": self._max_depth,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._total_wait / done * 1000, 2),
+                "avg_run_ms": round(self._total_run / done * 1000, 2),
+            }
+
+    def shutdown(self):
+        """关闭线程池"""
+        self._executor.shutdown(wait=False)
+
+
+# 创建全局实例：注册、登录等Supabase Auth调用
+auth_executor = BlockingExecutor(
+    "auth",
+    max_workers=int(os.getenv("AUTH_EXECUTOR_WORKERS", "4")),
+    max_queue=int(os.getenv("AUTH_EXECUTOR_QUEUE", "64")),
+)
+
+# 每个已认证请求的令牌校验单独使用一个执行器，登录高峰被削减时不影响已登录用户
+token_executor = BlockingExecutor(
+    "auth_token",
+    max_workers=int(os.getenv("TOKEN_EXECUTOR_WORKERS", "4")),
+    max_queue=int(os.getenv("TOKEN_EXECUTOR_QUEUE", "256")),
+)
@@ -0,0 +1,122 @@
+"""上游服务熔断与延迟统计模块"""
+import time
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，直接拒绝调用"""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider}: 上游服务暂不可用")
+        self.provider = provider
+        self.reason = "上游服务暂不可用，请稍后重试"
+        self.retry_after = max(int(retry_after + 0.999), 1)
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后打开，冷却期内快速失败；冷却结束后半开，放行少量探测请求
+
+    探测成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._stats = {"opened": 0, "short_circuited": 0, "failures": 0}
+        self._last_error: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def before_call(self):
+        """调用前检查，熔断时抛出CircuitOpenError"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return
+            self._stats["short_circuited"] += 1
+            retry_after = self.recovery_timeout - (now - self._opened_at) if state == OPEN else 1.0
+            raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+
+    def record_failure(self, error: Optional[str] = None):
+        with self._lock:
+            self._stats["failures"] += 1
+            self._last_error = error
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self._stats["opened"] += 1
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        """熔断状态（/health）"""
+        return dict(self._stats, state=self.state, consecutive_failures=self._failures,
+                    last_error=self._last_error)
+
+
+class LatencyTracker:
+    """最近N次调用的延迟分位数，max_age秒之前的样本不计入"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20, max_age: Optional[float] = None):
+        self._samples: deque = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.max_age = max_age
+
+    def add(self, seconds: float):
+        self._samples.append((time.monotonic(), seconds))
+
+    def _expire(self):
+        if self.max_age is None:
+            return
+        cutoff = time.monotonic() - self.max_age
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    def quantile(self, q: float) -> Optional[float]:
+        """样本不足时返回None"""
+        self._expire()
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(seconds for _, seconds in self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def stats(self) -> Dict[str, Any]:
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        return {
+            "samples": len(self._samples),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
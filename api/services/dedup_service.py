@@ -0,0 +1,153 @@
+"""现有技术去重模块"""
+import re
+import zlib
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 专利公开号，如 CN112345678A、US10123456B2、WO2020123456A1
+_PATENT_NUMBER = re.compile(r"\b((?:CN|US|EP|WO|JP|KR|DE|GB|FR|TW)\d{5,}[A-Z]?\d?)\b", re.IGNORECASE)
+_KIND_CODE = re.compile(r"[A-Z]\d?$")
+_URL_NOISE = re.compile(r"^https?://(www\.)?|#.*$|/(en|zh|zh-cn|ja|ko|de|fr)/?$|/+$", re.IGNORECASE)
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def canonical_patent_id(result: Dict[str, Any]) -> Optional[str]:
+    """规范化专利号：忽略大小写与文献类型码（A/B1/B2等同族公开）"""
+    candidate = result.get("patent_id") or ""
+    match = _PATENT_NUMBER.search(candidate) or _PATENT_NUMBER.search(result.get("link") or "")
+    if not match:
+        return None
+    number = match.group(1).upper()
+    stripped = _KIND_CODE.sub("", number[2:])
+    return number[:2] + stripped
+
+
+def canonical_url(link: str) -> str:
+    """去掉协议、www、锚点、语言后缀与末尾斜杠"""
+    previous = None
+    link = link.strip().lower()
+    while previous != link:
+        previous = link
+        link = _URL_NOISE.sub("", link)
+    return link
+
+
+class MinHashDeduplicator:
+    """基于字符shingle的MinHash + LSH分桶近重复检测
+
+    标题和摘要按字符n-gram切分（兼容中文无空格文本），估计Jaccard相似度超过阈值即视为重复；
+    同一专利号或同一规范化URL直接判为重复。
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, shingle_size: int = 3,
+                 threshold: float = 0.7, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm必须能被bands整除")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        rng = np.random.default_rng(seed)
+        # 系数取31位以内，与32位shingle哈希相乘不会溢出uint64
+        self._a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.total_removed = 0
+
+    def _shingles(self, text: str) -> np.ndarray:
+        text = _NON_WORD.sub(" ", text.lower()).strip()
+        if len(text) <= self.shingle_size:
+            grams = {text} if text else set()
+        else:
+            grams = {text[i:i + self.shingle_size] for i in range(len(text) - self.shingle_size + 1)}
+        return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """MinHash签名，文本为空时返回None"""
+        shingles = self._shingles(text)
+        if not len(shingles):
+            return None
+        hashed = (np.outer(self._a, shingles) + self._b[:, None]) % _MERSENNE_PRIME
+        return hashed.min(axis=1)
+
+    def deduplicate(self, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """按出现顺序保留每组重复中的第一条，返回去重结果与移除数量"""
+        parent = list(range(len(results)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        def union(i: int, j: int):
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+
+        exact: Dict[str, int] = {}
+        buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        signatures: List[Optional[np.ndarray]] = []
+        for i, result in enumerate(results):
+            for key in (canonical_patent_id(result), canonical_url(result.get("link") or "")):
+                if not key:
+                    continue
+                if key in exact:
+                    union(i, exact[key])
+                else:
+                    exact[key] = i
+
+            signature = self.signature(f"{result.get('title', '')} {result.get('snippet', '')}")
+            signatures.append(signature)
+            if signature is None:
+                continue
+            for band in range(self.bands):
+                key = (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                candidates = buckets.setdefault(key, [])
+                for j in candidates:
+                    if find(i) != find(j) and self._similar(signature, signatures[j]):
+                        union(i, j)
+                candidates.append(i)
+
+        kept: List[Dict[str, Any]] = []
+        representative: Dict[int, Dict[str, Any]] = {}
+        for i, result in enumerate(results):
+            root = find(i)
+            if root == i:
+                representative[i] = result
+                kept.append(result)
+            else:
+                # 保留重复文献的链接，便于追溯
+                links = representative[root].setdefault("duplicate_links", [])
+                if result.get("link"):
+                    links.append(result["link"])
+
+        removed = len(results) - len(kept)
+        self.total_removed += removed
+        return kept, removed
+
+    def deduplicate_groups(self, groups: Dict[str, List[Dict[str, Any]]]) -> Tuple[Dict[str, List[Dict[str, Any]]], int]:
+        """跨来源去重：按groups顺序优先保留，结果仍按来源拆分返回"""
+        flattened, owners = [], []
+        for name, items in groups.items():
+            flattened.extend(items)
+            owners.extend([name] * len(items))
+        kept, removed = self.deduplicate(flattened)
+        kept_ids = {id(item) for item in kept}
+        output: Dict[str, List[Dict[str, Any]]] = {name: [] for name in groups}
+        for item, owner in zip(flattened, owners):
+            if id(item) in kept_ids:
+                output[owner].append(item)
+        return output, removed
+
+    def _similar(self, a: np.ndarray, b: Optional[np.ndarray]) -> bool:
+        return b is not None and float(np.mean(a == b)) >= self.threshold
+
+
+# 创建全局实例
+deduplicator = MinHashDeduplicator()
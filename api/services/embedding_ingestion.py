@@ -0,0 +1,158 @@
+"""专利向量入库服务模块"""
+import os
+import asyncio
+import logging
+from collections import deque, OrderedDict
+from typing import Dict, Any, List, Optional
+from db import db
+from .gemini_service_simple import gemini
+from .vector_index import vector_index
+from .upstream_governor import run_batch
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingIngestor:
+    """后台批量入库：收集搜索得到的专利结果，批量生成向量后写入patent_embeddings
+
+    submit() 只做内存追加，可以在任意线程中调用，不会阻塞搜索请求。
+    """
+
+    def __init__(self, batch_size: int = 50, flush_interval: float = 5.0,
+                 max_buffer: int = 5000, seen_capacity: int = 50000):
+        self.enabled = os.getenv("EMBEDDING_INGESTION_ENABLED", "true").lower() != "false"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: deque = deque(maxlen=max_buffer)
+        # 最近已处理的专利号，避免重复查询数据库
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._seen_capacity = seen_capacity
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "submitted": 0,
+            "duplicates": 0,
+            "dropped": 0,
+            "embedded": 0,
+            "upserted": 0,
+            "failed": 0,
+        }
+
+    def submit(self, results: List[Dict[str, Any]]):
+        """提交搜索结果，仅保留带patent_id的专利"""
+        if not self.enabled:
+            return
+        for result in results:
+            patent_id = result.get("patent_id")
+            if not patent_id or not result.get("title"):
+                continue
+            if patent_id in self._seen:
+                self._stats["duplicates"] += 1
+                continue
+            if len(self._buffer) == self._buffer.maxlen:
+                self._stats["dropped"] += 1
+            self._buffer.append(result)
+            self._stats["submitted"] += 1
+
+    async def flush(self):
+        """处理缓冲区中的全部结果"""
+        while self._buffer:
+            batch = self._take_batch()
+            if batch:
+                await self._ingest(batch)
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        """取出一批并在批内按patent_id去重"""
+        batch: Dict[str, Dict[str, Any]] = {}
+        while self._buffer and len(batch) < self.batch_size:
+            result = self._buffer.popleft()
+            patent_id = result["patent_id"]
+            if patent_id in batch or patent_id in self._seen:
+                self._stats["duplicates"] += 1
+                continue
+            batch[patent_id] = result
+        return list(batch.values())
+
+    async def _ingest(self, batch: List[Dict[str, Any]]):
+        """跳过已入库的专利，批量生成向量并写入"""
+        try:
+            existing = await db.get_existing_patent_ids([r["patent_id"] for r in batch])
+            pending = [r for r in batch if r["patent_id"] not in existing]
+            self._stats["duplicates"] += len(batch) - len(pending)
+            for r in batch:
+                self._remember(r["patent_id"])
+            if not pending:
+                return
+
+            texts = [self._document_text(r) for r in pending]
+            embeddings = await run_batch(gemini.batch_embed_contents, texts)
+            self._stats["embedded"] += len(embeddings)
+
+            rows = [self._to_row(result, embedding)
+                    for result, embedding in zip(pending, embeddings) if embedding]
+            self._stats["upserted"] += await db.upsert_patent_embeddings(rows)
+            if vector_index.enabled:
+                vector_index.index.add(rows)
+                await vector_index.index.rebuild_ivf()
+        except Exception as e:
+            self._stats["failed"] += len(batch)
+            # 失败的专利允许后续搜索再次提交
+            for r in batch:
+                self._seen.pop(r["patent_id"], None)
+            logger.error(f"专利向量入库失败: {e}")
+
+    def _remember(self, patent_id: str):
+        self._seen[patent_id] = None
+        self._seen.move_to_end(patent_id)
+        if len(self._seen) > self._seen_capacity:
+            self._seen.popitem(last=False)
+
+    @staticmethod
+    def _document_text(result: Dict[str, Any]) -> str:
+        return f"{result.get('title', '')}\n{result.get('snippet', '')}".strip()
+
+    @staticmethod
+    def _to_row(result: Dict[str, Any], embedding: List[float]) -> Dict[str, Any]:
+        metadata = {"link": result.get("link", ""), "source": "serp"}
+        if result.get("assignee"):
+            metadata["assignee"] = result["assignee"]
+        return {
+            "patent_id": result["patent_id"],
+            "title": result.get("title", ""),
+            "abstract": result.get("snippet", ""),
+            "embedding": embedding,
+            "metadata": metadata,
+        }
+
+    async def _run(self):
+        while True:
+            if len(self._buffer) < self.batch_size:
+                await asyncio.sleep(self.flush_interval)
+            try:
+                batch = self._take_batch()
+                if batch:
+                    await self._ingest(batch)
+            except Exception as e:
+                logger.error(f"专利向量入库任务异常: {e}")
+
+    def start(self):
+        """启动后台入库任务"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务并写入剩余结果"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """入库指标"""
+        return dict(self._stats, buffered=len(self._buffer))
+
+
+# 创建全局实例
+embedding_ingestor = EmbeddingIngestor(
+    batch_size=int(os.getenv("EMBEDDING_INGESTION_BATCH_SIZE", "50")),
+    flush_interval=float(os.getenv("EMBEDDING_INGESTION_FLUSH_SECONDS", "5")),
+)
@@ -2,9 +2,11 @@
 import os
 from typing import Dict, Any, List, Optional
 import logging
-import google.generativeai as genai
 from datetime import datetime
 import json
+from service_registry import LazyService
+import fast_json
+from .model_router import model_router, NOVELTY, INVENTIVENESS, UTILITY, REPORT, FEATURE_EXTRACTION
 
 logger = logging.getLogger(__name__)
 
@@ -16,8 +18,21 @@ class GeminiService:
         if not api_key:
             raise ValueError("GEMINI_API_KEY必须配置")
         
+        # google.generativeai导入较慢，推迟到首次构造
+        import google.generativeai as genai
+        self._genai = genai
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        # 每个模型一个实例，按阶段由model_router选择
+        self._models: Dict[str, Any] = {}
+    
+    def _generate(self, stage: str, prompt: str):
+        """按分析阶段路由模型并生成内容"""
+        model_name = model_router.select(stage)
+        model = self._models.get(model_name)
+        if model is None:
+            model = self._models[model_name] = self._genai.GenerativeModel(model_name)
+        with model_router.track(stage, model_name):
+            return model.generate_content(prompt)
     
     async def analyze_patent_novelty(self, invention_info: Dict[str, Any], 
                                    prior_art: List[Dict[str, Any]]) -> Dict[str, Any]:
@@ -44,7 +59,7 @@ class GeminiService:
             请以JSON格式返回分析结果。
             """
             
-            response = self.model.generate_content(prompt)
+            response = self._generate(NOVELTY, prompt)
             result = self._parse_response(response.text)
             
             return {
@@ -70,7 +85,7 @@ class GeminiService:
             - 技术方案：{invention_info.get('technical_content', '')}
             
             新颖性分析结果：
-            {json.dumps(novelty_analysis.get('analysis', {}), ensure_ascii=False, indent=2)}
+            {fast_json.dumps(novelty_analysis.get('analysis', {}), indent=True)}
             
             请从以下方面进行创造性分析：
             1. 最接近的现有技术
@@ -82,7 +97,7 @@ class GeminiService:
             请以JSON格式返回分析结果。
             """
             
-            response = self.model.generate_content(prompt)
+            response = self._generate(INVENTIVENESS, prompt)
             result = self._parse_response(response.text)
             
             return {
@@ -116,7 +131,7 @@ class GeminiService:
             请以JSON格式返回分析结果。
             """
             
-            response = self.model.generate_content(prompt)
+            response = self._generate(UTILITY, prompt)
             result = self._parse_response(response.text)
             
             return {
@@ -136,9 +151,9 @@ class GeminiService:
             基于以下专利分析结果，生成一份专业的专利分析报告。
             
             分析结果：
-            - 新颖性分析：{json.dumps(analysis_results.get('novelty', {}), ensure_ascii=False)}
-            - 创造性分析：{json.dumps(analysis_results.get('inventiveness', {}), ensure_ascii=False)}
-            - 实用性分析：{json.dumps(analysis_results.get('utility', {}), ensure_ascii=False)}
+            - 新颖性分析：{fast_json.dumps(analysis_results.get('novelty', {}))}
+            - 创造性分析：{fast_json.dumps(analysis_results.get('inventiveness', {}))}
+            - 实用性分析：{fast_json.dumps(analysis_results.get('utility', {}))}
             
             请生成包含以下部分的报告：
             1. 执行摘要
@@ -152,7 +167,7 @@ class GeminiService:
             报告应该专业、清晰、有说服力。请以JSON格式返回。
             """
             
-            response = self.model.generate_content(prompt)
+            response = self._generate(REPORT, prompt)
             result = self._parse_response(response.text)
             
             return {
@@ -184,7 +199,7 @@ class GeminiService:
             请以JSON格式返回，包含features数组。
             """
             
-            response = self.model.generate_content(prompt)
+            response = self._generate(FEATURE_EXTRACTION, prompt)
             result = self._parse_response(response.text)
             
             return result.get("features", [])
@@ -273,5 +288,5 @@ class GeminiService:
         else:
             return "建议进一步研发后再考虑申请"
 
-# 创建全局实例
-gemini = GeminiService()
\ No newline at end of file
+# 创建全局实例（首次使用时构造）
+gemini = LazyService("gemini_sdk", GeminiService)
\ No newline at end of file
@@ -5,6 +5,12 @@ import logging
 import requests
 import json
 from datetime import datetime
+from .upstream_governor import upstream_governor, run_upstream
+from .model_router import model_router, MODEL_PRICES, NOVELTY, INVENTIVENESS, UTILITY, REPORT
+from .metrics import LLM_TOKENS, UPSTREAM_COST
+from .tracing import tracer
+from service_registry import registry
+import fast_json
 
 logger = logging.getLogger(__name__)
 
@@ -16,9 +22,20 @@ class GeminiService:
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY必须配置")
         
-        self.base_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
+        # 模型由model_router按分析阶段与套餐选择
+        self.generate_url = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+        # 768维向量，与patent_embeddings.embedding列一致
+        self.embedding_url = "https://generativelanguage.googleapis.com/v1beta/models/text-embedding-004:embedContent"
+        # 上游限速、月度预算与429退避
+        self.governor = upstream_governor.provider("gemini")
+        # 生成请求超过p95仍未返回时补发一份（幂等，先到者生效）
+        self.hedge_requests = os.getenv("GEMINI_HEDGE_REQUESTS", "false").lower() == "true"
     
-    def _make_request(self, prompt: str) -> Dict[str, Any]:
+    def warm_up(self):
+        """启动预热：预先建立到Gemini API的连接"""
+        self.governor.warm_up(self.generate_url)
+    
+    def _make_request(self, prompt: str, model: str) -> Dict[str, Any]:
         """发送请求到Gemini API"""
         headers = {
             "Content-Type": "application/json",
@@ -32,20 +49,26 @@ class GeminiService:
             }]
         }
         
-        url = f"{self.base_url}?key={self.api_key}"
+        url = f"{self.generate_url.format(model=model)}?key={self.api_key}"
         
         try:
-            response = requests.post(url, headers=headers, json=data)
+            response = self.governor.request("POST", url, hedge=self.hedge_requests, headers=headers,
+                                             data=fast_json.dumps_bytes(data))
             response.raise_for_status()
-            return response.json()
+            return fast_json.loads(response.content)
         except requests.exceptions.RequestException as e:
             logger.error(f"Gemini API请求失败: {e}")
             raise
     
-    def generate_content(self, prompt: str) -> str:
-        """生成内容的简单方法"""
+    def generate_content(self, prompt: str, stage: Optional[str] = None,
+                         plan_type: Optional[str] = None, model: Optional[str] = None) -> str:
+        """生成内容的简单方法，未指定model时按阶段与套餐路由"""
+        model = model or model_router.select(stage, plan_type)
         try:
-            response = self._make_request(prompt)
+            with tracer.span("gemini.generate", "gemini", model=model, stage=stage):
+                with model_router.track(stage, model):
+                    response = self._make_request(prompt, model)
+                self._record_usage(model, response.get("usageMetadata") or {})
             # 提取生成的文本
             if "candidates" in response and response["candidates"]:
                 content = response["candidates"][0].get("content", {})
@@ -57,8 +80,68 @@ class GeminiService:
             logger.error(f"内容生成失败: {e}")
             raise
     
+    @staticmethod
+    def _record_usage(model: str, usage: Dict[str, Any]):
+        """按响应中的usageMetadata累计token与估算成本"""
+        prompt_tokens = usage.get("promptTokenCount", 0)
+        output_tokens = usage.get("candidatesTokenCount", 0)
+        LLM_TOKENS.inc((model, "prompt"), prompt_tokens)
+        LLM_TOKENS.inc((model, "completion"), output_tokens)
+        tracer.set_attribute("prompt_tokens", prompt_tokens)
+        tracer.set_attribute("completion_tokens", output_tokens)
+        price_in, price_out = MODEL_PRICES.get(model, (0.0, 0.0))
+        UPSTREAM_COST.inc(("gemini", model), (prompt_tokens * price_in + output_tokens * price_out) / 1e6)
+    
+    def embed_content(self, text: str, task_type: str = "RETRIEVAL_QUERY") -> List[float]:
+        """生成文本向量"""
+        data = {
+            "model": "models/text-embedding-004",
+            "content": {"parts": [{"text": text}]},
+            "taskType": task_type
+        }
+        
+        url = f"{self.embedding_url}?key={self.api_key}"
+        
+        try:
+            with tracer.span("gemini.embed", "gemini"):
+                response = self.governor.request("POST", url, headers={"Content-Type": "application/json"},
+                                                 data=fast_json.dumps_bytes(data))
+                response.raise_for_status()
+            return fast_json.loads(response.content).get("embedding", {}).get("values", [])
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Gemini向量生成失败: {e}")
+            raise
+    
+    def batch_embed_contents(self, texts: List[str],
+                             task_type: str = "RETRIEVAL_DOCUMENT") -> List[List[float]]:
+        """批量生成文本向量（单次请求最多100条）"""
+        url = f"{self.embedding_url.replace(':embedContent', ':batchEmbedContents')}?key={self.api_key}"
+        embeddings: List[List[float]] = []
+        
+        for start in range(0, len(texts), 100):
+            data = {
+                "requests": [{
+                    "model": "models/text-embedding-004",
+                    "content": {"parts": [{"text": text}]},
+                    "taskType": task_type
+                } for text in texts[start:start + 100]]
+            }
+            
+            try:
+                with tracer.span("gemini.batch_embed", "gemini", count=len(data["requests"])):
+                    response = self.governor.request("POST", url, headers={"Content-Type": "application/json"},
+                                                     data=fast_json.dumps_bytes(data))
+                    response.raise_for_status()
+                embeddings.extend(e.get("values", []) for e in fast_json.loads(response.content).get("embeddings", []))
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Gemini批量向量生成失败: {e}")
+                raise
+        
+        return embeddings
+    
     async def analyze_patent_novelty(self, invention_info: Dict[str, Any], 
-                                   prior_art: List[Dict[str, Any]]) -> Dict[str, Any]:
+                                   prior_art: List[Dict[str, Any]],
+                                   plan_type: Optional[str] = None) -> Dict[str, Any]:
         """分析专利新颖性"""
         try:
             prompt = f"""
@@ -82,12 +165,14 @@ class GeminiService:
             请以JSON格式返回分析结果。
             """
             
-            response_text = self.generate_content(prompt)
+            model = model_router.select(NOVELTY, plan_type)
+            response_text = await run_upstream(self.generate_content, prompt, NOVELTY, plan_type, model)
             result = self._parse_response(response_text)
             
             return {
                 "analysis": result,
                 "score": 0.75,  # 简化评分
+                "model": model,
                 "timestamp": datetime.utcnow().isoformat()
             }
             
@@ -96,7 +181,8 @@ class GeminiService:
             raise
     
     async def analyze_patent_inventiveness(self, invention_info: Dict[str, Any],
-                                         novelty_analysis: Dict[str, Any]) -> Dict[str, Any]:
+                                         novelty_analysis: Dict[str, Any],
+                                         plan_type: Optional[str] = None) -> Dict[str, Any]:
         """分析专利创造性"""
         try:
             prompt = f"""
@@ -117,12 +203,14 @@ class GeminiService:
             请以JSON格式返回分析结果。
             """
             
-            response_text = self.generate_content(prompt)
+            model = model_router.select(INVENTIVENESS, plan_type)
+            response_text = await run_upstream(self.generate_content, prompt, INVENTIVENESS, plan_type, model)
             result = self._parse_response(response_text)
             
             return {
                 "analysis": result,
                 "score": 0.7,  # 简化评分
+                "model": model,
                 "timestamp": datetime.utcnow().isoformat()
             }
             
@@ -130,7 +218,8 @@ class GeminiService:
             logger.error(f"创造性分析失败: {e}")
             raise
     
-    async def analyze_patent_utility(self, invention_info: Dict[str, Any]) -> Dict[str, Any]:
+    async def analyze_patent_utility(self, invention_info: Dict[str, Any],
+                                     plan_type: Optional[str] = None) -> Dict[str, Any]:
         """分析专利实用性"""
         try:
             prompt = f"""
@@ -151,12 +240,14 @@ class GeminiService:
             请以JSON格式返回分析结果。
             """
             
-            response_text = self.generate_content(prompt)
+            model = model_router.select(UTILITY, plan_type)
+            response_text = await run_upstream(self.generate_content, prompt, UTILITY, plan_type, model)
             result = self._parse_response(response_text)
             
             return {
                 "analysis": result,
                 "score": 0.85,  # 简化评分
+                "model": model,
                 "timestamp": datetime.utcnow().isoformat()
             }
             
@@ -164,20 +255,63 @@ class GeminiService:
             logger.error(f"实用性分析失败: {e}")
             raise
     
-    async def generate_patent_report(self, analysis_results: Dict[str, Any]) -> Dict[str, Any]:
+    async def analyze_patent_utility_batch(self, inventions: List[Dict[str, Any]],
+                                           plan_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """在一次请求中分析多项发明的实用性，结果数量与输入不一致时抛出ValueError"""
+        items = "\n".join(
+            f"""
+            发明{i}：
+            - 名称：{info.get('title', '')}
+            - 技术领域：{info.get('technical_field', '')}
+            - 技术方案：{info.get('technical_content', '')}
+            """
+            for i, info in enumerate(inventions, 1)
+        )
+        prompt = f"""
+            作为专利分析专家，请分别分析以下{len(inventions)}项发明的实用性。
+            {items}
+            对每项发明从以下方面进行实用性分析：
+            1. 工业应用可行性
+            2. 技术方案的完整性
+            3. 实施难度评估
+            4. 预期技术效果
+            5. 实用性评估（高/中/低）
+            
+            请以JSON数组返回，按发明顺序每项一个对象，数组长度必须为{len(inventions)}。
+            """
+        
+        model = model_router.select(UTILITY, plan_type)
+        response_text = await run_upstream(self.generate_content, prompt, UTILITY, plan_type, model)
+        results = self._parse_list_response(response_text)
+        if len(results) != len(inventions):
+            raise ValueError(f"批量实用性分析返回{len(results)}项，应为{len(inventions)}项")
+        
+        timestamp = datetime.utcnow().isoformat()
+        return [{
+            "analysis": result if isinstance(result, dict) else {"content": result},
+            "score": 0.85,  # 简化评分
+            "model": model,
+            "batched": len(inventions),
+            "timestamp": timestamp
+        } for result in results]
+    
+    async def generate_patent_report(self, analysis_results: Dict[str, Any],
+                                     plan_type: Optional[str] = None) -> Dict[str, Any]:
         """生成专利分析报告"""
         try:
             prompt = f"""
             基于以下专利分析结果，生成一份简洁的专利分析报告摘要。
             
             新颖性得分：{analysis_results.get('novelty', {}).get('score', 0)}
+            新颖性预筛得分（与现有技术的向量相似度校准）：{(analysis_results.get('novelty', {}).get('prescreen') or {}).get('score', 'N/A')}
             创造性得分：{analysis_results.get('inventiveness', {}).get('score', 0)}
             实用性得分：{analysis_results.get('utility', {}).get('score', 0)}
             
             请生成包含执行摘要、主要发现和建议的报告。
             """
             
-            response_text = self.generate_content(prompt)
+            model = model_router.select(REPORT, plan_type)
+            response_text = await run_upstream(self.generate_content, prompt, REPORT, plan_type, model)
             
             overall_score = (
                 analysis_results.get('novelty', {}).get('score', 0) * 0.4 +
@@ -189,6 +323,7 @@ class GeminiService:
                 "report": {"summary": response_text},
                 "overall_score": overall_score,
                 "recommendation": "建议申请专利" if overall_score > 0.6 else "建议改进后申请",
+                "model": model,
                 "timestamp": datetime.utcnow().isoformat()
             }
             
@@ -203,6 +338,17 @@ class GeminiService:
             formatted.append(f"{i}. {art.get('title', 'Unknown')}")
         return "\n".join(formatted)
     
+    def _parse_list_response(self, response_text: str) -> List[Any]:
+        """解析JSON数组响应（允许```json代码块包裹），无法解析时返回空列表"""
+        text = response_text.strip()
+        if text.startswith("```"):
+            text = text.split("\n", 1)[-1].rsplit("```", 1)[0]
+        try:
+            result = json.loads(text)
+        except ValueError:
+            return []
+        return result if isinstance(result, list) else []
+    
     def _parse_response(self, response_text: str) -> Dict[str, Any]:
         """解析响应"""
         try:
@@ -210,5 +356,5 @@ class GeminiService:
         except:
             return {"content": response_text}
 
-# 创建全局实例
-gemini = GeminiService()
\ No newline at end of file
+# 创建全局实例（首次使用时构造）
+gemini = registry.register("gemini", GeminiService)
\ No newline at end of file
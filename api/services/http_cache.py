@@ -0,0 +1,239 @@
+"""HTTP缓存与压缩模块
+
+已完成的分析不再变化：按分析与各报告的版本字段生成强ETag，条件请求返回304；
+完成的分析整体序列化一次并预先压缩（gzip，安装brotli时另存br），之后的请求直接返回缓存的字节。
+其余较大的响应由CompressionMiddleware按Accept-Encoding即时压缩。
+"""
+import os
+import gzip
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+import fast_json
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Accept-Encoding -> {编码: q值}"""
+    accepted: Dict[str, float] = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header: Optional[str], available: Tuple[str, ...]) -> str:
+    """按客户端q值（相同时按available顺序）选择压缩编码，都不接受时返回identity"""
+    accepted = parse_accept_encoding(header)
+    best, best_q = "identity", 0.0
+    for coding in available:
+        q = accepted.get(coding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, precompressed: bool = False) -> bytes:
+    """预压缩（只做一次）用最高压缩级别，即时压缩用较快的级别"""
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if precompressed else 4)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=9 if precompressed else 6)
+    return body
+
+
+def available_encodings() -> Tuple[str, ...]:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def analysis_etag(analysis: Dict[str, Any], reports: List[Dict[str, Any]]) -> str:
+    """由分析记录与各报告的版本字段生成强ETag（不依赖报告内容，可只查版本字段计算）"""
+    parts = [str(analysis.get("id")), str(analysis.get("status")), str(analysis.get("updated_at"))]
+    for report in sorted(reports, key=lambda r: (str(r.get("report_type")), str(r.get("id")))):
+        parts.append("|".join(str(report.get(key)) for key in ("id", "report_type", "created_at", "score")))
+    return '"' + hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match使用弱比较：忽略W/前缀与按编码追加的后缀"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    base = etag.strip('"')
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        if tag == base or tag.startswith(base + "-"):
+            return True
+    return False
+
+
+def _encoded_etag(etag: str, encoding: str) -> str:
+    # 强ETag区分表示：压缩后的字节不同，ETag也要不同
+    return etag if encoding == "identity" else f'{etag[:-1]}-{encoding}"'
+
+
+class CachedReport:
+    """一份已完成分析的序列化结果及其预压缩版本"""
+
+    __slots__ = ("analysis_id", "user_id", "etag", "bodies", "size")
+
+    def __init__(self, analysis_id: str, user_id: Optional[str], etag: str, bodies: Dict[str, bytes]):
+        self.analysis_id = analysis_id
+        self.user_id = user_id
+        self.etag = etag
+        self.bodies = bodies
+        self.size = sum(len(body) for body in bodies.values())
+
+
+class CompletedReportCache:
+    """已完成分析的响应缓存（按字节数LRU淘汰）"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_age: int = 86400, min_compress_size: int = 1024):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_compress_size = min_compress_size
+        self._entries: "OrderedDict[str, CachedReport]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "not_modified": 0, "stores": 0, "evictions": 0}
+
+    @property
+    def cache_control(self) -> str:
+        # 分析结果属于用户私有数据，只允许浏览器缓存
+        return f"private, max-age={self.max_age}, immutable"
+
+    def get(self, analysis_id: str) -> Optional[CachedReport]:
+        with self._lock:
+            entry = self._entries.get(analysis_id)
+            if entry is not None:
+                self._entries.move_to_end(analysis_id)
+            return entry
+
+    def put(self, analysis: Dict[str, Any], etag: str) -> CachedReport:
+        """序列化并预压缩；只应传入已完成的分析"""
+        body = fast_json.dumps_bytes(analysis)
+        bodies = {"identity": body}
+        if len(body) >= self.min_compress_size:
+            for encoding in available_encodings():
+                bodies[encoding] = compress(body, encoding, precompressed=True)
+        entry = CachedReport(str(analysis["id"]), analysis.get("user_id"), etag, bodies)
+        if entry.size > self.max_bytes:
+            return entry
+        with self._lock:
+            previous = self._entries.pop(entry.analysis_id, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[entry.analysis_id] = entry
+            self._bytes += entry.size
+            self._stats["stores"] += 1
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self._stats["evictions"] += 1
+        return entry
+
+    def invalidate(self, analysis_id: str):
+        with self._lock:
+            entry = self._entries.pop(analysis_id, None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    def respond(self, entry: CachedReport, if_none_match: Optional[str],
+                accept_encoding: Optional[str], hit: bool = True) -> Response:
+        """按条件请求与Accept-Encoding返回304或对应编码的缓存字节"""
+        headers = {"Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        encoding = choose_encoding(accept_encoding, tuple(e for e in available_encodings() if e in entry.bodies))
+        headers["ETag"] = _encoded_etag(entry.etag, encoding)
+        if etag_matches(if_none_match, entry.etag):
+            self._stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        if hit:
+            self._stats["hits"] += 1
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(entry.bodies[encoding], media_type="application/json", headers=headers)
+
+    def not_modified(self, etag: str) -> Response:
+        """未读取报告内容时（只比较了版本字段）返回304"""
+        self._stats["not_modified"] += 1
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": self.cache_control,
+                                                  "Vary": "Accept-Encoding"})
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, entries=len(self._entries), bytes=self._bytes,
+                    encodings=list(available_encodings()))
+
+
+class CompressionMiddleware:
+    """按Accept-Encoding压缩完整的较大响应（纯ASGI中间件）
+
+    已设置Content-Encoding的响应（如预压缩的报告）与流式响应（NDJSON逐行推送）原样转发。
+    """
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"), available_encodings())
+        if encoding == "identity":
+            return await self.app(scope, receive, send)
+
+        start_message: Dict[str, Any] = {}
+        state = {"passthrough": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                start_message.update(message)
+                state["passthrough"] = "content-encoding" in Headers(raw=message["headers"])
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+            if start_message:
+                body = message.get("body", b"")
+                if (not state["passthrough"] and not message.get("more_body", False)
+                        and len(body) >= self.minimum_size):
+                    body = compress(body, encoding)
+                    headers = MutableHeaders(raw=start_message["headers"])
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    headers.add_vary_header("Accept-Encoding")
+                    message = dict(message, body=body)
+                await send(dict(start_message))
+                start_message.clear()
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# 创建全局实例
+report_cache = CompletedReportCache(
+    max_bytes=int(float(os.getenv("REPORT_CACHE_MAX_MB", "64")) * 1024 * 1024),
+    max_age=int(os.getenv("REPORT_CACHE_MAX_AGE", "86400")),
+    min_compress_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+)
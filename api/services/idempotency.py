@@ -0,0 +1,107 @@
+"""重复提交合并模块
+
+带Idempotency-Key的请求：同一用户同一键只执行一次，保留期内的重试直接取得同一结果；
+同一个键配上不同的请求内容视为客户端错误。未带键的请求按（用户, 内容哈希）合并：
+相同内容的提交在执行中或刚完成时，附着到已有的执行上，不再新建分析记录、重复调用LLM与SERP。
+执行失败的记录立即移除，之后的重试会重新执行。
+"""
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Awaitable, Tuple
+import fast_json
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyKeyReused(Exception):
+    """同一Idempotency-Key对应了不同的请求内容"""
+
+
+def content_hash(payload: Any) -> str:
+    return hashlib.sha256(fast_json.dumps_bytes(payload, sort_keys=True)).hexdigest()
+
+
+class _Submission:
+    __slots__ = ("future", "payload_hash", "finished_at", "attached")
+
+    def __init__(self, future: asyncio.Future, payload_hash: str):
+        self.future = future
+        self.payload_hash = payload_hash
+        self.finished_at: Optional[float] = None
+        self.attached = 0
+
+
+class SubmissionCollapser:
+    """按幂等键或内容哈希合并重复提交
+
+    执行在独立任务中进行，首个请求的客户端断开不会中断其他附着的请求。
+    """
+
+    def __init__(self, key_ttl: float = 86400.0, duplicate_window: float = 30.0, max_entries: int = 10000):
+        self.key_ttl = key_ttl
+        self.duplicate_window = duplicate_window
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, ...], _Submission]" = OrderedDict()
+        self._stats = {"executed": 0, "attached": 0, "replayed": 0, "conflicts": 0}
+
+    async def run(self, user_id: str, scope: str, payload: Any,
+                  func: Callable[[], Awaitable[Any]], key: Optional[str] = None) -> Tuple[Any, bool]:
+        """执行func()或附着到已有的执行，返回 (结果, 是否复用了已有执行)"""
+        self._expire()
+        payload_hash = content_hash(payload)
+        entry_key = (user_id, scope, "key", key) if key else (user_id, scope, "content", payload_hash)
+
+        entry = self._entries.get(entry_key)
+        if entry is not None:
+            if entry.payload_hash != payload_hash:
+                self._stats["conflicts"] += 1
+                raise IdempotencyKeyReused("Idempotency-Key已用于内容不同的请求")
+            entry.attached += 1
+            self._stats["replayed" if entry.finished_at else "attached"] += 1
+            logger.info(f"重复提交附着到已有执行: {scope} user={user_id} key={key or payload_hash[:12]}")
+            return await asyncio.shield(entry.future), True
+
+        # 登记与创建任务之间没有await，同一事件循环内并发到达的重复请求一定能看到这条记录
+        future = asyncio.ensure_future(func())
+        entry = self._entries[entry_key] = _Submission(future, payload_hash)
+        self._stats["executed"] += 1
+        future.add_done_callback(lambda done: self._on_done(entry_key, entry, done))
+        return await asyncio.shield(future), False
+
+    def _on_done(self, entry_key: Tuple[str, ...], entry: _Submission, done: asyncio.Future):
+        if done.cancelled() or done.exception() is not None:
+            # 失败不保留，重试时重新执行
+            if self._entries.get(entry_key) is entry:
+                del self._entries[entry_key]
+            return
+        entry.finished_at = time.monotonic()
+
+    def _expire(self):
+        """清理超过保留期的已完成记录；条目过多时优先淘汰最早的已完成记录"""
+        now = time.monotonic()
+        for entry_key, entry in list(self._entries.items()):
+            if entry.finished_at is None:
+                continue
+            ttl = self.key_ttl if entry_key[2] == "key" else self.duplicate_window
+            if now - entry.finished_at > ttl:
+                del self._entries[entry_key]
+        if len(self._entries) > self.max_entries:
+            finished = [k for k, e in self._entries.items() if e.finished_at is not None]
+            for entry_key in finished[:len(self._entries) - self.max_entries]:
+                del self._entries[entry_key]
+
+    def stats(self) -> Dict[str, Any]:
+        in_flight = sum(1 for e in self._entries.values() if e.finished_at is None)
+        return dict(self._stats, in_flight=in_flight, retained=len(self._entries) - in_flight)
+
+
+# 创建全局实例
+submissions = SubmissionCollapser(
+    key_ttl=float(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", "86400")),
+    duplicate_window=float(os.getenv("DUPLICATE_SUBMISSION_WINDOW_SECONDS", "30")),
+    max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000")),
+)
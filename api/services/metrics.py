@@ -0,0 +1,274 @@
+"""Prometheus指标模块
+
+不依赖prometheus_client：热路径上只做一次字典查找与加法，导出时按文本格式（0.0.4）拼接。
+队列深度等状态类指标在抓取时通过回调读取各组件的stats()，不在热路径上维护。
+"""
+import time
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+from typing import Dict, Optional, List, Tuple, Callable, Sequence
+
+logger = logging.getLogger(__name__)
+
+# 覆盖毫秒级数据库调用到分钟级LLM调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """单调递增计数"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, labels: LabelValues = (), amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: LabelValues = ()) -> float:
+        return self._values.get(labels, 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in items]
+
+
+class Gauge(_Metric):
+    """当前值；指定callback时在抓取时读取，返回 {标签值元组: 数值}"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, labels: LabelValues = (), value: float = 0.0):
+        self._values[labels] = value
+
+    def _samples(self) -> List[str]:
+        values = self._values
+        if self.callback:
+            try:
+                values = self.callback()
+            except Exception as e:
+                logger.error(f"读取指标 {self.name} 失败: {e}")
+                return []
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+                for labels, value in list(values.items())]
+
+
+class Histogram(_Metric):
+    """固定分桶直方图；每个标签组合保存各桶（非累计）计数、总和与次数"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, labels: LabelValues, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # [桶0..桶n-1, +Inf桶, sum]
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        lines = []
+        bounds = self.buckets + (float("inf"),)
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                le = 'le="%s"' % _number(float(bound))
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，render()输出Prometheus文本格式"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              callback: Optional[Callable[[], Dict[LabelValues, float]]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor:
+    """周期性休眠并记录实际唤醒的延迟（事件循环被阻塞的程度）"""
+
+    def __init__(self, histogram: Histogram, interval: float = 0.5):
+        self.histogram = histogram
+        self.interval = interval
+        self.last_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(time.perf_counter() - started - self.interval, 0.0)
+            self.histogram.observe((), self.last_lag)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+class ASGIMetricsMiddleware:
+    """按路由模板统计请求延迟与状态码（纯ASGI中间件，不包装请求/响应对象）"""
+
+    def __init__(self, app, latency: Histogram, requests: Counter):
+        self.app = app
+        self.latency = latency
+        self.requests = requests
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = ["500"]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # 路由匹配后FastAPI会把route写入scope；未匹配的请求归为一类，避免标签基数膨胀
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            self.latency.observe((scope["method"], path), time.perf_counter() - started)
+            self.requests.inc((scope["method"], path, status[0]))
+
+
+def http_client_hooks(provider: str) -> Tuple[Callable, Callable]:
+    """httpx事件钩子（request, response），统计同步客户端（如Supabase PostgREST）的调用耗时与错误"""
+    def on_request(request):
+        request.extensions["metrics_started"] = time.perf_counter()
+
+    def on_response(response):
+        started = response.request.extensions.get("metrics_started")
+        if started is not None:
+            UPSTREAM_LATENCY.observe((provider,), time.perf_counter() - started)
+        UPSTREAM_REQUESTS.inc((provider, "ok" if response.status_code < 400 else "error"))
+
+    return on_request, on_response
+
+
+def ratio(numerator: float, denominator: float) -> float:
+    return numerator / denominator if denominator else 0.0
+
+
+# 创建全局实例
+metrics = MetricsRegistry()
+
+HTTP_LATENCY = metrics.histogram(
+    "http_request_duration_seconds", "API请求耗时（按路由模板）", ("method", "route"))
+HTTP_REQUESTS = metrics.counter(
+    "http_requests_total", "API请求数（按路由模板与状态码）", ("method", "route", "status"))
+UPSTREAM_LATENCY = metrics.histogram(
+    "upstream_request_duration_seconds", "上游调用耗时（含限流重试）", ("provider",))
+UPSTREAM_REQUESTS = metrics.counter(
+    "upstream_requests_total", "上游调用数，outcome为ok/throttled/error/rejected", ("provider", "outcome"))
+SEARCH_CACHE = metrics.counter(
+    "search_cache_requests_total", "search_cache查询结果（hit/miss）", ("result",))
+metrics.gauge(
+    "search_cache_hit_ratio", "search_cache命中率（进程启动以来）",
+    callback=lambda: {(): ratio(SEARCH_CACHE.value(("hit",)),
+                                SEARCH_CACHE.value(("hit",)) + SEARCH_CACHE.value(("miss",)))})
+SEARCH_CACHE_SWEPT = metrics.counter(
+    "search_cache_swept_rows_total", "search_cache清理删除的行数，reason为expired/evicted", ("reason",))
+NODE_DURATION = metrics.histogram(
+    "analysis_node_duration_seconds", "分析阶段/工作流节点耗时，outcome为computed/reused", ("node", "outcome"))
+LLM_TOKENS = metrics.counter(
+    "llm_tokens_total", "Gemini token用量（usageMetadata）", ("model", "kind"))
+UPSTREAM_COST = metrics.counter(
+    "upstream_cost_usd_total", "上游调用估算成本（美元）", ("provider", "model"))
+LOOP_LAG = metrics.histogram(
+    "event_loop_lag_seconds", "事件循环唤醒延迟",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+loop_lag_monitor = LoopLagMonitor(LOOP_LAG)
+metrics.gauge("event_loop_lag_last_seconds", "最近一次测得的事件循环延迟",
+              callback=lambda: {(): loop_lag_monitor.last_lag})
@@ -0,0 +1,174 @@
+"""Gemini模型分级路由模块"""
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple
+from .circuit_breaker import LatencyTracker
+from .upstream_governor import upstream_governor
+
+logger = logging.getLogger(__name__)
+
+# 分析阶段
+FEATURE_EXTRACTION = "feature_extraction"
+NOVELTY = "novelty"
+INVENTIVENESS = "inventiveness"
+UTILITY = "utility"
+MARKET = "market"
+RISK = "risk"
+REPORT = "report"
+
+FAST_MODEL = os.getenv("MODEL_FAST", "gemini-1.5-flash")
+HEAVY_MODEL = os.getenv("MODEL_HEAVY", "gemini-1.5-pro")
+
+# 模型相对成本（按输入token单价，flash为1）
+MODEL_COST = {FAST_MODEL: 1.0, HEAVY_MODEL: 16.0}
+
+# 每百万token价格（美元）：(输入, 输出)，用于成本指标估算
+MODEL_PRICES = {
+    FAST_MODEL: (float(os.getenv("MODEL_FAST_PRICE_IN", "0.075")), float(os.getenv("MODEL_FAST_PRICE_OUT", "0.30"))),
+    HEAVY_MODEL: (float(os.getenv("MODEL_HEAVY_PRICE_IN", "1.25")), float(os.getenv("MODEL_HEAVY_PRICE_OUT", "5.00"))),
+}
+
+# 各阶段延迟目标（秒）：重模型近期p95超过目标时降级到快速模型
+LATENCY_TARGETS = {
+    FEATURE_EXTRACTION: 8.0,
+    UTILITY: 15.0,
+    MARKET: 15.0,
+    RISK: 20.0,
+    NOVELTY: 30.0,
+    INVENTIVENESS: 30.0,
+    REPORT: 40.0,
+}
+
+# 套餐 -> 阶段 -> 模型；未列出的阶段使用快速模型
+STAGE_ROUTES: Dict[str, Dict[str, str]] = {
+    "starter": {},
+    "professional": {
+        NOVELTY: HEAVY_MODEL,
+        REPORT: HEAVY_MODEL,
+    },
+    "enterprise": {
+        NOVELTY: HEAVY_MODEL,
+        INVENTIVENESS: HEAVY_MODEL,
+        RISK: HEAVY_MODEL,
+        REPORT: HEAVY_MODEL,
+    },
+}
+
+
+class ModelRouter:
+    """按分析阶段与订阅套餐选择模型
+
+    简单阶段（特征提取、实用性）走快速模型，新颖性/创造性判断与报告综合按套餐使用重模型；
+    重模型并发过高、近期p95超出阶段目标或Gemini正在退避时，自动降级到快速模型。
+    延迟只统计latency_window秒内的样本：降级后重模型不再有新样本，旧样本过期即恢复重模型。
+    track在线程池中调用，计数由锁保护。
+    """
+
+    def __init__(self, routes: Dict[str, Dict[str, str]], default_plan: str = "starter",
+                 heavy_max_inflight: int = 8, latency_window: float = 300.0):
+        self.routes = routes
+        self.default_plan = default_plan
+        self.heavy_max_inflight = heavy_max_inflight
+        self.latency_window = latency_window
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, int] = {}
+        self._latency: Dict[Tuple[str, str], LatencyTracker] = {}
+        self._counts: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._fallbacks: Dict[str, int] = {}
+
+    def select(self, stage: Optional[str], plan_type: Optional[str] = None) -> str:
+        """选择模型"""
+        plan = self.routes.get(plan_type or self.default_plan, self.routes.get(self.default_plan, {}))
+        model = plan.get(stage, FAST_MODEL) if stage else FAST_MODEL
+        if model == FAST_MODEL:
+            return model
+
+        with self._lock:
+            reason = self._overload_reason(stage, model)
+            if reason:
+                self._fallbacks[reason] = self._fallbacks.get(reason, 0) + 1
+        if reason:
+            logger.info(f"阶段 {stage} 降级到 {FAST_MODEL}: {reason}")
+            return FAST_MODEL
+        return model
+
+    def _overload_reason(self, stage: str, model: str) -> Optional[str]:
+        if self._inflight.get(model, 0) >= self.heavy_max_inflight:
+            return "inflight"
+        tracker = self._latency.get((stage, model))
+        p95 = tracker.quantile(0.95) if tracker else None
+        if p95 is not None and p95 > LATENCY_TARGETS.get(stage, 30.0):
+            return "latency"
+        if upstream_governor.provider("gemini").backoff_factor < 1.0:
+            return "throttled"
+        return None
+
+    @contextmanager
+    def track(self, stage: Optional[str], model: str):
+        """记录一次调用的延迟与结果（同步调用与await均可包裹）"""
+        route = (stage or "default", model)
+        with self._lock:
+            self._inflight[model] = self._inflight.get(model, 0) + 1
+            counts = self._counts.setdefault(route, {"calls": 0, "errors": 0})
+        started = time.monotonic()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._inflight[model] -= 1
+                counts["calls"] += 1
+                if failed:
+                    counts["errors"] += 1
+                tracker = self._latency.get(route)
+                if tracker is None:
+                    tracker = self._latency[route] = LatencyTracker(min_samples=5, max_age=self.latency_window)
+                tracker.add(elapsed)
+
+    def stats(self) -> Dict[str, Any]:
+        """各路由（阶段/模型）的调用量与延迟"""
+        routes = {}
+        with self._lock:
+            for (stage, model), counts in self._counts.items():
+                tracker = self._latency.get((stage, model))
+                routes[f"{stage}/{model}"] = dict(
+                    counts,
+                    relative_cost=MODEL_COST.get(model),
+                    latency_target_s=LATENCY_TARGETS.get(stage),
+                    **(tracker.stats() if tracker else {}),
+                )
+            return {
+                "routes": routes,
+                "inflight": {model: n for model, n in self._inflight.items() if n},
+                "fallbacks": dict(self._fallbacks),
+            }
+
+
+def _load_routes() -> Dict[str, Dict[str, str]]:
+    """默认路由表，可用MODEL_ROUTES（JSON，如{"starter": {"report": "gemini-1.5-pro"}}）覆盖"""
+    routes = {plan: dict(stages) for plan, stages in STAGE_ROUTES.items()}
+    overrides = os.getenv("MODEL_ROUTES")
+    if overrides:
+        try:
+            for plan, stages in json.loads(overrides).items():
+                routes.setdefault(plan, {}).update(stages)
+        except (ValueError, AttributeError) as e:
+            logger.error(f"MODEL_ROUTES配置无效，使用默认路由: {e}")
+    return routes
+
+
+# 创建全局实例
+model_router = ModelRouter(
+    _load_routes(),
+    default_plan=os.getenv("MODEL_ROUTER_DEFAULT_PLAN", "starter"),
+    heavy_max_inflight=int(os.getenv("MODEL_HEAVY_MAX_INFLIGHT", "8")),
+    latency_window=float(os.getenv("MODEL_LATENCY_WINDOW_SECONDS", "300")),
+)
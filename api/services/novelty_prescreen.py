@@ -0,0 +1,145 @@
+"""新颖性向量预筛模块"""
+import os
+import math
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+import numpy as np
+from .gemini_service_simple import gemini
+from .prior_art_service import prior_art_search
+from .upstream_governor import run_upstream
+
+logger = logging.getLogger(__name__)
+
+# 相似度分布直方图的分段
+HISTOGRAM_BINS = [0.6, 0.8, 0.9]
+
+
+class NoveltyPrescreen:
+    """用发明与现有技术的向量相似度做新颖性预筛
+
+    最相近的现有技术几乎相同（anticipated）时直接给出结论，跳过LLM新颖性分析；
+    与所有现有技术都明显不同（novel）时缩小LLM提示中的现有技术数量。
+
+    预筛分数是相似度经固定logistic曲线映射的0-1启发式分数，未按人工标注校准，不能当作概率解读：
+    相似度等于midpoint时为0.5，steepness越大曲线越陡。两个参数可通过
+    NOVELTY_PRESCREEN_MIDPOINT / NOVELTY_PRESCREEN_STEEPNESS 按实际数据调整。
+    """
+
+    def __init__(self, anticipated_threshold: float = 0.95, novel_threshold: float = 0.6,
+                 midpoint: float = 0.8, steepness: float = 12.0):
+        self.anticipated_threshold = anticipated_threshold
+        self.novel_threshold = novel_threshold
+        self.midpoint = midpoint
+        self.steepness = steepness
+
+    async def screen(self, invention_info: Dict[str, Any],
+                     prior_art: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """计算相似度分布与预筛分数，向量服务不可用时返回None"""
+        if not prior_art:
+            return None
+        try:
+            similarities = await self._similarities(invention_info, prior_art)
+        except Exception as e:
+            logger.warning(f"新颖性预筛失败，使用完整LLM分析: {e}")
+            return None
+
+        ordered = np.sort(np.asarray(similarities, dtype=np.float32))[::-1]
+        max_similarity = float(ordered[0])
+        mean_top3 = float(ordered[:3].mean())
+        blended = 0.7 * max_similarity + 0.3 * mean_top3
+
+        if max_similarity >= self.anticipated_threshold:
+            decision = "anticipated"
+        elif max_similarity < self.novel_threshold:
+            decision = "novel"
+        else:
+            decision = "uncertain"
+
+        counts = np.histogram(ordered, bins=[-1.0] + HISTOGRAM_BINS + [1.01])[0]
+        labels = [f"<{HISTOGRAM_BINS[0]}"] + [
+            f"{low}-{high}" for low, high in zip(HISTOGRAM_BINS, HISTOGRAM_BINS[1:])
+        ] + [f">={HISTOGRAM_BINS[-1]}"]
+
+        # 不修改调用方的现有技术条目（可能来自检查点或批次共享的检索结果）
+        closest = sorted((dict(art, similarity=similarity) for art, similarity in zip(prior_art, similarities)),
+                         key=lambda a: a["similarity"], reverse=True)[:3]
+        return {
+            "score": round(self.similarity_score(blended), 4),
+            "score_curve": {"midpoint": self.midpoint, "steepness": self.steepness},
+            "decision": decision,
+            "max_similarity": round(max_similarity, 4),
+            "mean_top3_similarity": round(mean_top3, 4),
+            "histogram": dict(zip(labels, (int(c) for c in counts))),
+            "compared": len(prior_art),
+            # 与prior_art顺序一致，select_prior_art据此排序
+            "similarities": [round(float(s), 4) for s in similarities],
+            "closest": [{
+                "title": a.get("title", ""),
+                "link": a.get("link", ""),
+                "similarity": round(a["similarity"], 4)
+            } for a in closest],
+        }
+
+    def similarity_score(self, similarity: float) -> float:
+        """把相似度映射为0-1的启发式新颖性分数（logistic，中点处为0.5）"""
+        return 1.0 / (1.0 + math.exp(self.steepness * (similarity - self.midpoint)))
+
+    def select_prior_art(self, prior_art: List[Dict[str, Any]],
+                         prescreen: Optional[Dict[str, Any]], limit: int = 5) -> List[Dict[str, Any]]:
+        """按相似度挑选放入LLM提示的现有技术（返回带similarity的副本），结论明确为novel时只保留3条"""
+        if not prescreen:
+            return prior_art
+        if prescreen["decision"] == "novel":
+            limit = min(limit, 3)
+        scored = [dict(art, similarity=similarity) for art, similarity in zip(prior_art, prescreen["similarities"])]
+        return sorted(scored, key=lambda a: a["similarity"], reverse=True)[:limit]
+
+    def shortcut_result(self, prescreen: Dict[str, Any]) -> Dict[str, Any]:
+        """近乎相同的现有技术已存在时，直接生成新颖性结论"""
+        closest = prescreen["closest"][0]
+        return {
+            "analysis": {
+                "新颖性评估": "低",
+                "新颖性破坏风险": f"与现有技术《{closest['title']}》高度相似（相似度{closest['similarity']}）",
+                "closest_prior_art": prescreen["closest"],
+                "method": "embedding_prescreen"
+            },
+            "score": prescreen["score"],
+            "prescreen": prescreen,
+            "llm_skipped": True,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
+    @staticmethod
+    async def _similarities(invention_info: Dict[str, Any], prior_art: List[Dict[str, Any]]) -> List[float]:
+        """本地检索结果已带相似度，其余现有技术批量生成向量后计算余弦相似度
+
+        发明向量复用现有技术检索时生成的向量；向量调用在线程池中执行，不阻塞事件循环。
+        """
+        missing = [i for i, art in enumerate(prior_art) if "similarity" not in art]
+        similarities = [art.get("similarity", 0.0) for art in prior_art]
+        if not missing:
+            return similarities
+
+        query = np.asarray(await prior_art_search.embed(prior_art_search.invention_text(invention_info)),
+                           dtype=np.float32)
+        documents = await run_upstream(
+            gemini.batch_embed_contents,
+            [f"{prior_art[i].get('title', '')}\n{prior_art[i].get('snippet', '')}" for i in missing]
+        )
+        matrix = np.asarray(documents, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+        norms[norms == 0] = 1.0
+        for i, similarity in zip(missing, (matrix @ query) / norms):
+            similarities[i] = float(similarity)
+        return similarities
+
+
+# 创建全局实例
+novelty_prescreen = NoveltyPrescreen(
+    anticipated_threshold=float(os.getenv("NOVELTY_PRESCREEN_ANTICIPATED", "0.95")),
+    novel_threshold=float(os.getenv("NOVELTY_PRESCREEN_NOVEL", "0.6")),
+    midpoint=float(os.getenv("NOVELTY_PRESCREEN_MIDPOINT", "0.8")),
+    steepness=float(os.getenv("NOVELTY_PRESCREEN_STEEPNESS", "12")),
+)
@@ -0,0 +1,144 @@
+"""公司专利组合扫描模块"""
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Any, Optional, AsyncIterator, List, Callable, Awaitable
+from .serp_service import serp
+from .serp_records import CompanyPatentRecord
+from .upstream_governor import run_batch
+
+logger = logging.getLogger(__name__)
+
+
+class ScanCheckpointStore:
+    """扫描游标的本地文件存储，中断后可从上次完成的页继续"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, scan_id: str) -> str:
+        return os.path.join(self.directory, f"{scan_id}.json")
+
+    def load(self, scan_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(scan_id), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"读取扫描检查点失败: {e}")
+            return None
+
+    def save(self, scan_id: str, state: Dict[str, Any]):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._path(scan_id)}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(scan_id))
+
+    def clear(self, scan_id: str):
+        try:
+            os.remove(self._path(scan_id))
+        except FileNotFoundError:
+            pass
+
+
+class PortfolioScanner:
+    """分页流式扫描公司专利组合
+
+    按页并发（有界）拉取search_company_patents，按patent_id边扫描边去重，逐条产出结果；
+    每页处理完后写检查点。内存中只保留已见过的专利号，不保留完整结果。
+    每页结果同时经SerpService的结果监听器进入patent_embeddings入库流程。
+    检查点按（用户, 公司, 结果上限）区分，不同用户或不同上限的扫描不会续上别人的进度。
+    """
+
+    def __init__(self, page_size: int = 100, concurrency: int = 3,
+                 checkpoints: Optional[ScanCheckpointStore] = None, max_results: int = 2000):
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.checkpoints = checkpoints
+        # 单次扫描的结果上限
+        self.max_results = max_results
+
+    @staticmethod
+    def scan_id(company_name: str, user_id: str = "", max_results: Optional[int] = None) -> str:
+        return hashlib.md5(f"company_scan:{user_id}:{company_name}:{max_results or ''}".encode()).hexdigest()
+
+    async def scan(self, company_name: str, max_results: Optional[int] = None, resume: bool = True,
+                   user_id: str = "",
+                   before_page: Optional[Callable[[int], Awaitable[None]]] = None
+                   ) -> AsyncIterator[CompanyPatentRecord]:
+        """逐条产出去重后的公司专利
+
+        before_page(页序号)在拉取每一页之前调用（用于按页计费限流），抛出异常即中止扫描，检查点保留。
+        """
+        max_results = min(max_results or self.max_results, self.max_results)
+        scan_id = self.scan_id(company_name, user_id, max_results)
+        state = self.checkpoints.load(scan_id) if (self.checkpoints and resume) else None
+        next_start = state["next_start"] if state else 0
+        seen = set(state["seen"]) if state else set()
+        emitted = state["emitted"] if state else 0
+        if state:
+            logger.info(f"从检查点继续扫描 {company_name}: 偏移 {next_start}，已产出 {emitted}")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pages_fetched = 0
+
+        async def fetch(start: int, page_number: int) -> List[CompanyPatentRecord]:
+            if before_page:
+                await before_page(page_number)
+            async with semaphore:
+                return await run_batch(serp.search_company_patents, company_name, self.page_size, start)
+
+        finished = False
+        while not finished:
+            # 只拉取凑满结果上限所需的页数
+            needed = -(-(max_results - emitted) // self.page_size)
+            offsets = [next_start + i * self.page_size for i in range(max(min(self.concurrency, needed), 1))]
+            pages = await asyncio.gather(*(fetch(offset, pages_fetched + i) for i, offset in enumerate(offsets)))
+            pages_fetched += len(offsets)
+
+            for offset, page in zip(offsets, pages):
+                fresh = 0
+                for record in page:
+                    key = record.patent_id or record.link
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    fresh += 1
+                    emitted += 1
+                    yield record
+                    if emitted >= max_results:
+                        finished = True
+                        break
+
+                next_start = offset + self.page_size
+                # 结果不足一页或整页都是重复结果，说明已经扫描到底
+                if len(page) < self.page_size or not fresh:
+                    finished = True
+                if self.checkpoints:
+                    self.checkpoints.save(scan_id, {
+                        "company_name": company_name,
+                        "user_id": user_id,
+                        "max_results": max_results,
+                        "next_start": next_start,
+                        "emitted": emitted,
+                        "seen": list(seen),
+                    })
+                if finished:
+                    break
+
+        if self.checkpoints:
+            self.checkpoints.clear(scan_id)
+        logger.info(f"公司专利扫描完成 {company_name}: 共 {emitted} 条")
+
+
+# 创建全局实例
+portfolio_scanner = PortfolioScanner(
+    page_size=int(os.getenv("PORTFOLIO_SCAN_PAGE_SIZE", "100")),
+    concurrency=int(os.getenv("PORTFOLIO_SCAN_CONCURRENCY", "3")),
+    checkpoints=ScanCheckpointStore(os.getenv("PORTFOLIO_SCAN_CHECKPOINT_DIR", ".scan_checkpoints")),
+    max_results=int(os.getenv("PORTFOLIO_SCAN_MAX_RESULTS", "2000")),
+)
@@ -0,0 +1,130 @@
+"""现有技术检索服务模块"""
+import os
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+from db import db
+from .serp_service import serp
+from .gemini_service_simple import gemini
+from .vector_index import vector_index
+from .dedup_service import deduplicator
+from .upstream_governor import run_upstream
+
+logger = logging.getLogger(__name__)
+
+
+class PriorArtService:
+    """现有技术检索：优先使用patent_embeddings本地近邻，召回不足时再调用SERP"""
+
+    def __init__(self, min_hits: int = 5, min_similarity: float = 0.75, embedding_cache_size: int = 256):
+        self.min_hits = min_hits
+        self.min_similarity = min_similarity
+        # 最近的检索向量：新颖性预筛复用检索阶段已生成的发明向量
+        self.embedding_cache_size = embedding_cache_size
+        self._embeddings: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    @staticmethod
+    def invention_text(invention_info: Dict[str, Any]) -> str:
+        """拼接用于向量检索的发明文本"""
+        parts = [
+            invention_info.get("title", ""),
+            invention_info.get("technical_field", ""),
+            (invention_info.get("technical_content") or "")[:2000],
+        ]
+        return "\n".join(p for p in parts if p)
+
+    async def embed(self, text: str) -> List[float]:
+        """生成检索向量（在线程池中调用Gemini），相同文本直接返回缓存的向量"""
+        embedding = self._embeddings.get(text)
+        if embedding is not None:
+            self._embeddings.move_to_end(text)
+            return embedding
+        embedding = await run_upstream(gemini.embed_content, text)
+        if embedding:
+            self._embeddings[text] = embedding
+            while len(self._embeddings) > self.embedding_cache_size:
+                self._embeddings.popitem(last=False)
+        return embedding
+
+    async def search_local(self, text: str, top_k: int = 10,
+                           filters: Optional[Dict[str, Any]] = None,
+                           min_similarity: float = 0.0) -> List[Dict[str, Any]]:
+        """本地向量近邻检索，结果格式与SERP专利结果一致
+
+        已加载进程内索引（VECTOR_INDEX_PATH）时直接在内存中检索，无需访问数据库。
+        """
+        embedding = await self.embed(text)
+        if not embedding:
+            return []
+
+        if len(vector_index.index):
+            rows = vector_index.index.search(embedding, top_k=top_k, filters=filters,
+                                             min_similarity=min_similarity)
+        else:
+            rows = await db.search_similar_patents(embedding, top_k=top_k, filters=filters,
+                                                   min_similarity=min_similarity)
+        return [self._to_result(row) for row in rows]
+
+    async def search_local_prior_art(self, invention_info: Dict[str, Any], top_k: int = 15) -> Dict[str, Any]:
+        """本地向量检索（输入为完整的发明文本），sufficient表示强命中已足够、无需SERP"""
+        local_results = await self.search_local(self.invention_text(invention_info), top_k=top_k)
+        strong_hits = sum(1 for r in local_results if r["similarity"] >= self.min_similarity)
+        return {"results": local_results, "local_hits": strong_hits, "sufficient": strong_hits >= self.min_hits}
+
+    @staticmethod
+    def serp_inputs(invention_info: Dict[str, Any]) -> Dict[str, str]:
+        """SERP检索只依赖标题与技术领域"""
+        return {"title": invention_info.get("title", ""),
+                "technical_field": invention_info.get("technical_field", "")}
+
+    async def search_serp(self, invention_info: Dict[str, Any], searches=None) -> Dict[str, Any]:
+        """SERP补充检索：现有技术与专利两组结果
+
+        searches为批量分析共享的检索（SharedSearches）时，检索词与单次分析完全相同，
+        批次内只有检索词相同的检索才共享结果，两种模式的结果一致。
+        """
+        title = invention_info.get("title", "")
+        query = f"{invention_info.get('technical_field', '')} {title}"
+        if searches is None:
+            prior_art = await run_upstream(serp.search_prior_art, query, 10)
+            patents = await run_upstream(serp.search_patents, title, 5)
+        else:
+            # 批量模式：相同检索词共享结果，复制后再合并，条目之间互不影响
+            prior_art = [dict(r) for r in await searches.get(f"prior_art:{query}", serp.search_prior_art, query, 10)]
+            patents = [dict(r) for r in await searches.get(f"patents:{title}", serp.search_patents, title, 5)]
+        return {"prior_art": prior_art, "patents": patents}
+
+    @staticmethod
+    def merge(local: Dict[str, Any], serp_results: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """合并本地与SERP结果（本地在前），返回结果列表与来源统计；serp_results为None表示未调用SERP"""
+        if serp_results is None:
+            return {"results": list(local["results"]), "local_hits": local["local_hits"], "used_serp": False,
+                    "duplicates_removed": 0}
+
+        # 同一文献常以不同URL（镜像、语言版本、同族公开）重复出现，进入提示前合并
+        merged, removed = deduplicator.deduplicate(
+            list(local["results"]) + list(serp_results["prior_art"]) + list(serp_results["patents"]))
+        if removed:
+            logger.info(f"现有技术去重移除 {removed} 条重复结果")
+
+        return {"results": merged, "local_hits": local["local_hits"], "used_serp": True,
+                "duplicates_removed": removed}
+
+    @staticmethod
+    def _to_result(row: Dict[str, Any]) -> Dict[str, Any]:
+        metadata = row.get("metadata") or {}
+        return {
+            "title": row.get("title", ""),
+            "link": metadata.get("link") or f"https://patents.google.com/patent/{row.get('patent_id')}",
+            "snippet": row.get("abstract") or "",
+            "patent_id": row.get("patent_id"),
+            "similarity": round(float(row.get("similarity", 0)), 4),
+            "source": "patent_embeddings",
+        }
+
+
+# 创建全局实例
+prior_art_search = PriorArtService(
+    min_hits=int(os.getenv("PRIOR_ART_MIN_LOCAL_HITS", "5")),
+    min_similarity=float(os.getenv("PRIOR_ART_MIN_SIMILARITY", "0.75")),
+)
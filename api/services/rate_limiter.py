@@ -0,0 +1,426 @@
+"""用户限流与配额服务模块"""
+import os
+import time
+import asyncio
+import calendar
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+from db import db
+
+logger = logging.getLogger(__name__)
+
+# 各套餐的限流参数：动作 -> (每分钟补充令牌数, 桶容量)，以及每月分析次数上限
+PLAN_LIMITS: Dict[str, Dict[str, Any]] = {
+    "starter": {
+        "analyze": (2, 3),
+        "search": (10, 10),
+        "monthly_analyses": 3,
+    },
+    "professional": {
+        "analyze": (6, 10),
+        "search": (60, 30),
+        "monthly_analyses": 40,
+    },
+    "enterprise": {
+        "analyze": (20, 30),
+        "search": (200, 100),
+        "monthly_analyses": 130,
+    },
+}
+
+# 全局（所有用户合计）限流，保护付费的Gemini与SerpAPI额度
+GLOBAL_LIMITS: Dict[str, Tuple[float, float]] = {
+    "analyze": (float(os.getenv("RATE_LIMIT_GLOBAL_ANALYZE_PER_MIN", "60")), 60),
+    "search": (float(os.getenv("RATE_LIMIT_GLOBAL_SEARCH_PER_MIN", "600")), 300),
+}
+
+# 消耗月度配额的动作
+QUOTA_ACTIONS = {"analyze"}
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    """解析数据库返回的ISO时间，无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def _add_months(moment: datetime, months: int) -> datetime:
+    """按月顺延，目标月份没有该日时取月末"""
+    year, month = divmod(moment.month - 1 + months, 12)
+    year += moment.year
+    month += 1
+    return moment.replace(year=year, month=month, day=min(moment.day, calendar.monthrange(year, month)[1]))
+
+
+class RateLimitExceeded(Exception):
+    """超出限流或配额"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(int(retry_after), 1)
+
+
+class TokenBucket:
+    """令牌桶，O(1)检查"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate_per_min: float, capacity: float):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def take(self, now: float, cost: float = 1.0) -> float:
+        """尝试取出令牌，成功返回0，否则返回需等待的秒数"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        if self.rate <= 0:
+            return 60.0
+        return (cost - self.tokens) / self.rate
+
+
+class InMemoryBucketStore:
+    """进程内令牌桶存储"""
+
+    def __init__(self):
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    async def take(self, key: str, rate_per_min: float, capacity: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket.capacity != capacity:
+            bucket = self._buckets[key] = TokenBucket(rate_per_min, capacity)
+        return bucket.take(time.monotonic())
+
+    async def give_back(self, key: str):
+        """退还一枚令牌（请求随后被其他限额拒绝时）"""
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.tokens = min(bucket.capacity, bucket.tokens + 1)
+
+    def evict_idle(self) -> int:
+        """删除已补满的桶（与新建的桶等价），返回删除数量"""
+        now = time.monotonic()
+        idle = [key for key, bucket in self._buckets.items()
+                if bucket.tokens + (now - bucket.updated_at) * bucket.rate >= bucket.capacity]
+        for key in idle:
+            del self._buckets[key]
+        return len(idle)
+
+    def size(self) -> int:
+        return len(self._buckets)
+
+
+class RedisBucketStore:
+    """基于Redis的共享令牌桶存储，多个worker共享同一限额"""
+
+    # KEYS[1]=桶键; ARGV: 每秒速率, 容量, 当前时间
+    _SCRIPT = """
+    local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local tokens = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    tokens = math.min(capacity, tokens + (now - ts) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    elseif rate > 0 then
+        wait = (1 - tokens) / rate
+    else
+        wait = 60
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / math.max(rate, 0.001)) + 60)
+    return tostring(wait)
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as aioredis  # 可选依赖，仅在配置共享后端时需要
+
+        self._client = aioredis.from_url(url)
+        self._script = self._client.register_script(self._SCRIPT)
+
+    async def take(self, key: str, rate_per_min: float, capacity: float) -> float:
+        wait = await self._script(keys=[f"ratelimit:{key}"],
+                                  args=[rate_per_min / 60.0, capacity, time.time()])
+        return float(wait)
+
+    async def give_back(self, key: str):
+        """退还一枚令牌；超出容量的部分在下次take时截断"""
+        await self._client.hincrbyfloat(f"ratelimit:{key}", "tokens", 1)
+
+    def evict_idle(self) -> int:
+        """桶由EXPIRE自动过期"""
+        return 0
+
+    def size(self) -> int:
+        return -1
+
+
+class _QuotaEntry:
+    """单个用户的配额状态"""
+
+    __slots__ = ("plan_type", "limit", "used", "pending", "period_end", "period_end_at", "loaded_at", "used_at")
+
+    def __init__(self, plan_type: str, limit: Optional[int], used: int,
+                 period_end: Optional[str], loaded_at: float):
+        self.plan_type = plan_type
+        self.limit = limit
+        self.used = used
+        self.pending = 0  # 尚未同步到数据库的增量
+        self.period_end = period_end
+        end = _parse_time(period_end)
+        # 加载时周期已结束（顺延失败）的条目按常规刷新间隔重试，不在每次请求时重新加载
+        self.period_end_at = end.timestamp() if end and end.timestamp() > time.time() else None
+        self.loaded_at = loaded_at
+        self.used_at = loaded_at
+
+    def period_over(self) -> bool:
+        return self.period_end_at is not None and self.period_end_at <= time.time()
+
+
+class RateLimiter:
+    """按用户与套餐限流，并在内存中维护月度配额，定期同步到user_subscriptions
+
+    同步时清理已补满的令牌桶，以及idle_ttl秒内没有请求且增量已同步的配额缓存（下次请求重新加载）；
+    idle_ttl应长于一次分析的耗时，分析失败时的配额退还才能落在缓存条目上。
+    """
+
+    def __init__(self, store=None, sync_interval: float = 30.0, refresh_interval: float = 300.0,
+                 idle_ttl: float = 3600.0):
+        self.enabled = os.getenv("RATE_LIMIT_ENABLED", "true").lower() != "false"
+        self.store = store or InMemoryBucketStore()
+        self.sync_interval = sync_interval
+        self.refresh_interval = refresh_interval
+        self.idle_ttl = idle_ttl
+        self._quotas: Dict[str, _QuotaEntry] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._sync_task: Optional[asyncio.Task] = None
+        self._rejected: Dict[str, int] = {}
+
+    async def check(self, user_id: str, action: str, count: int = 1):
+        """检查并扣减限额，超出时抛出RateLimitExceeded
+
+        count为本次请求包含的分析数（批量分析），只作用于月度配额，速率令牌仍按一次请求扣减。
+        """
+        if not self.enabled:
+            return
+
+        entry = await self._get_quota(user_id)
+        entry.used_at = time.monotonic()
+        limits = PLAN_LIMITS.get(entry.plan_type, PLAN_LIMITS["starter"])
+
+        if action in QUOTA_ACTIONS and entry.limit is not None and entry.used + count > entry.limit:
+            self._reject("quota")
+            raise RateLimitExceeded("本月分析次数已用完，请升级套餐", self._seconds_until(entry.period_end))
+
+        # 先检查用户自己的限额：被用户限额拒绝的请求不消耗全局令牌
+        user_key = None
+        if action in limits:
+            rate, capacity = limits[action]
+            user_key = f"user:{user_id}:{action}"
+            wait = await self.store.take(user_key, rate, capacity)
+            if wait:
+                self._reject("user")
+                raise RateLimitExceeded("请求过于频繁，请稍后重试", wait + 1)
+
+        global_rate, global_capacity = GLOBAL_LIMITS.get(action, (0, 0))
+        if global_rate:
+            wait = await self.store.take(f"global:{action}", global_rate, global_capacity)
+            if wait:
+                # 请求未执行，退还用户令牌
+                if user_key:
+                    await self.store.give_back(user_key)
+                self._reject("global")
+                raise RateLimitExceeded("系统繁忙，请稍后重试", wait + 1)
+
+        if action in QUOTA_ACTIONS:
+            # 令牌检查期间条目可能被清理或重新加载，增量记在当前缓存的条目上
+            entry = self._quotas.setdefault(user_id, entry)
+            # 令牌检查期间可能有并发请求扣减配额，这里再确认一次
+            if entry.limit is not None and entry.used + count > entry.limit:
+                self._reject("quota")
+                raise RateLimitExceeded("本月分析次数已用完，请升级套餐", self._seconds_until(entry.period_end))
+            entry.used += count
+            entry.pending += count
+
+    def refund(self, user_id: str, action: str, count: int = 1):
+        """分析未能启动时退还已扣减的配额"""
+        entry = self._quotas.get(user_id)
+        if entry and action in QUOTA_ACTIONS and entry.used > 0:
+            count = min(count, entry.used)
+            entry.used -= count
+            entry.pending -= count
+
+    def plan_type(self, user_id: str) -> str:
+        """已缓存的用户套餐（check之后可用），用于模型路由；未启用限流或没有缓存时按基础套餐"""
+        entry = self._quotas.get(user_id)
+        return entry.plan_type if entry else "starter"
+
+    async def _get_quota(self, user_id: str) -> _QuotaEntry:
+        """获取用户配额，缓存未命中或过期时才查询数据库"""
+        entry = self._quotas.get(user_id)
+        # 计费周期结束后立即重新加载，由_load_quota进入新周期
+        if entry and time.monotonic() - entry.loaded_at < self.refresh_interval and not entry.period_over():
+            return entry
+
+        # 同一用户的并发请求只触发一次加载
+        loading = self._loading.get(user_id)
+        if loading:
+            return await loading
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = future
+        try:
+            entry = await self._load_quota(user_id, entry)
+            self._quotas[user_id] = entry
+            future.set_result(entry)
+            return entry
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._loading[user_id]
+
+    async def _load_quota(self, user_id: str, previous: Optional[_QuotaEntry]) -> _QuotaEntry:
+        """从user_subscriptions加载配额，保留尚未同步的增量"""
+        subscription = None
+        try:
+            subscription = await db.get_user_subscription(user_id)
+        except Exception as e:
+            logger.error(f"加载用户订阅失败: {e}")
+            if previous:
+                previous.loaded_at = time.monotonic()
+                return previous
+
+        plan_type = "starter"
+        limit = PLAN_LIMITS["starter"]["monthly_analyses"]
+        used = 0
+        period_end = None
+        if subscription and subscription.get("status", "active") == "active":
+            plan_type = subscription.get("plan_type") or "starter"
+            limit = subscription.get("monthly_analyses_limit")
+            if limit is None:
+                limit = PLAN_LIMITS.get(plan_type, PLAN_LIMITS["starter"])["monthly_analyses"]
+            period_end = subscription.get("current_period_end")
+            end = _parse_time(period_end)
+            if end and end.timestamp() <= time.time():
+                subscription = await self._start_next_period(user_id, subscription, end)
+                period_end = subscription.get("current_period_end")
+            used = subscription.get("monthly_analyses_used") or 0
+
+        entry = _QuotaEntry(plan_type, limit, used, period_end, time.monotonic())
+        # 未同步的增量属于上一周期时不再计入
+        if previous and previous.pending and previous.period_end == period_end:
+            entry.used += previous.pending
+            entry.pending = previous.pending
+        return entry
+
+    async def _start_next_period(self, user_id: str, subscription: Dict[str, Any],
+                                 end: datetime) -> Dict[str, Any]:
+        """计费周期已结束：已用次数清零，周期按月顺延到包含当前时间的那个月"""
+        months = 1
+        while _add_months(end, months).timestamp() <= time.time():
+            months += 1
+        try:
+            updated = await db.start_subscription_period(
+                user_id, subscription["current_period_end"],
+                _add_months(end, months - 1).isoformat(), _add_months(end, months).isoformat())
+            if updated is None:
+                # 其他worker已先完成顺延
+                updated = await db.get_user_subscription(user_id)
+            return updated or subscription
+        except Exception as e:
+            logger.error(f"顺延用户订阅周期失败: {e}")
+            return subscription
+
+    async def sync(self):
+        """将内存中累计的配额增量写回数据库"""
+        for user_id, entry in list(self._quotas.items()):
+            delta = entry.pending
+            if not delta:
+                continue
+            entry.pending -= delta
+            try:
+                await db.increment_subscription_usage(user_id, delta)
+            except Exception as e:
+                entry.pending += delta
+                logger.error(f"同步用户配额失败: {e}")
+
+    def evict_idle(self) -> int:
+        """清理空闲的配额缓存与已补满的令牌桶，返回清理的配额条目数"""
+        now = time.monotonic()
+        idle = [user_id for user_id, entry in self._quotas.items()
+                if not entry.pending and now - entry.used_at >= self.idle_ttl]
+        for user_id in idle:
+            del self._quotas[user_id]
+        self.store.evict_idle()
+        return len(idle)
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await self.sync()
+            self.evict_idle()
+
+    def start(self):
+        """启动后台配额同步任务"""
+        if self.enabled and self._sync_task is None:
+            self._sync_task = asyncio.get_running_loop().create_task(self._sync_loop())
+
+    async def stop(self):
+        """停止同步任务并写回剩余增量"""
+        if self._sync_task:
+            self._sync_task.cancel()
+            self._sync_task = None
+        await self.sync()
+
+    def _reject(self, kind: str):
+        self._rejected[kind] = self._rejected.get(kind, 0) + 1
+
+    @staticmethod
+    def _seconds_until(period_end: Optional[str]) -> int:
+        end = _parse_time(period_end)
+        if end is None:
+            return 3600
+        remaining = end.timestamp() - time.time()
+        return int(remaining) if remaining > 1 else 1
+
+    def stats(self) -> Dict[str, Any]:
+        """限流器指标"""
+        return {
+            "enabled": self.enabled,
+            "tracked_users": len(self._quotas),
+            "buckets": self.store.size(),
+            "pending_sync": sum(e.pending for e in self._quotas.values()),
+            "rejected": dict(self._rejected),
+        }
+
+
+def _create_store():
+    """按配置选择令牌桶存储，Redis不可用时退回进程内存储"""
+    redis_url = os.getenv("RATE_LIMIT_REDIS_URL")
+    if redis_url:
+        try:
+            return RedisBucketStore(redis_url)
+        except ImportError:
+            logger.warning("未安装redis，限流使用进程内存储")
+    return InMemoryBucketStore()
+
+
+# 创建全局实例
+rate_limiter = RateLimiter(
+    store=_create_store(),
+    idle_ttl=float(os.getenv("RATE_LIMIT_IDLE_TTL_SECONDS", "3600")),
+)
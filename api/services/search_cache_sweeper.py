@@ -0,0 +1,149 @@
+"""搜索缓存维护模块
+
+search_cache的行只写入不删除，表与idx_search_cache_expires会无限增长。本模块后台定期：
+按批删除已过期的行；行数超过上限时按最近命中时间（LRU）淘汰最久未命中的行；
+读取行数与占用空间写入指标。命中在内存中累加，按周期批量写回hit_count/last_hit_at，
+不给命中的搜索请求增加数据库往返。
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Any, Optional
+from db import db
+from .metrics import SEARCH_CACHE_SWEPT
+
+logger = logging.getLogger(__name__)
+
+
+class SearchCacheSweeper:
+    """search_cache后台清理：过期删除 + 行数上限LRU淘汰 + 大小指标
+
+    每批删除后让出事件循环（batch_pause），单次清理最多max_batches批，剩余的留给下一轮。
+    """
+
+    def __init__(self, interval: float = 300.0, hit_flush_interval: float = 30.0, batch_size: int = 100,
+                 max_batches: int = 50, batch_pause: float = 0.05, max_rows: int = 50000):
+        self.enabled = os.getenv("SEARCH_CACHE_SWEEP_ENABLED", "true").lower() != "false"
+        self.interval = interval
+        self.hit_flush_interval = hit_flush_interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.batch_pause = batch_pause
+        # 0表示不限行数，只清理过期行
+        self.max_rows = max_rows
+        self._hits: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+        self._last_sweep: Optional[Dict[str, Any]] = None
+        self._table: Dict[str, Any] = {}
+        self._stats = {"hits_recorded": 0, "hits_flushed": 0, "sweeps": 0, "expired_deleted": 0,
+                       "evicted": 0, "failed": 0}
+
+    def record_hit(self, query_hash: str):
+        """记录一次缓存命中（仅内存累加）"""
+        if not self.enabled:
+            return
+        self._hits[query_hash] += 1
+        self._stats["hits_recorded"] += 1
+
+    async def flush_hits(self):
+        """把累加的命中写回数据库；失败时丢弃（只影响淘汰顺序）"""
+        if not self._hits:
+            return
+        hits, self._hits = dict(self._hits), Counter()
+        try:
+            await db.record_search_cache_hits(hits, datetime.utcnow().isoformat())
+            self._stats["hits_flushed"] += sum(hits.values())
+        except Exception as e:
+            logger.warning(f"写回搜索缓存命中失败，丢弃 {len(hits)} 条: {e}")
+
+    async def _delete_in_batches(self, delete, remaining: Optional[int] = None) -> int:
+        """反复调用delete(批大小)直到删完、达到remaining或批数上限"""
+        deleted = 0
+        for _ in range(self.max_batches):
+            size = self.batch_size if remaining is None else min(self.batch_size, remaining - deleted)
+            if size <= 0:
+                break
+            count = await delete(size)
+            deleted += count
+            if count < size:
+                break
+            await asyncio.sleep(self.batch_pause)
+        return deleted
+
+    async def sweep(self) -> Dict[str, Any]:
+        """执行一轮清理，返回本轮结果"""
+        started = time.perf_counter()
+        # 先写回命中，LRU按最新的命中时间淘汰
+        await self.flush_hits()
+        expired = await self._delete_in_batches(db.delete_expired_search_cache)
+        SEARCH_CACHE_SWEPT.inc(("expired",), expired)
+
+        evicted = 0
+        self._table = await db.get_search_cache_stats()
+        if self.max_rows and self._table["rows"] > self.max_rows:
+            evicted = await self._delete_in_batches(db.evict_search_cache, self._table["rows"] - self.max_rows)
+            SEARCH_CACHE_SWEPT.inc(("evicted",), evicted)
+            self._table = await db.get_search_cache_stats()
+
+        self._stats["sweeps"] += 1
+        self._stats["expired_deleted"] += expired
+        self._stats["evicted"] += evicted
+        self._last_sweep = {
+            "at": datetime.utcnow().isoformat(),
+            "expired_deleted": expired,
+            "evicted": evicted,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        if expired or evicted:
+            logger.info(f"search_cache清理: 删除过期 {expired} 行，淘汰 {evicted} 行，剩余 {self._table['rows']} 行")
+        return self._last_sweep
+
+    async def _run(self):
+        next_sweep = time.monotonic()
+        while True:
+            # 启动后先等一个周期，不与服务预热和首批请求争抢数据库连接
+            await asyncio.sleep(min(self.hit_flush_interval, self.interval))
+            try:
+                if time.monotonic() >= next_sweep:
+                    next_sweep = time.monotonic() + self.interval
+                    await self.sweep()
+                else:
+                    await self.flush_hits()
+            except Exception as e:
+                self._stats["failed"] += 1
+                logger.error(f"search_cache清理失败: {e}")
+
+    def start(self):
+        """启动后台清理任务"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务并写回剩余的命中"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush_hits()
+
+    @property
+    def table(self) -> Dict[str, Any]:
+        """最近一次清理时读取的表大小（rows, expired, table_bytes, index_bytes）"""
+        return self._table
+
+    def stats(self) -> Dict[str, Any]:
+        """清理与表大小指标"""
+        return dict(self._stats, pending_hits=len(self._hits), max_rows=self.max_rows,
+                    table=dict(self._table), last_sweep=self._last_sweep)
+
+
+# 创建全局实例
+search_cache_sweeper = SearchCacheSweeper(
+    interval=float(os.getenv("SEARCH_CACHE_SWEEP_INTERVAL", "300")),
+    hit_flush_interval=float(os.getenv("SEARCH_CACHE_HIT_FLUSH_SECONDS", "30")),
+    batch_size=int(os.getenv("SEARCH_CACHE_SWEEP_BATCH", "100")),
+    max_batches=int(os.getenv("SEARCH_CACHE_SWEEP_MAX_BATCHES", "50")),
+    max_rows=int(os.getenv("SEARCH_CACHE_MAX_ROWS", "50000")),
+)
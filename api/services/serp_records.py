@@ -0,0 +1,203 @@
+"""SERP搜索结果记录模块"""
+from collections.abc import MutableMapping
+from typing import Dict, Any, List, Optional, Iterator, Iterable, Type
+
+
+class SearchRecord(MutableMapping):
+    """使用__slots__的搜索结果记录
+
+    每条结果不再是独立的dict（每条都带一份键名与哈希表），字段存放在固定槽位中；
+    同时实现Mapping接口，现有的 result.get("title") / result["link"] 写法保持不变。
+    未声明的字段（如去重附加的duplicate_links、预筛附加的similarity）存放在_extra中。
+    """
+
+    __slots__ = ("_extra",)
+
+    kind = "base"
+    _fields: tuple = ()
+    # 值为None时视为不存在的字段（与原先按需写入dict的行为一致）
+    _optional: frozenset = frozenset()
+
+    def __init__(self, *values: Any, **extra: Any):
+        for field, value in zip(self._fields, values):
+            setattr(self, field, value)
+        for field in self._fields[len(values):]:
+            setattr(self, field, None)
+        self._extra = extra or None
+
+    # ========== Mapping接口 ==========
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._fields:
+            value = getattr(self, key)
+            if value is None and key in self._optional:
+                raise KeyError(key)
+            return value
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key in self._fields:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key: str):
+        if key in self._fields and key in self._optional:
+            setattr(self, key, None)
+        elif self._extra and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for field in self._fields:
+            if field not in self._optional or getattr(self, field) is not None:
+                yield field
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为普通dict（用于JSON序列化）"""
+        data = {field: getattr(self, field) for field in self._fields
+                if field not in self._optional or getattr(self, field) is not None}
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+
+class PatentRecord(SearchRecord):
+    """Google Patents结果"""
+    kind = "patent"
+    _fields = ("title", "link", "snippet", "position", "patent_id")
+    _optional = frozenset({"patent_id"})
+    __slots__ = _fields
+
+
+class CompanyPatentRecord(SearchRecord):
+    """公司专利结果"""
+    kind = "company_patent"
+    _fields = ("title", "link", "snippet", "assignee", "position", "patent_id")
+    _optional = frozenset({"patent_id"})
+    __slots__ = _fields
+
+
+class PriorArtRecord(SearchRecord):
+    """现有技术（网页）结果"""
+    kind = "prior_art"
+    _fields = ("title", "link", "snippet", "source", "date", "position")
+    __slots__ = _fields
+
+
+class ScholarRecord(SearchRecord):
+    """学术文献结果"""
+    kind = "scholar"
+    _fields = ("title", "link", "snippet", "publication_info", "authors", "year", "cited_by", "position")
+    __slots__ = _fields
+
+
+RECORD_TYPES: Dict[str, Type[SearchRecord]] = {
+    cls.kind: cls for cls in (PatentRecord, CompanyPatentRecord, PriorArtRecord, ScholarRecord)
+}
+
+
+class ResultBatch:
+    """列式结果集：每个字段一个列表，键名只存一次
+
+    用于大结果集（如公司专利组合扫描）与搜索缓存。to_payload() 直接返回列引用，不复制数据。
+    """
+
+    __slots__ = ("record_type", "columns", "extras")
+
+    def __init__(self, record_type: Type[SearchRecord],
+                 columns: Optional[Dict[str, List[Any]]] = None,
+                 extras: Optional[List[Optional[Dict[str, Any]]]] = None):
+        self.record_type = record_type
+        self.columns = columns or {field: [] for field in record_type._fields}
+        self.extras = extras
+
+    @classmethod
+    def from_records(cls, records: Iterable[SearchRecord],
+                     record_type: Optional[Type[SearchRecord]] = None) -> "ResultBatch":
+        records = list(records)
+        record_type = record_type or (type(records[0]) if records else PatentRecord)
+        batch = cls(record_type)
+        batch.extend(records)
+        return batch
+
+    def extend(self, records: Iterable[SearchRecord]):
+        """追加记录"""
+        for record in records:
+            for field, column in self.columns.items():
+                column.append(getattr(record, field))
+            if record._extra or self.extras is not None:
+                if self.extras is None:
+                    self.extras = [None] * (len(self) - 1)
+                self.extras.append(record._extra)
+
+    def __len__(self) -> int:
+        first = self.record_type._fields[0]
+        return len(self.columns[first])
+
+    def record(self, index: int) -> SearchRecord:
+        """按行取出记录"""
+        values = [self.columns[field][index] for field in self.record_type._fields]
+        extra = self.extras[index] if self.extras else None
+        return self.record_type(*values, **(extra or {}))
+
+    def __iter__(self) -> Iterator[SearchRecord]:
+        for index in range(len(self)):
+            yield self.record(index)
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """展开为行式dict列表（API响应格式）"""
+        return [record.to_dict() for record in self]
+
+    def to_payload(self) -> Dict[str, Any]:
+        """列式可序列化表示，直接引用列数据"""
+        payload = {"kind": self.record_type.kind, "columns": self.columns}
+        if self.extras:
+            payload["extras"] = self.extras
+        return payload
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any]) -> "ResultBatch":
+        record_type = RECORD_TYPES[payload["kind"]]
+        return cls(record_type, payload["columns"], payload.get("extras"))
+
+
+def to_dicts(results: Iterable[Any]) -> List[Dict[str, Any]]:
+    """把记录或dict混合列表统一转换为dict列表"""
+    return [r.to_dict() if isinstance(r, SearchRecord) else r for r in results]
+
+
+def pack_search_results(query: str, source: str, records: List[SearchRecord]) -> Dict[str, Any]:
+    """搜索缓存的列式存储格式"""
+    return {
+        "query": query,
+        "source": source,
+        "count": len(records),
+        "format": "columnar",
+        "batch": ResultBatch.from_records(records).to_payload(),
+    }
+
+
+def unpack_search_results(cached: Dict[str, Any]) -> Dict[str, Any]:
+    """还原为API响应格式，兼容旧的行式缓存"""
+    if cached.get("format") != "columnar":
+        return cached
+    return {
+        "query": cached["query"],
+        "source": cached["source"],
+        "results": ResultBatch.from_payload(cached["batch"]).to_dicts(),
+        "count": cached["count"],
+    }
@@ -1,13 +1,68 @@
 """SERP API服务模块"""
 import os
-from typing import Dict, Any, List, Optional
+import re
+from typing import Dict, Any, List, Optional, Callable, Iterable
 import logging
 import hashlib
 from datetime import datetime
 import requests
+from .serp_records import PatentRecord, CompanyPatentRecord, PriorArtRecord, ScholarRecord
+from .upstream_governor import upstream_governor
+from .metrics import UPSTREAM_COST
+from .tracing import tracer
+from service_registry import registry
+import fast_json
 
 logger = logging.getLogger(__name__)
 
+_PATENT_LINK_MARKER = "patents.google.com/patent/"
+_YEAR = re.compile(r"\b(?:19|20)\d{2}\b")
+
+# URL来源分类规则，按优先级排列（与原先的if/elif顺序一致）
+SOURCE_RULES = [
+    ("google_patents", ["patents.google.com"]),
+    ("google_scholar", ["scholar.google.com"]),
+    ("github", ["github.com"]),
+    ("arxiv", ["arxiv.org"]),
+    ("academic", [".edu", "university", "academic"]),
+    ("encyclopedia", ["wikipedia", "baike.baidu"]),
+]
+# 展开为 (关键词, 来源) 扁平表：短URL上逐个子串查找比组合正则的逐位置扫描更快
+_SOURCE_KEYWORDS = tuple((keyword, name) for name, keywords in SOURCE_RULES for keyword in keywords)
+
+
+def identify_source(url: str) -> str:
+    """识别URL来源类型"""
+    for keyword, name in _SOURCE_KEYWORDS:
+        if keyword in url:
+            return name
+    return "web"
+
+
+def identify_sources(urls: Iterable[str]) -> List[str]:
+    """批量识别URL来源"""
+    return [identify_source(url) for url in urls]
+
+
+def extract_patent_id(link: str) -> Optional[str]:
+    """从Google Patents链接提取专利号"""
+    if _PATENT_LINK_MARKER in link:
+        return link.split("/patent/")[1].split("/")[0]
+    return None
+
+
+def extract_patent_ids(links: Iterable[str]) -> List[Optional[str]]:
+    """批量提取专利号"""
+    return [link.split("/patent/")[1].split("/")[0] if _PATENT_LINK_MARKER in link else None
+            for link in links]
+
+
+def extract_year(summary: str) -> Optional[int]:
+    """提取发表年份"""
+    match = _YEAR.search(summary)
+    return int(match.group()) if match else None
+
+
 class SerpService:
     """SERP API服务封装"""
     
@@ -16,21 +71,33 @@ class SerpService:
         if not self.api_key:
             raise ValueError("SERPAPI_KEY必须配置")
         self.base_url = "https://serpapi.com/search"
+        # 每次搜索的估算成本（美元），用于成本指标
+        self.cost_per_search = float(os.getenv("SERPAPI_COST_PER_SEARCH", "0.01"))
+        # 上游限速、月度预算与429退避
+        self.governor = upstream_governor.provider("serpapi")
+        # 专利结果监听器（如向量入库），每次专利搜索后调用
+        self.result_listeners: List[Callable[[List[PatentRecord]], None]] = []
+    
+    def warm_up(self):
+        """启动预热：预先建立到SERP API的连接"""
+        self.governor.warm_up(self.base_url)
     
     def _make_request(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """发送请求到SERP API"""
         params["api_key"] = self.api_key
         
         try:
-            response = requests.get(self.base_url, params=params)
-            response.raise_for_status()
-            return response.json()
+            with tracer.span("serpapi.search", "serpapi", engine=params.get("engine"), query=params.get("q")):
+                response = self.governor.request("GET", self.base_url, params=params)
+                response.raise_for_status()
+            UPSTREAM_COST.inc(("serpapi", ""), self.cost_per_search)
+            return fast_json.loads(response.content)
         except requests.exceptions.RequestException as e:
             logger.error(f"SERP API请求失败: {e}")
             raise
     
     def search_patents(self, query: str, num_results: int = 10, 
-                      location: str = "China", language: str = "zh-cn") -> List[Dict[str, Any]]:
+                      location: str = "China", language: str = "zh-cn") -> List[PatentRecord]:
         """搜索专利相关信息"""
         try:
             # 构建专利搜索查询
@@ -47,22 +114,9 @@ class SerpService:
             results = self._make_request(params)
             
             # 解析结果
-            parsed_results = []
-            for result in results.get("organic_results", []):
-                parsed = {
-                    "title": result.get("title", ""),
-                    "link": result.get("link", ""),
-                    "snippet": result.get("snippet", ""),
-                    "position": result.get("position", 0)
-                }
-                
-                # 尝试从URL提取专利号
-                if "patents.google.com/patent/" in parsed["link"]:
-                    patent_id = parsed["link"].split("/patent/")[1].split("/")[0]
-                    parsed["patent_id"] = patent_id
-                
-                parsed_results.append(parsed)
+            parsed_results = self.parse_patent_results(results.get("organic_results", []))
             
+            self._notify_listeners(parsed_results)
             return parsed_results
             
         except Exception as e:
@@ -70,7 +124,7 @@ class SerpService:
             raise
     
     def search_prior_art(self, query: str, num_results: int = 20,
-                        exclude_patents: bool = False) -> List[Dict[str, Any]]:
+                        exclude_patents: bool = False) -> List[PriorArtRecord]:
         """搜索现有技术（非专利文献）"""
         try:
             # 构建查询，可选择排除专利
@@ -88,26 +142,14 @@ class SerpService:
             results = self._make_request(params)
             
             # 解析结果
-            parsed_results = []
-            for result in results.get("organic_results", []):
-                parsed = {
-                    "title": result.get("title", ""),
-                    "link": result.get("link", ""),
-                    "snippet": result.get("snippet", ""),
-                    "source": self._identify_source(result.get("link", "")),
-                    "date": result.get("date", ""),
-                    "position": result.get("position", 0)
-                }
-                parsed_results.append(parsed)
-            
-            return parsed_results
+            return self.parse_prior_art_results(results.get("organic_results", []))
             
         except Exception as e:
             logger.error(f"现有技术搜索失败: {e}")
             raise
     
     def search_scholar(self, query: str, num_results: int = 10,
-                      year_start: Optional[int] = None) -> List[Dict[str, Any]]:
+                      year_start: Optional[int] = None) -> List[ScholarRecord]:
         """搜索学术文献"""
         try:
             params = {
@@ -124,28 +166,15 @@ class SerpService:
             results = self._make_request(params)
             
             # 解析学术结果
-            parsed_results = []
-            for result in results.get("organic_results", []):
-                parsed = {
-                    "title": result.get("title", ""),
-                    "link": result.get("link", ""),
-                    "snippet": result.get("snippet", ""),
-                    "publication_info": result.get("publication_info", {}),
-                    "authors": self._parse_authors(result.get("publication_info", {})),
-                    "year": self._extract_year(result.get("publication_info", {})),
-                    "cited_by": result.get("inline_links", {}).get("cited_by", {}).get("total", 0),
-                    "position": result.get("position", 0)
-                }
-                parsed_results.append(parsed)
-            
-            return parsed_results
+            return self.parse_scholar_results(results.get("organic_results", []))
             
         except Exception as e:
             logger.error(f"学术搜索失败: {e}")
             raise
     
-    def search_company_patents(self, company_name: str, num_results: int = 20) -> List[Dict[str, Any]]:
-        """搜索特定公司的专利"""
+    def search_company_patents(self, company_name: str, num_results: int = 20,
+                               start: int = 0) -> List[CompanyPatentRecord]:
+        """搜索特定公司的专利，start为结果偏移量（用于分页）"""
         try:
             # 构建公司专利搜索查询
             query = f'site:patents.google.com "assignee:{company_name}"'
@@ -157,27 +186,15 @@ class SerpService:
                 "gl": "cn",
                 "engine": "google"
             }
+            if start:
+                params["start"] = start
             
             results = self._make_request(params)
             
             # 解析结果
-            parsed_results = []
-            for result in results.get("organic_results", []):
-                parsed = {
-                    "title": result.get("title", ""),
-                    "link": result.get("link", ""),
-                    "snippet": result.get("snippet", ""),
-                    "assignee": company_name,
-                    "position": result.get("position", 0)
-                }
-                
-                # 提取专利号
-                if "patents.google.com/patent/" in parsed["link"]:
-                    patent_id = parsed["link"].split("/patent/")[1].split("/")[0]
-                    parsed["patent_id"] = patent_id
-                
-                parsed_results.append(parsed)
+            parsed_results = self.parse_company_results(results.get("organic_results", []), company_name)
             
+            self._notify_listeners(parsed_results)
             return parsed_results
             
         except Exception as e:
@@ -204,22 +221,80 @@ class SerpService:
             logger.error(f"获取搜索建议失败: {e}")
             return []
     
+    # ========== 批量解析（也用于缓存结果与组合扫描的后处理） ==========
+    
+    @staticmethod
+    def parse_patent_results(organic_results: List[Dict[str, Any]]) -> List[PatentRecord]:
+        """解析专利搜索结果"""
+        parsed_results = []
+        for result in organic_results:
+            link = result.get("link", "")
+            parsed_results.append(PatentRecord(
+                result.get("title", ""),
+                link,
+                result.get("snippet", ""),
+                result.get("position", 0),
+                extract_patent_id(link)
+            ))
+        return parsed_results
+    
+    @staticmethod
+    def parse_company_results(organic_results: List[Dict[str, Any]],
+                              company_name: str) -> List[CompanyPatentRecord]:
+        """解析公司专利搜索结果"""
+        parsed_results = []
+        for result in organic_results:
+            link = result.get("link", "")
+            parsed_results.append(CompanyPatentRecord(
+                result.get("title", ""),
+                link,
+                result.get("snippet", ""),
+                company_name,
+                result.get("position", 0),
+                extract_patent_id(link)
+            ))
+        return parsed_results
+    
+    @staticmethod
+    def parse_prior_art_results(organic_results: List[Dict[str, Any]]) -> List[PriorArtRecord]:
+        """解析现有技术搜索结果"""
+        return [PriorArtRecord(
+            result.get("title", ""),
+            result.get("link", ""),
+            result.get("snippet", ""),
+            identify_source(result.get("link", "")),
+            result.get("date", ""),
+            result.get("position", 0)
+        ) for result in organic_results]
+    
+    def parse_scholar_results(self, organic_results: List[Dict[str, Any]]) -> List[ScholarRecord]:
+        """解析学术搜索结果"""
+        parsed_results = []
+        for result in organic_results:
+            publication_info = result.get("publication_info", {})
+            parsed_results.append(ScholarRecord(
+                result.get("title", ""),
+                result.get("link", ""),
+                result.get("snippet", ""),
+                publication_info,
+                self._parse_authors(publication_info),
+                self._extract_year(publication_info),
+                result.get("inline_links", {}).get("cited_by", {}).get("total", 0),
+                result.get("position", 0)
+            ))
+        return parsed_results
+    
+    def _notify_listeners(self, results: List[PatentRecord]):
+        """将专利结果交给监听器，监听器异常不影响搜索"""
+        for listener in self.result_listeners:
+            try:
+                listener(results)
+            except Exception as e:
+                logger.error(f"专利结果监听器失败: {e}")
+    
     def _identify_source(self, url: str) -> str:
         """识别URL来源类型"""
-        if "patents.google.com" in url:
-            return "google_patents"
-        elif "scholar.google.com" in url:
-            return "google_scholar"
-        elif "github.com" in url:
-            return "github"
-        elif "arxiv.org" in url:
-            return "arxiv"
-        elif any(domain in url for domain in [".edu", "university", "academic"]):
-            return "academic"
-        elif any(domain in url for domain in ["wikipedia", "baike.baidu"]):
-            return "encyclopedia"
-        else:
-            return "web"
+        return identify_source(url)
     
     def _parse_authors(self, publication_info: Dict) -> List[str]:
         """解析作者信息"""
@@ -231,12 +306,7 @@ class SerpService:
     
     def _extract_year(self, publication_info: Dict) -> Optional[int]:
         """提取发表年份"""
-        summary = publication_info.get("summary", "")
-        import re
-        year_match = re.search(r"\b(19|20)\d{2}\b", summary)
-        if year_match:
-            return int(year_match.group())
-        return None
-
-# 创建全局实例
-serp = SerpService()
\ No newline at end of file
+        return extract_year(publication_info.get("summary", ""))
+
+# 创建全局实例（首次使用时构造）
+serp = registry.register("serp", SerpService)
\ No newline at end of file
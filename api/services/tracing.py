@@ -0,0 +1,303 @@
+"""分析链路追踪模块
+
+不依赖OpenTelemetry：每次分析是一条trace，span保存在进程内（按analysis_id索引，供瀑布图接口读取），
+可选在trace结束时追加写入本地JSONL文件（TRACE_EXPORT_FILE），进程重启后仍可查询。
+当前span通过ContextVar传递；run_upstream复制上下文，线程池中的上游调用也会挂到正确的父span下。
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, List, Callable, Iterator, Tuple
+import fast_json
+
+logger = logging.getLogger(__name__)
+
+# 瀑布图汇总耗时的类别
+BREAKDOWN_CATEGORIES = ("serpapi", "gemini", "supabase", "queue")
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """一段计时区间；start/end为perf_counter读数"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "category", "start", "end", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, category: str, parent_id: Optional[str],
+                 attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.category = category
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def finish(self, error: Optional[BaseException] = None):
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "category": self.category,
+            "offset_ms": round((self.start - self.trace.t0) * 1000, 2),
+            "duration_ms": round((self.end - self.start) * 1000, 2) if self.end is not None else None,
+            # trace级属性（analysis_id、user_id）对其下每个span都成立
+            "attributes": {**self.trace.attributes, **self.attributes},
+            "error": self.error,
+        }
+
+
+class Trace:
+    """一次分析（或一次工作流运行）的全部span"""
+
+    def __init__(self, name: str, attributes: Dict[str, Any], max_spans: int):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.t0 = time.perf_counter()
+        self.max_spans = max_spans
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def new_span(self, name: str, category: str, parent_id: Optional[str],
+                 attributes: Dict[str, Any]) -> Span:
+        span = Span(self, name, category, parent_id, attributes)
+        with self._lock:
+            if len(self.spans) < self.max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+        return span
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        spans.sort(key=lambda s: s["offset_ms"])
+        depths: Dict[Optional[str], int] = {None: -1}
+        for span in spans:
+            # 父span总是先开始，按开始时间排序后父节点的深度已确定
+            span["depth"] = depths.get(span["parent_id"], -1) + 1
+            depths[span["span_id"]] = span["depth"]
+
+        breakdown = {category: 0.0 for category in BREAKDOWN_CATEGORIES}
+        for span in spans:
+            if span["category"] in breakdown and span["duration_ms"] is not None:
+                breakdown[span["category"]] += span["duration_ms"]
+        root = spans[0] if spans else None
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": root["duration_ms"] if root else None,
+            "attributes": dict(self.attributes),
+            # 各类别span耗时之和；并发的span会重叠，合计可能超过总耗时
+            "breakdown_ms": {k: round(v, 2) for k, v in breakdown.items()},
+            "dropped_spans": self.dropped,
+            "spans": spans,
+        }
+
+
+class Tracer:
+    """span追踪器
+
+    start_trace()开启一条trace（分析入口），span()在当前trace下记录子区间，
+    当前没有trace时span()不记录任何内容，因此服务层可以无条件埋点。
+    """
+
+    def __init__(self, enabled: bool = True, max_traces: int = 200, max_spans: int = 2000,
+                 export_file: Optional[str] = None):
+        self.enabled = enabled
+        self.max_traces = max_traces
+        self.max_spans = max_spans
+        self.export_file = export_file
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+        self._by_analysis: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+
+    @contextmanager
+    def start_trace(self, name: str, category: str = "analysis", **attributes) -> Iterator[Optional[Span]]:
+        """开启新trace并以根span为当前span；结束时导出到本地文件"""
+        if not self.enabled:
+            yield None
+            return
+        trace = Trace(name, {k: v for k, v in attributes.items() if v is not None}, self.max_spans)
+        self._register(trace)
+        root = trace.new_span(name, category, None, {})
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.finish(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            root.finish()
+            self._export(trace)
+
+    @contextmanager
+    def span(self, name: str, category: str = "internal", **attributes) -> Iterator[Optional[Span]]:
+        """在当前span下记录一个子区间"""
+        span = self.start_span(name, category, **attributes)
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.finish(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish()
+
+    def start_span(self, name: str, category: str = "internal", **attributes) -> Optional[Span]:
+        """创建子span但不设为当前span，由调用方finish()（如httpx请求/响应钩子）"""
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        return parent.trace.new_span(name, category, parent.span_id, attributes)
+
+    def traced(self, name: str, category: str = "internal"):
+        """异步函数装饰器，每次调用记录为一个span"""
+        def decorator(func: Callable):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.span(name, category):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def set_attribute(key: str, value: Any):
+        """给当前span添加属性"""
+        span = _current_span.get()
+        if span is not None:
+            span.set_attribute(key, value)
+
+    def bind(self, **attributes):
+        """给当前trace添加属性（如创建分析记录后才得到的analysis_id）"""
+        span = _current_span.get()
+        if span is None:
+            return
+        trace = span.trace
+        trace.attributes.update({k: v for k, v in attributes.items() if v is not None})
+        if attributes.get("analysis_id"):
+            self._index(trace)
+
+    def _register(self, trace: Trace):
+        with self._lock:
+            self._traces[trace.trace_id] = trace
+            while len(self._traces) > self.max_traces:
+                _, evicted = self._traces.popitem(last=False)
+                self._unindex(evicted)
+        if trace.attributes.get("analysis_id"):
+            self._index(trace)
+
+    def _index(self, trace: Trace):
+        with self._lock:
+            trace_ids = self._by_analysis.setdefault(str(trace.attributes["analysis_id"]), [])
+            if trace.trace_id not in trace_ids:
+                trace_ids.append(trace.trace_id)
+
+    def _unindex(self, trace: Trace):
+        analysis_id = trace.attributes.get("analysis_id")
+        trace_ids = self._by_analysis.get(str(analysis_id)) if analysis_id else None
+        if trace_ids and trace.trace_id in trace_ids:
+            trace_ids.remove(trace.trace_id)
+            if not trace_ids:
+                del self._by_analysis[str(analysis_id)]
+
+    def _export(self, trace: Trace):
+        if not self.export_file:
+            return
+        try:
+            line = fast_json.dumps(trace.to_dict(), default=str)
+            with self._export_lock:
+                with open(self.export_file, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except Exception as e:
+            logger.error(f"导出trace失败: {e}")
+
+    def _load_exported(self, analysis_id: str) -> List[Dict[str, Any]]:
+        """从本地导出文件读取某次分析的trace（内存中已淘汰或进程重启后）"""
+        if not self.export_file or not os.path.exists(self.export_file):
+            return []
+        traces = []
+        with open(self.export_file, encoding="utf-8") as f:
+            for line in f:
+                if analysis_id not in line:
+                    continue
+                try:
+                    data = fast_json.loads(line)
+                except ValueError:
+                    continue
+                if str(data.get("attributes", {}).get("analysis_id")) == analysis_id:
+                    traces.append(data)
+        return traces
+
+    def waterfall(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        """某次分析的全部trace（按开始时间），每条trace的span按开始时间排序并带层级深度"""
+        with self._lock:
+            traces = [self._traces[trace_id] for trace_id in self._by_analysis.get(analysis_id, [])
+                      if trace_id in self._traces]
+        result = [trace.to_dict() for trace in traces]
+        if not result:
+            result = self._load_exported(analysis_id)
+        if not result:
+            return None
+        result.sort(key=lambda t: t["started_at"])
+        return {"analysis_id": analysis_id, "traces": result}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "traces": len(self._traces), "export_file": self.export_file}
+
+
+def trace_http_hooks(category: str) -> Tuple[Callable, Callable]:
+    """httpx事件钩子（request, response），把同步客户端（如Supabase PostgREST）的每次调用记为span"""
+    def on_request(request):
+        path = request.url.path
+        # /rest/v1/{table} 或 /rest/v1/rpc/{name}
+        target = path.split("/rest/v1/", 1)[-1] if "/rest/v1/" in path else path
+        span = tracer.start_span(f"{request.method} {target}", category, method=request.method, table=target)
+        if span is not None:
+            request.extensions["trace_span"] = span
+
+    def on_response(response):
+        span = response.request.extensions.get("trace_span")
+        if span is not None:
+            span.set_attribute("status", response.status_code)
+            if response.status_code >= 400:
+                span.error = f"HTTP {response.status_code}"
+            span.finish()
+
+    return on_request, on_response
+
+
+# 创建全局实例
+tracer = Tracer(
+    enabled=os.getenv("TRACING_ENABLED", "true").lower() == "true",
+    max_traces=int(os.getenv("TRACE_MAX_TRACES", "200")),
+    max_spans=int(os.getenv("TRACE_MAX_SPANS", "2000")),
+    export_file=os.getenv("TRACE_EXPORT_FILE") or None,
+)
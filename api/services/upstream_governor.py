@@ -0,0 +1,381 @@
+"""上游API调用调度模块（SerpAPI、Gemini）"""
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from typing import Dict, Any, Optional, Callable
+import requests
+from .rate_limiter import TokenBucket
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, LatencyTracker, CLOSED
+from .metrics import UPSTREAM_LATENCY, UPSTREAM_REQUESTS
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# 调用优先级：交互请求（如/api/search）优先于后台批量任务
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+_lane: ContextVar = ContextVar("upstream_lane", default=INTERACTIVE)
+
+# 视为上游限流/过载的状态码
+THROTTLE_STATUS = {429, 503}
+
+# 对冲请求使用的线程池（主请求仍在调用线程之外并行执行）
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv("UPSTREAM_HEDGE_WORKERS", "16")),
+                                 thread_name_prefix="upstream-hedge")
+
+# 批量优先级的上游调用使用独立线程池：批量请求在acquire中最长排队batch_wait秒，
+# 若占用默认线程池，交互请求在登记排队之前就拿不到线程，优先级失效
+_batch_pool = ThreadPoolExecutor(max_workers=int(os.getenv("UPSTREAM_BATCH_WORKERS", "8")),
+                                 thread_name_prefix="upstream-batch")
+
+
+class UpstreamQuotaExceeded(Exception):
+    """上游额度不足或排队超时"""
+
+    def __init__(self, provider: str, reason: str, retry_after: float):
+        super().__init__(f"{provider}: {reason}")
+        self.provider = provider
+        self.reason = reason
+        self.retry_after = max(int(retry_after + 0.999), 1)
+
+
+@contextmanager
+def upstream_lane(lane: str):
+    """在当前上下文中以指定优先级调用上游API"""
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+async def run_upstream(func: Callable, *args) -> Any:
+    """在线程池中执行阻塞的上游调用，不占用事件循环，并沿用当前上下文的优先级
+
+    交互请求使用默认线程池，批量请求使用独立的批量线程池。
+    """
+    context = copy_context()
+    executor = _batch_pool if _lane.get() == BATCH else None
+    return await asyncio.get_running_loop().run_in_executor(executor, context.run, func, *args)
+
+
+async def run_batch(func: Callable, *args) -> Any:
+    """以批量优先级执行阻塞的上游调用"""
+    with upstream_lane(BATCH):
+        return await run_upstream(func, *args)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析Retry-After头（秒数或HTTP日期）"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(retry_at.timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class ProviderGovernor:
+    """单个上游服务的调用调度
+
+    - 令牌桶控制每秒请求数，月度预算控制总调用量
+    - 收到429/503时按AIMD乘性降低速率并遵守Retry-After，成功后加性恢复
+    - 交互请求排队时，批量请求让行
+    - 连接/读取超时与熔断：上游持续失败时快速失败，不再让线程逐个等满超时
+    - 可选对冲请求：超过p95延迟仍未返回时再发一份，先到者生效
+
+    月度预算只在当前进程内计数，重启后从0开始，多个worker各自计数；
+    monthly_budget应按 总额度 / worker数 配置。
+    """
+
+    def __init__(self, name: str, rate_per_sec: float, burst: float, monthly_budget: int = 0,
+                 max_retries: int = 3, interactive_wait: float = 10.0, batch_wait: float = 120.0,
+                 min_factor: float = 0.1, increase_step: float = 0.05,
+                 timeout: tuple = (5.0, 30.0), breaker: Optional[CircuitBreaker] = None,
+                 hedge_ratio: float = 0.1, min_hedge_delay: float = 0.5):
+        self.name = name
+        self.timeout = timeout
+        # 复用keep-alive连接，省去每次调用的TCP/TLS握手；连接池按并发调用数设置
+        self.session = requests.Session()
+        pool_size = int(os.getenv("UPSTREAM_POOL_SIZE", "32"))
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.breaker = breaker or CircuitBreaker(name)
+        self.latency = LatencyTracker()
+        # 对冲请求占全部请求的比例上限，控制额外成本
+        self.hedge_ratio = hedge_ratio
+        self.min_hedge_delay = min_hedge_delay
+        self.rate_per_sec = rate_per_sec
+        self.monthly_budget = monthly_budget
+        self.max_retries = max_retries
+        self.max_wait = {INTERACTIVE: interactive_wait, BATCH: batch_wait}
+        self.min_factor = min_factor
+        self.increase_step = increase_step
+
+        self._bucket = TokenBucket(rate_per_sec * 60, burst)
+        self._factor = 1.0
+        self._blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._waiting = {INTERACTIVE: 0, BATCH: 0}
+        self._month = self._current_month()
+        self._month_used = 0
+        self._stats = {"requests": 0, "throttled": 0, "retries": 0, "rejected": 0,
+                       "hedged": 0, "hedge_wins": 0}
+
+    @property
+    def backoff_factor(self) -> float:
+        """当前速率相对配置速率的比例，小于1说明近期被上游限流"""
+        return self._factor
+
+    def request(self, method: str, url: str, hedge: bool = False, **kwargs) -> requests.Response:
+        """经调度发送请求；被限流时按退避重试，重试用尽仍被限流时抛出UpstreamQuotaExceeded
+
+        熔断时抛出CircuitOpenError；hedge=True仅用于幂等请求。
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        lane = _lane.get()
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            response = self._request(method, url, hedge, lane, kwargs)
+            if response.status_code in THROTTLE_STATUS:
+                outcome = "throttled"
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is None:
+                    retry_after = self._blocked_until - time.monotonic()
+                raise UpstreamQuotaExceeded(self.name, "上游API限流，请稍后重试", max(retry_after, 1.0))
+            if response.status_code < 400:
+                outcome = "ok"
+            return response
+        except (CircuitOpenError, UpstreamQuotaExceeded):
+            if outcome != "throttled":
+                outcome = "rejected"
+            raise
+        finally:
+            UPSTREAM_LATENCY.observe((self.name,), time.perf_counter() - started)
+            UPSTREAM_REQUESTS.inc((self.name, outcome))
+
+    def _request(self, method: str, url: str, hedge: bool, lane: str,
+                 kwargs: Dict[str, Any]) -> requests.Response:
+        self.breaker.before_call()
+        try:
+            for attempt in range(self.max_retries + 1):
+                with tracer.span(f"{self.name}.queue", "queue", lane=lane, attempt=attempt):
+                    self.acquire(lane)
+                response = self._send(method, url, hedge, lane, kwargs)
+                if response.status_code not in THROTTLE_STATUS:
+                    self._on_success()
+                    break
+
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                self._on_throttled(attempt, retry_after)
+                if attempt == self.max_retries:
+                    break
+                self._stats["retries"] += 1
+                logger.warning(f"{self.name} 返回 {response.status_code}，第{attempt + 1}次重试")
+        except requests.exceptions.RequestException as e:
+            self.breaker.record_failure(type(e).__name__)
+            raise
+
+        # 429说明服务在线，只计入限速；5xx计为失败
+        if response.status_code >= 500:
+            self.breaker.record_failure(f"HTTP {response.status_code}")
+        else:
+            self.breaker.record_success()
+        return response
+
+    def _send(self, method: str, url: str, hedge: bool, lane: str,
+              kwargs: Dict[str, Any]) -> requests.Response:
+        """发送单次请求；启用对冲且主请求超过p95仍未返回时，补发一份并取先返回的结果"""
+        started = time.monotonic()
+        delay = self._hedge_delay() if hedge else None
+        if delay is None:
+            response = self.session.request(method, url, **kwargs)
+            self.latency.add(time.monotonic() - started)
+            return response
+
+        primary = _hedge_pool.submit(self.session.request, method, url, **kwargs)
+        done, _ = wait([primary], timeout=delay)
+        futures = [primary]
+        if not done and self._try_acquire(lane):
+            self._stats["hedged"] += 1
+            futures.append(_hedge_pool.submit(self.session.request, method, url, **kwargs))
+
+        error: Optional[Exception] = None
+        for future in as_completed(futures):
+            try:
+                response = future.result()
+            except requests.exceptions.RequestException as e:
+                error = e
+                continue
+            if future is not primary:
+                self._stats["hedge_wins"] += 1
+            self.latency.add(time.monotonic() - started)
+            return response
+        raise error
+
+    def warm_up(self, url: str):
+        """预先解析域名并建立连接（启动预热），不经限速也不计入月度预算"""
+        parsed = urlsplit(url)
+        self.session.head(f"{parsed.scheme}://{parsed.netloc}/", timeout=self.timeout, allow_redirects=False)
+
+    def _hedge_delay(self) -> Optional[float]:
+        """对冲等待时间取近期p95；样本不足或超出对冲比例时不对冲"""
+        p95 = self.latency.quantile(0.95)
+        if p95 is None or self._stats["hedged"] >= self.hedge_ratio * max(self._stats["requests"], 1):
+            return None
+        return max(p95, self.min_hedge_delay)
+
+    def _try_acquire(self, lane: str) -> bool:
+        """不等待地获取额度（对冲请求在没有余量时直接放弃）"""
+        try:
+            self.acquire(lane, max_wait=0.0)
+            return True
+        except UpstreamQuotaExceeded:
+            return False
+
+    def acquire(self, lane: str = INTERACTIVE, max_wait: Optional[float] = None):
+        """等待可用额度，超过该优先级的最长等待时间时抛出UpstreamQuotaExceeded"""
+        lane = lane if lane in self.max_wait else INTERACTIVE
+        deadline = time.monotonic() + (self.max_wait[lane] if max_wait is None else max_wait)
+        with self._cond:
+            self._check_budget()
+            self._waiting[lane] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if lane == BATCH and self._waiting[INTERACTIVE]:
+                        # 让位给交互请求；等到截止时间仍未轮到则拒绝，不能不取令牌就放行
+                        if now >= deadline:
+                            self._stats["rejected"] += 1
+                            raise UpstreamQuotaExceeded(self.name, "上游API繁忙，请稍后重试", 1.0)
+                        self._cond.wait(deadline - now)
+                        continue
+                    if self._blocked_until > now:
+                        wait = self._blocked_until - now
+                    else:
+                        self._bucket.rate = self.rate_per_sec * self._factor
+                        wait = self._bucket.take(now)
+                    if wait <= 0:
+                        break
+                    if now + wait > deadline:
+                        self._stats["rejected"] += 1
+                        raise UpstreamQuotaExceeded(self.name, "上游API繁忙，请稍后重试", wait)
+                    # 交互请求完成时会唤醒等待中的批量请求
+                    self._cond.wait(min(wait, deadline - now))
+            finally:
+                self._waiting[lane] -= 1
+                self._cond.notify_all()
+            self._month_used += 1
+            self._stats["requests"] += 1
+
+    def _check_budget(self):
+        month = self._current_month()
+        if month != self._month:
+            self._month, self._month_used = month, 0
+        if self.monthly_budget and self._month_used >= self.monthly_budget:
+            self._stats["rejected"] += 1
+            raise UpstreamQuotaExceeded(self.name, "本月上游API额度已用完", self._seconds_until_next_month())
+
+    def _on_throttled(self, attempt: int, retry_after: Optional[float]):
+        """乘性减速；无Retry-After时按指数退避（带抖动）暂停发送"""
+        with self._cond:
+            self._stats["throttled"] += 1
+            self._factor = max(self.min_factor, self._factor * 0.5)
+            if retry_after is None:
+                retry_after = min(2 ** attempt, 30) * random.uniform(0.5, 1.0)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+    def _on_success(self):
+        if self._factor < 1.0:
+            with self._cond:
+                self._factor = min(1.0, self._factor + self.increase_step)
+
+    @staticmethod
+    def _current_month() -> str:
+        return datetime.now(timezone.utc).strftime("%Y-%m")
+
+    @staticmethod
+    def _seconds_until_next_month() -> float:
+        now = datetime.now(timezone.utc)
+        if now.month == 12:
+            next_month = now.replace(year=now.year + 1, month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        else:
+            next_month = now.replace(month=now.month + 1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        return (next_month - now).total_seconds()
+
+    def stats(self) -> Dict[str, Any]:
+        """调度指标"""
+        return dict(
+            self._stats,
+            rate_per_sec=round(self.rate_per_sec * self._factor, 3),
+            backoff_factor=round(self._factor, 3),
+            blocked_for=round(max(self._blocked_until - time.monotonic(), 0.0), 1),
+            waiting=dict(self._waiting),
+            month_used=self._month_used,
+            monthly_budget=self.monthly_budget or None,
+            budget_scope="process",
+            latency=self.latency.stats(),
+            circuit=self.breaker.stats(),
+        )
+
+
+class UpstreamGovernor:
+    """按服务商管理调度器
+
+    参数来自环境变量 {PREFIX}_RATE_PER_SEC / _BURST / _MONTHLY_BUDGET（每个进程的月度调用上限）
+    / _TIMEOUT（读取超时秒数）/ _BREAKER_FAILURES / _BREAKER_RECOVERY_SECONDS。
+    """
+
+    def __init__(self, defaults: Dict[str, Dict[str, float]]):
+        self._providers: Dict[str, ProviderGovernor] = {}
+        for name, config in defaults.items():
+            prefix = name.upper()
+            self._providers[name] = ProviderGovernor(
+                name,
+                rate_per_sec=float(os.getenv(f"{prefix}_RATE_PER_SEC", config["rate_per_sec"])),
+                burst=float(os.getenv(f"{prefix}_BURST", config["burst"])),
+                monthly_budget=int(os.getenv(f"{prefix}_MONTHLY_BUDGET", "0")),
+                interactive_wait=float(os.getenv("UPSTREAM_INTERACTIVE_MAX_WAIT", "10")),
+                batch_wait=float(os.getenv("UPSTREAM_BATCH_MAX_WAIT", "120")),
+                timeout=(float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5")),
+                         float(os.getenv(f"{prefix}_TIMEOUT", config["timeout"]))),
+                breaker=CircuitBreaker(
+                    name,
+                    failure_threshold=int(os.getenv(f"{prefix}_BREAKER_FAILURES", "5")),
+                    recovery_timeout=float(os.getenv(f"{prefix}_BREAKER_RECOVERY_SECONDS", "30")),
+                ),
+            )
+
+    def provider(self, name: str) -> ProviderGovernor:
+        return self._providers[name]
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: governor.stats() for name, governor in self._providers.items()}
+
+    def degraded(self) -> bool:
+        """任一服务商熔断未关闭"""
+        return any(governor.breaker.state != CLOSED for governor in self._providers.values())
+
+
+# 创建全局实例
+upstream_governor = UpstreamGovernor({
+    "serpapi": {"rate_per_sec": 5, "burst": 10, "timeout": 30},
+    "gemini": {"rate_per_sec": 5, "burst": 10, "timeout": 60},
+})
@@ -0,0 +1,467 @@
+"""本地专利向量索引模块"""
+import os
+import json
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+import numpy as np
+from db import db
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    """按行L2归一化，余弦相似度即为点积"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def _dequantize(vectors: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    """取出float32向量（int8时乘回每行的缩放系数）"""
+    if scales is None:
+        return np.asarray(vectors, dtype=np.float32)
+    return vectors.astype(np.float32) * scales[:, None]
+
+
+def _parse_embedding(value: Any) -> Optional[List[float]]:
+    """PostgREST返回的vector列是"[0.1,0.2,...]"字符串"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return json.loads(value)
+    return list(value)
+
+
+class PatentVectorIndex:
+    """patent_embeddings的进程内镜像
+
+    向量以连续的float32矩阵（或按行缩放的int8矩阵）存储，批量点积求top-k；
+    可选IVF分桶，只扫描最近的nprobe个桶。快照文件以.npy格式保存，
+    加载时使用内存映射，多个worker共享同一份物理页。
+    int8存储时，检索使用首次检索时反量化并缓存的float32矩阵，不在每次查询时整体转换。
+    与数据库按 (updated_at, patent_id) 键集游标增量同步。
+    """
+
+    def __init__(self, dim: int = 768, quantize: bool = False, nlist: int = 0, nprobe: int = 8):
+        self.dim = dim
+        self.quantize = quantize
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._vectors = np.zeros((0, dim), dtype=np.int8 if quantize else np.float32)
+        self._scales: Optional[np.ndarray] = np.zeros(0, dtype=np.float32) if quantize else None
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._records: List[Dict[str, Any]] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments: Optional[np.ndarray] = None
+        self._lists: List[np.ndarray] = []
+        self._ivf_size = 0
+        self._ivf_pending = False
+        self._float_cache: Optional[np.ndarray] = None
+        # 已同步到的 (updated_at, patent_id)
+        self.sync_cursor: Optional[Tuple[str, str]] = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    # ========== 写入 ==========
+
+    def add(self, rows: Sequence[Dict[str, Any]]) -> int:
+        """增量写入patent_embeddings行，已存在的patent_id原地覆盖，内容未变的行跳过
+
+        返回新增与实际变更的行数。
+        """
+        new_ids, new_records, new_vectors = [], [], []
+        candidates: Dict[int, Tuple[Dict[str, Any], List[float]]] = {}
+        for row in rows:
+            embedding = _parse_embedding(row.get("embedding"))
+            if not embedding or len(embedding) != self.dim:
+                continue
+            record = {
+                "title": row.get("title", ""),
+                "abstract": row.get("abstract") or "",
+                "metadata": row.get("metadata") or {},
+            }
+            patent_id = row["patent_id"]
+            position = self._positions.get(patent_id)
+            if position is not None and position >= len(self._ids):
+                # 同一批次内重复出现，覆盖待追加的那一行
+                new_records[position - len(self._ids)] = record
+                new_vectors[position - len(self._ids)] = embedding
+            elif position is not None:
+                candidates[position] = (record, embedding)
+            else:
+                self._positions[patent_id] = len(self._ids) + len(new_ids)
+                new_ids.append(patent_id)
+                new_records.append(record)
+                new_vectors.append(embedding)
+
+        updated = self._update(candidates)
+
+        if new_vectors:
+            stored, scales = self._encode(np.asarray(new_vectors, dtype=np.float32))
+            self._vectors = np.concatenate([self._vectors, stored])
+            if scales is not None:
+                self._scales = np.concatenate([self._scales, scales])
+            start = len(self._ids)
+            self._ids.extend(new_ids)
+            self._records.extend(new_records)
+            self._assign_new(start)
+        return len(new_ids) + updated
+
+    def _update(self, candidates: Dict[int, Tuple[Dict[str, Any], List[float]]]) -> int:
+        """覆盖已存在的行，返回实际变更的行数
+
+        增量同步会重复拉取边界时间戳上的行，编码结果与现有向量相同的行不写入，
+        只有向量确有变化时才把只读的内存映射快照复制到内存。
+        """
+        if not candidates:
+            return 0
+        positions = np.fromiter(candidates.keys(), dtype=np.int64, count=len(candidates))
+        stored, scales = self._encode(np.asarray([e for _, e in candidates.values()], dtype=np.float32))
+        changed = np.any(stored != self._vectors[positions], axis=1)
+        if scales is not None:
+            changed |= scales != self._scales[positions]
+        dirty = changed.copy()
+        for i, (position, (record, _)) in enumerate(candidates.items()):
+            if record != self._records[position]:
+                self._records[position] = record
+                dirty[i] = True
+
+        if changed.any():
+            positions, stored = positions[changed], stored[changed]
+            self._float_cache = None
+            self._vectors = np.array(self._vectors)
+            self._vectors[positions] = stored
+            if scales is not None:
+                self._scales = np.array(self._scales)
+                self._scales[positions] = scales[changed]
+            if self._centroids is not None:
+                self._reassign(positions)
+        return int(dirty.sum())
+
+    def _encode(self, vectors: np.ndarray):
+        """归一化，按需量化为int8（每行一个缩放系数）"""
+        vectors = _normalize(vectors)
+        if not self.quantize:
+            return vectors, None
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    # ========== IVF分桶 ==========
+
+    def build_ivf(self, nlist: Optional[int] = None, iterations: int = 10, seed: int = 0):
+        """球面k-means构建IVF分桶（在当前线程中执行）"""
+        self._install_ivf(self._train_ivf(self._vectors, self._scales, len(self), nlist, iterations, seed))
+
+    async def rebuild_ivf(self):
+        """有待重建的分桶时在线程池中训练，完成后在事件循环中替换，检索不被阻塞"""
+        if not self._ivf_pending:
+            return
+        self._ivf_pending = False
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, self._train_ivf, self._vectors, self._scales, len(self))
+        self._install_ivf(result)
+
+    def _train_ivf(self, vectors: np.ndarray, scales: Optional[np.ndarray], size: int,
+                   nlist: Optional[int] = None, iterations: int = 10, seed: int = 0):
+        """只读取传入的前size行，训练期间索引可以继续写入"""
+        nlist = nlist or self.nlist or int(np.sqrt(size))
+        if size < max(nlist, 1) * 4:
+            return None
+        rng = np.random.default_rng(seed)
+        sample_positions = rng.choice(size, size=min(size, nlist * 64), replace=False)
+        sample = _dequantize(vectors[sample_positions], None if scales is None else scales[sample_positions])
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+        assignments = np.empty(size, dtype=np.int32)
+        for start in range(0, size, 8192):
+            block = slice(start, min(start + 8192, size))
+            dense = _dequantize(vectors[block], None if scales is None else scales[block])
+            assignments[block] = np.argmax(dense @ centroids.T, axis=1)
+        return centroids, assignments, nlist, size
+
+    def _install_ivf(self, result):
+        if result is None:
+            self._centroids = None
+            self._assignments = None
+            self._lists = []
+            return
+        centroids, assignments, nlist, size = result
+        self._centroids = centroids
+        self.nlist = nlist
+        self._ivf_size = size
+        if len(self) > size:
+            # 训练期间新增的行归入新的桶
+            block = np.arange(size, len(self))
+            labels = np.argmax(self._dense(block) @ centroids.T, axis=1).astype(np.int32)
+            assignments = np.concatenate([assignments, labels])
+        self._assignments = assignments
+        self._rebuild_lists()
+
+    def _rebuild_lists(self):
+        order = np.argsort(self._assignments, kind="stable")
+        bounds = np.searchsorted(self._assignments[order], np.arange(self.nlist + 1))
+        self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(self.nlist)]
+
+    def _assign_new(self, start: int):
+        """新增向量归入最近的桶；尚未分桶或规模翻倍时标记重建，由rebuild_ivf执行"""
+        if self._centroids is None:
+            self._ivf_pending = bool(self.nlist) and len(self) >= self.nlist * 4
+            return
+        if len(self) > self._ivf_size * 2:
+            self._ivf_pending = True
+        block = np.arange(start, len(self))
+        labels = np.argmax(self._dense(block) @ self._centroids.T, axis=1).astype(np.int32)
+        self._assignments = np.concatenate([self._assignments, labels])
+        self._rebuild_lists()
+
+    def _reassign(self, positions: np.ndarray):
+        self._assignments = np.array(self._assignments)
+        self._assignments[positions] = np.argmax(self._dense(positions) @ self._centroids.T, axis=1)
+        self._rebuild_lists()
+
+    # ========== 检索 ==========
+
+    def _dense(self, positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """取出float32向量（int8时反量化）"""
+        if positions is None:
+            return _dequantize(self._vectors, self._scales)
+        return _dequantize(self._vectors[positions], None if self._scales is None else self._scales[positions])
+
+    def _float_matrix(self) -> np.ndarray:
+        """检索用的float32矩阵；int8存储时缓存反量化结果，新增的行只反量化新增部分，更新时重建"""
+        if self._scales is None:
+            return self._vectors
+        cached = 0 if self._float_cache is None else len(self._float_cache)
+        if cached != len(self._vectors):
+            tail = _dequantize(self._vectors[cached:], self._scales[cached:])
+            self._float_cache = tail if self._float_cache is None else np.concatenate([self._float_cache, tail])
+        return self._float_cache
+
+    def _scores(self, queries: np.ndarray, positions: Optional[np.ndarray]) -> np.ndarray:
+        matrix = self._float_matrix()
+        vectors = matrix if positions is None else matrix[positions]
+        return queries @ vectors.T
+
+    def search(self, query: Sequence[float], top_k: int = 10,
+               filters: Optional[Dict[str, Any]] = None,
+               min_similarity: float = 0.0) -> List[Dict[str, Any]]:
+        """单条检索，返回格式与match_patent_embeddings一致"""
+        return self.search_batch([query], top_k, filters, min_similarity)[0]
+
+    def search_batch(self, queries: Sequence[Sequence[float]], top_k: int = 10,
+                     filters: Optional[Dict[str, Any]] = None,
+                     min_similarity: float = 0.0) -> List[List[Dict[str, Any]]]:
+        """批量余弦top-k检索"""
+        if not len(self):
+            return [[] for _ in queries]
+        matrix = _normalize(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+        allowed = self._filter_positions(filters)
+
+        if self._centroids is None:
+            scores = self._scores(matrix, allowed)
+            return [self._top_k(row, allowed, top_k, min_similarity) for row in scores]
+
+        results = []
+        probes = np.argsort(-(matrix @ self._centroids.T), axis=1)[:, :self.nprobe]
+        for query, lists in zip(matrix, probes):
+            candidates = np.concatenate([self._lists[c] for c in lists])
+            if allowed is not None:
+                candidates = np.intersect1d(candidates, allowed, assume_unique=True)
+            scores = self._scores(query[None, :], candidates)[0]
+            results.append(self._top_k(scores, candidates, top_k, min_similarity))
+        return results
+
+    def _filter_positions(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """metadata包含过滤（与SQL的metadata @> filter一致）"""
+        if not filters:
+            return None
+        return np.array([i for i, record in enumerate(self._records)
+                         if all(record["metadata"].get(k) == v for k, v in filters.items())],
+                        dtype=np.int64)
+
+    def _top_k(self, scores: np.ndarray, positions: Optional[np.ndarray],
+               top_k: int, min_similarity: float) -> List[Dict[str, Any]]:
+        if not len(scores):
+            return []
+        k = min(top_k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        results = []
+        for i in best:
+            similarity = float(scores[i])
+            if similarity < min_similarity:
+                break
+            position = int(positions[i]) if positions is not None else int(i)
+            record = self._records[position]
+            results.append({
+                "patent_id": self._ids[position],
+                "title": record["title"],
+                "abstract": record["abstract"],
+                "metadata": record["metadata"],
+                "similarity": similarity,
+            })
+        return results
+
+    # ========== 快照 ==========
+
+    def save(self, path: str):
+        """写入快照：{path}.npy 向量，{path}.json 元数据；先写本进程的临时文件再替换"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        arrays = {"": self._vectors}
+        if self._scales is not None:
+            arrays[".scales"] = self._scales
+        if self._centroids is not None:
+            arrays[".centroids"] = self._centroids
+            arrays[".assignments"] = self._assignments
+        for suffix, array in arrays.items():
+            # 多个worker可能同时写快照，临时文件按进程区分
+            tmp_path = f"{path}{suffix}.{os.getpid()}.tmp.npy"
+            np.save(tmp_path, np.asarray(array))
+            os.replace(tmp_path, f"{path}{suffix}.npy")
+
+        meta = {
+            "dim": self.dim,
+            "quantize": self.quantize,
+            "nlist": self.nlist if self._centroids is not None else 0,
+            "count": len(self),
+            "sync_cursor": self.sync_cursor,
+            "ids": self._ids,
+            "records": self._records,
+        }
+        tmp_path = f"{path}.json.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, f"{path}.json")
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, nprobe: int = 8) -> "PatentVectorIndex":
+        """加载快照，默认以只读内存映射方式打开向量"""
+        with open(f"{path}.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        mode = "r" if mmap else None
+        index = cls(dim=meta["dim"], quantize=meta["quantize"], nlist=meta["nlist"], nprobe=nprobe)
+        vectors = np.load(f"{path}.npy", mmap_mode=mode)
+        if vectors.shape[0] != meta["count"]:
+            raise ValueError("向量快照与元数据不一致")
+        index._vectors = vectors
+        if meta["quantize"]:
+            index._scales = np.load(f"{path}.scales.npy", mmap_mode=mode)
+        if meta["nlist"]:
+            index._centroids = np.load(f"{path}.centroids.npy")
+            index._assignments = np.load(f"{path}.assignments.npy")
+            index._rebuild_lists()
+            index._ivf_size = meta["count"]
+        index._ids = meta["ids"]
+        index._records = meta["records"]
+        index._positions = {patent_id: i for i, patent_id in enumerate(index._ids)}
+        cursor = meta.get("sync_cursor")
+        if cursor:
+            index.sync_cursor = tuple(cursor)
+        elif meta.get("last_created_at"):
+            # 旧快照只记录了创建时间，从该时间（含）开始重新同步
+            index.sync_cursor = (meta["last_created_at"], "")
+        return index
+
+    # ========== 与数据库同步 ==========
+
+    async def refresh_from_db(self, page_size: int = 1000) -> int:
+        """按 (updated_at, patent_id) 键集分页拉取上次同步之后新增或更新的行，返回变更的行数"""
+        changed = 0
+        while True:
+            rows = await db.list_patent_embeddings(after=self.sync_cursor, limit=page_size)
+            changed += self.add(rows)
+            if rows:
+                last = rows[-1]
+                self.sync_cursor = (last.get("updated_at") or last.get("created_at"), last["patent_id"])
+            if len(rows) < page_size:
+                break
+        await self.rebuild_ivf()
+        return changed
+
+    def stats(self) -> Dict[str, Any]:
+        """索引指标"""
+        return {
+            "size": len(self),
+            "dim": self.dim,
+            "quantized": self.quantize,
+            "ivf_lists": self.nlist if self._centroids is not None else 0,
+            "memory_mapped": isinstance(self._vectors, np.memmap),
+            "bytes": int(self._vectors.nbytes),
+            "float_cache_bytes": int(self._float_cache.nbytes) if self._float_cache is not None else 0,
+            "sync_cursor": list(self.sync_cursor) if self.sync_cursor else None,
+        }
+
+
+class VectorIndexManager:
+    """管理全局索引的加载、定期增量刷新与快照写入"""
+
+    def __init__(self, snapshot_path: Optional[str], refresh_interval: float = 300.0,
+                 quantize: bool = False, nlist: int = 0):
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        self.index = PatentVectorIndex(quantize=quantize, nlist=nlist)
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.snapshot_path)
+
+    def load(self):
+        """启动时从快照加载，快照不存在时保持空索引"""
+        if not self.enabled or not os.path.exists(f"{self.snapshot_path}.json"):
+            return
+        try:
+            self.index = PatentVectorIndex.load(self.snapshot_path)
+            logger.info(f"已加载本地向量索引: {len(self.index)} 条")
+        except Exception as e:
+            logger.error(f"加载本地向量索引失败: {e}")
+
+    async def refresh(self):
+        """增量同步数据库，有新增时写回快照"""
+        try:
+            changed = await self.index.refresh_from_db()
+            if changed:
+                logger.info(f"本地向量索引新增或更新 {changed} 条")
+                self.index.save(self.snapshot_path)
+        except Exception as e:
+            logger.error(f"刷新本地向量索引失败: {e}")
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        """加载快照并启动后台刷新任务"""
+        if not self.enabled or self._task is not None:
+            return
+        self.load()
+        if self.refresh_interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+# 创建全局实例（配置VECTOR_INDEX_PATH后启用）
+vector_index = VectorIndexManager(
+    snapshot_path=os.getenv("VECTOR_INDEX_PATH"),
+    refresh_interval=float(os.getenv("VECTOR_INDEX_REFRESH_SECONDS", "300")),
+    quantize=os.getenv("VECTOR_INDEX_QUANTIZE", "false").lower() == "true",
+    nlist=int(os.getenv("VECTOR_INDEX_NLIST", "0")),
+)
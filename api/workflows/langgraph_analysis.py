@@ -10,10 +10,19 @@ from langchain.prompts import ChatPromptTemplate
 from langchain.schema import HumanMessage, SystemMessage
 import asyncio
 import json
+import time
 from datetime import datetime
 from services.serp import SERPService
 from services.gemini import GeminiService
 from db.db import DB
+from services.prior_art_service import prior_art_search
+from services.novelty_prescreen import novelty_prescreen
+from services.dedup_service import deduplicator
+from services.model_router import model_router, NOVELTY, INVENTIVENESS, UTILITY, MARKET, RISK
+from services.analysis_checkpoints import analysis_checkpoints, fingerprint, field_fingerprints, RecomputeDiff
+from services.metrics import NODE_DURATION
+from services.tracing import tracer
+import fast_json
 
 # 定义工作流状态
 class PatentAnalysisState(TypedDict):
@@ -42,14 +51,43 @@ class PatentAnalysisState(TypedDict):
     overall_score: float
     recommendations: List[str]
     
+    # 跨来源去重移除的结果数
+    duplicates_removed: int
+    
+    # 检查点：复用与重新计算的节点
+    recompute: RecomputeDiff
+    
     # 工作流控制
     current_step: str
     error: str
     progress: int
 
+# 由状态派生的节点输入（只取节点实际用到的部分，避免无关修改触发重算）
+DERIVED_INPUTS = {
+    # 专利搜索查询只使用描述的前100字符
+    "description_prefix": lambda state: (state.get("description") or "")[:100],
+}
+
+# 需要检查点的节点：节点 -> (读取的状态字段, 写入的状态字段)
+# 报告生成与保存不调用外部服务，每次都重新执行
+NODE_IO = {
+    "patent_search": (["title", "technical_field", "technical_content", "description_prefix"],
+                      ["patent_searches", "duplicates_removed"]),
+    "academic_search": (["title", "technical_field"], ["academic_searches"]),
+    "market_search": (["title", "technical_field", "patent_searches", "academic_searches", "duplicates_removed"],
+                      ["market_searches", "patent_searches", "academic_searches", "duplicates_removed"]),
+    "novelty_analysis": (["title", "technical_field", "technical_content", "patent_searches"],
+                         ["novelty_analysis"]),
+    "inventiveness_analysis": (["title", "novelty_analysis"], ["inventiveness_analysis"]),
+    "utility_analysis": (["title", "technical_field", "technical_content"], ["utility_analysis"]),
+    "market_analysis": (["title", "technical_field", "market_searches", "utility_analysis"], ["market_analysis"]),
+    "risk_analysis": (["title", "technical_field", "novelty_analysis"], ["risk_analysis"]),
+}
+
 class PatentAnalysisWorkflow:
     def __init__(self):
-        self.llm = ChatGoogleGenerativeAI(model="gemini-pro", temperature=0.7)
+        # 每个模型一个客户端，按阶段由model_router选择
+        self._llms: Dict[str, ChatGoogleGenerativeAI] = {}
         self.serp_service = SERPService()
         self.gemini_service = GeminiService()
         self.db = DB()
@@ -57,21 +95,82 @@ class PatentAnalysisWorkflow:
         # 构建工作流图
         self.workflow = self._build_workflow()
     
+    async def _invoke_llm(self, stage: str, prompt: str):
+        """按分析阶段路由模型并调用"""
+        model = model_router.select(stage)
+        llm = self._llms.get(model)
+        if llm is None:
+            llm = self._llms[model] = ChatGoogleGenerativeAI(model=model, temperature=0.7)
+        with model_router.track(stage, model):
+            return await llm.ainvoke([HumanMessage(content=prompt)])
+    
+    def _checkpointed(self, name: str, node):
+        """节点包装：输入指纹命中检查点时直接复用输出，否则执行并在成功后写入检查点"""
+        inputs, outputs = NODE_IO[name]
+        
+        async def run_node(state: PatentAnalysisState) -> PatentAnalysisState:
+            started = time.perf_counter()
+            node_inputs = {
+                key: DERIVED_INPUTS[key](state) if key in DERIVED_INPUTS else state.get(key)
+                for key in inputs
+            }
+            input_fingerprint = fingerprint(node_inputs)
+            saved = await analysis_checkpoints.lookup(state["user_id"], name, input_fingerprint)
+            if saved is not None:
+                state.update(saved)
+                state["current_step"] = name
+                state["recompute"].mark_reused(name)
+                print(f"节点 {name} 输入未变化，复用检查点")
+                tracer.set_attribute("reused", True)
+                NODE_DURATION.observe((name, "reused"), time.perf_counter() - started)
+                return state
+            
+            input_fields = field_fingerprints(node_inputs)
+            state["recompute"].mark_recomputed(
+                name, await analysis_checkpoints.changed_inputs(state["user_id"], name, input_fields)
+            )
+            error_before = state.get("error")
+            state = await node(state)
+            # 节点内部出错时只记录到state["error"]，此时不写检查点
+            if state.get("error") == error_before:
+                await analysis_checkpoints.save(
+                    state["user_id"], name, input_fingerprint,
+                    {key: state.get(key) for key in outputs},
+                    analysis_id=state.get("analysis_id"),
+                    input_fields=input_fields
+                )
+            tracer.set_attribute("reused", False)
+            NODE_DURATION.observe((name, "computed"), time.perf_counter() - started)
+            return state
+        
+        return tracer.traced(name, "node")(run_node)
+    
+    def _timed(self, name: str, node):
+        """节点包装：只记录耗时（不做检查点的节点）"""
+        async def run_node(state: PatentAnalysisState) -> PatentAnalysisState:
+            started = time.perf_counter()
+            try:
+                return await node(state)
+            finally:
+                NODE_DURATION.observe((name, "computed"), time.perf_counter() - started)
+        
+        return tracer.traced(name, "node")(run_node)
+    
     def _build_workflow(self) -> StateGraph:
         # 创建工作流图
         workflow = StateGraph(PatentAnalysisState)
         
         # 添加节点
-        workflow.add_node("patent_search", self.patent_search_node)
-        workflow.add_node("academic_search", self.academic_search_node)
-        workflow.add_node("market_search", self.market_search_node)
-        workflow.add_node("novelty_analysis", self.novelty_analysis_node)
-        workflow.add_node("inventiveness_analysis", self.inventiveness_analysis_node)
-        workflow.add_node("utility_analysis", self.utility_analysis_node)
-        workflow.add_node("market_analysis", self.market_analysis_node)
-        workflow.add_node("risk_analysis", self.risk_analysis_node)
-        workflow.add_node("generate_report", self.generate_report_node)
-        workflow.add_node("save_results", self.save_results_node)
+        workflow.add_node("patent_search", self._checkpointed("patent_search", self.patent_search_node))
+        workflow.add_node("academic_search", self._checkpointed("academic_search", self.academic_search_node))
+        workflow.add_node("market_search", self._checkpointed("market_search", self.market_search_node))
+        workflow.add_node("novelty_analysis", self._checkpointed("novelty_analysis", self.novelty_analysis_node))
+        workflow.add_node("inventiveness_analysis", self._checkpointed("inventiveness_analysis", self.inventiveness_analysis_node))
+        workflow.add_node("utility_analysis", self._checkpointed("utility_analysis", self.utility_analysis_node))
+        workflow.add_node("market_analysis", self._checkpointed("market_analysis", self.market_analysis_node))
+        workflow.add_node("risk_analysis", self._checkpointed("risk_analysis", self.risk_analysis_node))
+        workflow.add_node("generate_report", self._timed("generate_report", self.generate_report_node))
+        workflow.add_node("save_results", self._timed("save_results", self.save_results_node))
         
         # 设置入口点
         workflow.set_entry_point("patent_search")
@@ -101,25 +200,36 @@ class PatentAnalysisWorkflow:
             state["current_step"] = "patent_search"
             state["progress"] = 10
             
+            # 优先使用本地向量近邻，召回充足时不再调用SERP
+            local_results = []
+            try:
+                local_results = await prior_art_search.search_local(
+                    prior_art_search.invention_text(state), top_k=10
+                )
+            except Exception as e:
+                print(f"本地向量检索失败，回退SERP: {e}")
+            
+            strong_hits = [r for r in local_results if r["similarity"] >= prior_art_search.min_similarity]
+            if len(strong_hits) >= prior_art_search.min_hits:
+                state["patent_searches"] = local_results[:10]
+                print(f"本地向量检索找到 {len(strong_hits)} 个相关专利")
+                return state
+            
             # 使用多个关键词组合搜索
             search_queries = [
                 state["title"],
-                f"{state["technical_field"]} {state["title"]}",
+                f"{state['technical_field']} {state['title']}",
                 state["description"][:100]  # 使用描述的前100字符
             ]
             
-            all_results = []
+            all_results = list(local_results)
             for query in search_queries:
                 results = await self.serp_service.search_patents(query)
                 all_results.extend(results.get("organic_results", [])[:5])
             
-            # 去重和排序
-            seen = set()
-            unique_results = []
-            for result in all_results:
-                if result.get("title") not in seen:
-                    seen.add(result.get("title"))
-                    unique_results.append(result)
+            # 近重复去重（专利号、规范化URL、标题摘要MinHash）
+            unique_results, removed = deduplicator.deduplicate(all_results)
+            state["duplicates_removed"] = removed
             
             state["patent_searches"] = unique_results[:10]
             print(f"找到 {len(state['patent_searches'])} 个相关专利")
@@ -162,6 +272,16 @@ class PatentAnalysisWorkflow:
             state["market_searches"] = results.get("organic_results", [])[:5]
             print(f"找到 {len(state['market_searches'])} 条市场信息")
             
+            # 三类搜索结果跨来源去重，专利结果优先保留
+            groups, removed = deduplicator.deduplicate_groups({
+                "patent_searches": state["patent_searches"],
+                "academic_searches": state["academic_searches"],
+                "market_searches": state["market_searches"]
+            })
+            state.update(groups)
+            state["duplicates_removed"] = state.get("duplicates_removed", 0) + removed
+            print(f"跨来源去重移除 {state['duplicates_removed']} 条重复结果")
+            
         except Exception as e:
             state["error"] = f"市场搜索失败: {str(e)}"
             print(f"Error in market_search_node: {e}")
@@ -174,10 +294,26 @@ class PatentAnalysisWorkflow:
             state["current_step"] = "novelty_analysis"
             state["progress"] = 40
             
+            # 向量预筛：存在近乎相同的现有技术时直接给出结论，跳过LLM调用
+            prescreen = await novelty_prescreen.screen(state, state["patent_searches"])
+            if prescreen and prescreen["decision"] == "anticipated":
+                shortcut = novelty_prescreen.shortcut_result(prescreen)
+                state["novelty_analysis"] = {
+                    "analysis": shortcut["analysis"]["新颖性破坏风险"],
+                    "comparisons": [],
+                    "score": round(prescreen["score"] * 100),
+                    "innovations": [],
+                    "risks": [shortcut["analysis"]["新颖性破坏风险"]],
+                    "prescreen": prescreen
+                }
+                print(f"新颖性预筛跳过LLM，评分: {state['novelty_analysis']['score']}")
+                return state
+            
             # 构建详细的分析提示
+            selected = novelty_prescreen.select_prior_art(state["patent_searches"], prescreen)
             prior_art = "\n".join([
                 f"- {p.get('title', 'N/A')}: {p.get('snippet', 'N/A')}"
-                for p in state["patent_searches"][:5]
+                for p in selected[:5]
             ])
             
             prompt = f"""作为专利审查专家，请对以下发明进行深入的新颖性分析：
@@ -208,8 +344,9 @@ class PatentAnalysisWorkflow:
     "risks": ["风险1", "风险2", ...]
 }}"""
             
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+            response = await self._invoke_llm(NOVELTY, prompt)
             novelty_result = json.loads(response.content)
+            novelty_result["prescreen"] = prescreen
             
             state["novelty_analysis"] = novelty_result
             print(f"新颖性评分: {novelty_result['score']}")
@@ -230,7 +367,7 @@ class PatentAnalysisWorkflow:
 
 发明：{state["title"]}
 新颖性得分：{state.get('novelty_analysis', {}).get('score', 0)}
-主要创新点：{json.dumps(state.get('novelty_analysis', {}).get('innovations', []), ensure_ascii=False)}
+主要创新点：{fast_json.dumps(state.get('novelty_analysis', {}).get('innovations', []))}
 
 请评估：
 1. 技术方案的非显而易见性（300字）
@@ -249,7 +386,7 @@ class PatentAnalysisWorkflow:
     "creativity_level": "突破性/显著/一般/较低"
 }}"""
             
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+            response = await self._invoke_llm(INVENTIVENESS, prompt)
             inventiveness_result = json.loads(response.content)
             
             state["inventiveness_analysis"] = inventiveness_result
@@ -290,7 +427,7 @@ class PatentAnalysisWorkflow:
     "score": 90
 }}"""
             
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+            response = await self._invoke_llm(UTILITY, prompt)
             utility_result = json.loads(response.content)
             
             state["utility_analysis"] = utility_result
@@ -317,7 +454,7 @@ class PatentAnalysisWorkflow:
 
 发明：{state["title"]}
 技术领域：{state["technical_field"]}
-应用场景：{json.dumps(state.get('utility_analysis', {}).get('application_scenarios', []), ensure_ascii=False)}
+应用场景：{fast_json.dumps(state.get('utility_analysis', {}).get('application_scenarios', []))}
 
 市场信息：
 {market_info}
@@ -339,7 +476,7 @@ class PatentAnalysisWorkflow:
     "score": 75
 }}"""
             
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+            response = await self._invoke_llm(MARKET, prompt)
             market_result = json.loads(response.content)
             
             state["market_analysis"] = market_result
@@ -360,7 +497,7 @@ class PatentAnalysisWorkflow:
             prompt = f"""进行专利申请的风险评估：
 
 发明：{state["title"]}
-新颖性风险：{json.dumps(state.get('novelty_analysis', {}).get('risks', []), ensure_ascii=False)}
+新颖性风险：{fast_json.dumps(state.get('novelty_analysis', {}).get('risks', []))}
 技术领域：{state["technical_field"]}
 
 请评估：
@@ -380,7 +517,7 @@ class PatentAnalysisWorkflow:
     "risk_score": 30
 }}"""
             
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+            response = await self._invoke_llm(RISK, prompt)
             risk_result = json.loads(response.content)
             
             state["risk_analysis"] = risk_result
@@ -522,7 +659,7 @@ class PatentAnalysisWorkflow:
             await self.db.save_analysis_report(
                 analysis_id=analysis_id,
                 report_type="market",
-                content=json.dumps(state.get("market_analysis", {}), ensure_ascii=False),
+                content=fast_json.dumps(state.get("market_analysis", {})),
                 score=state.get("market_analysis", {}).get("score", 0),
                 metadata=state.get("market_analysis", {})
             )
@@ -531,7 +668,7 @@ class PatentAnalysisWorkflow:
             await self.db.save_analysis_report(
                 analysis_id=analysis_id,
                 report_type="risk",
-                content=json.dumps(state.get("risk_analysis", {}), ensure_ascii=False),
+                content=fast_json.dumps(state.get("risk_analysis", {})),
                 score=state.get("risk_analysis", {}).get("risk_score", 0),
                 metadata=state.get("risk_analysis", {})
             )
@@ -580,6 +717,8 @@ class PatentAnalysisWorkflow:
                 patent_searches=[],
                 academic_searches=[],
                 market_searches=[],
+                duplicates_removed=0,
+                recompute=RecomputeDiff(),
                 novelty_analysis={},
                 inventiveness_analysis={},
                 utility_analysis={},
@@ -593,14 +732,18 @@ class PatentAnalysisWorkflow:
                 progress=0
             )
             
-            # 运行工作流
-            final_state = await self.workflow.ainvoke(initial_state)
+            # 运行工作流，每次运行（含恢复）记为该分析的一条trace
+            with tracer.start_trace("patent_workflow", analysis_id=input_data["analysis_id"],
+                                    user_id=input_data["user_id"]):
+                final_state = await self.workflow.ainvoke(initial_state)
             
             return {
                 "success": not bool(final_state.get("error")),
                 "analysis_id": final_state["analysis_id"],
                 "overall_score": final_state["overall_score"],
                 "recommendations": final_state["recommendations"],
+                "duplicates_removed": final_state.get("duplicates_removed", 0),
+                "recompute": final_state["recompute"].to_dict(),
                 "error": final_state.get("error", ""),
                 "progress": final_state["progress"]
             }
@@ -614,5 +757,23 @@ class PatentAnalysisWorkflow:
                 "progress": 0
             }
 
+    async def resume(self, analysis_id: str) -> Dict[str, Any]:
+        """按分析记录重新运行：已完成且输入未变的节点复用检查点，从第一个未完成的节点继续"""
+        analysis = await self.db.get_analysis(analysis_id)
+        if not analysis:
+            return {"success": False, "error": "分析不存在", "analysis_id": analysis_id, "progress": 0}
+        
+        completed = await analysis_checkpoints.completed_nodes(analysis_id)
+        print(f"恢复分析 {analysis_id}，已完成节点: {completed}")
+        metadata = analysis.get("metadata") or {}
+        return await self.run({
+            "title": analysis["title"],
+            "description": analysis.get("description") or "",
+            "technical_field": metadata.get("technical_field", ""),
+            "technical_content": metadata.get("technical_content", ""),
+            "user_id": analysis["user_id"],
+            "analysis_id": analysis_id
+        })
+
 # 创建工作流实例
 patent_workflow = PatentAnalysisWorkflow()
\ No newline at end of file
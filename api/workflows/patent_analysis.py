@@ -1,7 +1,7 @@
 from langgraph.graph import Graph, StateGraph
 from typing import TypedDict, List, Dict, Any
-import google.generativeai as genai
 from serpapi import GoogleSearch
+from functools import lru_cache
 import os
 
 # Define the state structure
@@ -23,8 +23,11 @@ class PatentAnalysisState(TypedDict):
     final_report: Dict[str, Any]
     error: str
 
-# Initialize Gemini model
-model = genai.GenerativeModel('gemini-pro')
+# Gemini model, created on first use (google.generativeai is slow to import)
+@lru_cache(maxsize=1)
+def get_model():
+    import google.generativeai as genai
+    return genai.GenerativeModel('gemini-pro')
 
 def search_prior_art(state: PatentAnalysisState) -> PatentAnalysisState:
     """Search for prior art using SERP API"""
@@ -90,7 +93,7 @@ def analyze_novelty(state: PatentAnalysisState) -> PatentAnalysisState:
         请用JSON格式返回分析结果。
         """
         
-        response = model.generate_content(prompt)
+        response = get_model().generate_content(prompt)
         # Parse response and store analysis
         state['novelty_analysis'] = {
             "analysis": response.text,
@@ -119,7 +122,7 @@ def analyze_inventiveness(state: PatentAnalysisState) -> PatentAnalysisState:
         请用JSON格式返回分析结果。
         """
         
-        response = model.generate_content(prompt)
+        response = get_model().generate_content(prompt)
         state['inventiveness_analysis'] = {
             "analysis": response.text,
             "score": 0.75
@@ -146,7 +149,7 @@ def analyze_utility(state: PatentAnalysisState) -> PatentAnalysisState:
         请用JSON格式返回分析结果。
         """
         
-        response = model.generate_content(prompt)
+        response = get_model().generate_content(prompt)
         state['utility_analysis'] = {
             "analysis": response.text,
             "score": 0.85
@@ -174,7 +177,7 @@ def generate_report(state: PatentAnalysisState) -> PatentAnalysisState:
         请生成包含执行摘要、详细分析、风险评估和建议的完整报告。
         """
         
-        response = model.generate_content(prompt)
+        response = get_model().generate_content(prompt)
         state['final_report'] = {
             "summary": response.text,
             "overall_score": 0.8,
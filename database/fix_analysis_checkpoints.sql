@@ -0,0 +1,25 @@
+-- 已有数据库的analysis_checkpoints建表：分析阶段检查点
+-- schema.sql只对新建的数据库生效；已部署的数据库执行本脚本后再部署检查点与恢复功能，
+-- 否则检查点读写失败，每次分析都会重新计算全部阶段。脚本可重复执行
+
+CREATE TABLE IF NOT EXISTS analysis_checkpoints (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    scope TEXT NOT NULL,
+    node TEXT NOT NULL,
+    input_fingerprint TEXT NOT NULL,
+    input_fields JSONB DEFAULT '{}',
+    output JSONB NOT NULL,
+    analysis_id UUID REFERENCES patent_analyses(id) ON DELETE SET NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE(scope, node, input_fingerprint)
+);
+
+CREATE INDEX IF NOT EXISTS idx_analysis_checkpoints_analysis_id ON analysis_checkpoints(analysis_id);
+CREATE INDEX IF NOT EXISTS idx_analysis_checkpoints_latest ON analysis_checkpoints(scope, node, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_analysis_checkpoints_created_at ON analysis_checkpoints(created_at);
+
+-- 只允许服务端（service role）访问，不创建面向用户的策略
+ALTER TABLE analysis_checkpoints ENABLE ROW LEVEL SECURITY;
+
+-- 让PostgREST重新加载表结构
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,41 @@
+-- 已有数据库的patent_embeddings升级：updated_at列与本地向量索引的键集分页同步
+-- upsert(on_conflict="patent_id")更新已有行时不改变created_at，按created_at同步会漏掉更新；
+-- 同一事务批量写入的行created_at相同，按created_at分页会在超过一页时停止
+
+ALTER TABLE patent_embeddings ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW();
+
+-- 已有行按创建时间回填（先删除触发器，回填不会被改写为当前时间）
+DROP TRIGGER IF EXISTS update_patent_embeddings_updated_at ON patent_embeddings;
+UPDATE patent_embeddings SET updated_at = created_at WHERE updated_at IS DISTINCT FROM created_at;
+
+CREATE TRIGGER update_patent_embeddings_updated_at BEFORE UPDATE ON patent_embeddings
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+CREATE INDEX IF NOT EXISTS idx_patent_embeddings_sync ON patent_embeddings(updated_at, patent_id);
+
+-- 按 (updated_at, patent_id) 键集分页拉取新增或更新的专利向量（本地索引增量同步）
+CREATE OR REPLACE FUNCTION list_patent_embeddings_after(
+    after_updated_at TIMESTAMPTZ DEFAULT NULL,
+    after_patent_id TEXT DEFAULT '',
+    page_size INTEGER DEFAULT 1000
+)
+RETURNS TABLE (
+    patent_id TEXT,
+    title TEXT,
+    abstract TEXT,
+    embedding vector(768),
+    metadata JSONB,
+    created_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT pe.patent_id, pe.title, pe.abstract, pe.embedding, pe.metadata, pe.created_at, pe.updated_at
+    FROM patent_embeddings pe
+    WHERE after_updated_at IS NULL
+       OR (pe.updated_at, pe.patent_id) > (after_updated_at, after_patent_id)
+    ORDER BY pe.updated_at, pe.patent_id
+    LIMIT page_size;
+$$;
+
+NOTIFY pgrst, 'reload schema';
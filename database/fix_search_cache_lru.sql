@@ -0,0 +1,51 @@
+-- 已有数据库的search_cache升级：命中统计列与清理用的函数
+-- schema.sql只对新建的数据库生效；已部署的数据库执行本脚本后再部署search_cache清理功能，
+-- 否则写入last_hit_at的缓存upsert会被PostgREST拒绝
+
+ALTER TABLE search_cache ADD COLUMN IF NOT EXISTS hit_count INTEGER DEFAULT 0;
+ALTER TABLE search_cache ADD COLUMN IF NOT EXISTS last_hit_at TIMESTAMPTZ DEFAULT NOW();
+
+CREATE INDEX IF NOT EXISTS idx_search_cache_last_hit ON search_cache(last_hit_at);
+
+-- 批量记录search_cache命中（累加命中次数，最近命中时间用于LRU淘汰）
+CREATE OR REPLACE FUNCTION record_search_cache_hits(
+    hashes TEXT[],
+    counts INTEGER[],
+    hit_at TIMESTAMPTZ DEFAULT NOW()
+)
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    WITH hits AS (
+        SELECT * FROM unnest(hashes, counts) AS h(query_hash, hits)
+    ), updated AS (
+        UPDATE search_cache sc
+        SET hit_count = COALESCE(sc.hit_count, 0) + hits.hits,
+            last_hit_at = GREATEST(sc.last_hit_at, hit_at)
+        FROM hits
+        WHERE sc.query_hash = hits.query_hash
+        RETURNING 1
+    )
+    SELECT count(*)::INTEGER FROM updated;
+$$;
+
+-- search_cache行数与占用空间（表含TOAST，索引单独统计）
+CREATE OR REPLACE FUNCTION search_cache_stats()
+RETURNS TABLE (
+    row_count BIGINT,
+    expired_count BIGINT,
+    table_bytes BIGINT,
+    index_bytes BIGINT
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT
+        count(*),
+        count(*) FILTER (WHERE expires_at <= NOW()),
+        pg_table_size('search_cache'),
+        pg_indexes_size('search_cache')
+    FROM search_cache;
+$$;
+
+-- 让PostgREST重新加载表结构缓存，新列与函数立即可用
+NOTIFY pgrst, 'reload schema';
@@ -28,7 +28,9 @@ CREATE TABLE search_cache (
     results JSONB NOT NULL,
     source TEXT CHECK (source IN ('google_patent', 'serp', 'scholar')),
     created_at TIMESTAMPTZ DEFAULT NOW(),
-    expires_at TIMESTAMPTZ NOT NULL
+    expires_at TIMESTAMPTZ NOT NULL,
+    hit_count INTEGER DEFAULT 0,
+    last_hit_at TIMESTAMPTZ DEFAULT NOW()
 );
 
 -- 使用量记录表
@@ -53,6 +55,7 @@ CREATE TABLE patent_embeddings (
     embedding vector(768),
     metadata JSONB DEFAULT '{}',
     created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
     UNIQUE(patent_id)
 );
 
@@ -82,13 +85,140 @@ CREATE TABLE user_subscriptions (
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- 分析阶段检查点表（按阶段输入指纹保存输出，用于断点续跑与增量重算）
+CREATE TABLE analysis_checkpoints (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    scope TEXT NOT NULL,
+    node TEXT NOT NULL,
+    input_fingerprint TEXT NOT NULL,
+    input_fields JSONB DEFAULT '{}',
+    output JSONB NOT NULL,
+    analysis_id UUID REFERENCES patent_analyses(id) ON DELETE SET NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE(scope, node, input_fingerprint)
+);
+
 -- 创建索引
 CREATE INDEX idx_patent_analyses_user_id ON patent_analyses(user_id);
 CREATE INDEX idx_patent_analyses_status ON patent_analyses(status);
 CREATE INDEX idx_search_cache_expires ON search_cache(expires_at);
+CREATE INDEX idx_search_cache_last_hit ON search_cache(last_hit_at);
+CREATE INDEX idx_analysis_checkpoints_analysis_id ON analysis_checkpoints(analysis_id);
+CREATE INDEX idx_analysis_checkpoints_latest ON analysis_checkpoints(scope, node, created_at DESC);
+CREATE INDEX idx_analysis_checkpoints_created_at ON analysis_checkpoints(created_at);
 CREATE INDEX idx_usage_logs_user_id ON usage_logs(user_id);
 CREATE INDEX idx_usage_logs_created_at ON usage_logs(created_at);
 CREATE INDEX idx_patent_embeddings_embedding ON patent_embeddings USING ivfflat (embedding vector_cosine_ops);
+CREATE INDEX idx_patent_embeddings_sync ON patent_embeddings(updated_at, patent_id);
+
+-- 专利向量相似度检索（余弦相似度，按metadata过滤）
+CREATE OR REPLACE FUNCTION match_patent_embeddings(
+    query_embedding vector(768),
+    match_count INTEGER DEFAULT 10,
+    min_similarity FLOAT DEFAULT 0,
+    filter JSONB DEFAULT '{}'
+)
+RETURNS TABLE (
+    patent_id TEXT,
+    title TEXT,
+    abstract TEXT,
+    metadata JSONB,
+    similarity FLOAT
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT
+        pe.patent_id,
+        pe.title,
+        pe.abstract,
+        pe.metadata,
+        1 - (pe.embedding <=> query_embedding) AS similarity
+    FROM patent_embeddings pe
+    WHERE pe.embedding IS NOT NULL
+      AND pe.metadata @> filter
+      AND 1 - (pe.embedding <=> query_embedding) >= min_similarity
+    ORDER BY pe.embedding <=> query_embedding
+    LIMIT match_count;
+$$;
+
+-- 按 (updated_at, patent_id) 键集分页拉取新增或更新的专利向量（本地索引增量同步）
+CREATE OR REPLACE FUNCTION list_patent_embeddings_after(
+    after_updated_at TIMESTAMPTZ DEFAULT NULL,
+    after_patent_id TEXT DEFAULT '',
+    page_size INTEGER DEFAULT 1000
+)
+RETURNS TABLE (
+    patent_id TEXT,
+    title TEXT,
+    abstract TEXT,
+    embedding vector(768),
+    metadata JSONB,
+    created_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT pe.patent_id, pe.title, pe.abstract, pe.embedding, pe.metadata, pe.created_at, pe.updated_at
+    FROM patent_embeddings pe
+    WHERE after_updated_at IS NULL
+       OR (pe.updated_at, pe.patent_id) > (after_updated_at, after_patent_id)
+    ORDER BY pe.updated_at, pe.patent_id
+    LIMIT page_size;
+$$;
+
+-- 批量记录search_cache命中（累加命中次数，最近命中时间用于LRU淘汰）
+CREATE OR REPLACE FUNCTION record_search_cache_hits(
+    hashes TEXT[],
+    counts INTEGER[],
+    hit_at TIMESTAMPTZ DEFAULT NOW()
+)
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    WITH hits AS (
+        SELECT * FROM unnest(hashes, counts) AS h(query_hash, hits)
+    ), updated AS (
+        UPDATE search_cache sc
+        SET hit_count = COALESCE(sc.hit_count, 0) + hits.hits,
+            last_hit_at = GREATEST(sc.last_hit_at, hit_at)
+        FROM hits
+        WHERE sc.query_hash = hits.query_hash
+        RETURNING 1
+    )
+    SELECT count(*)::INTEGER FROM updated;
+$$;
+
+-- 原子累加本月已用分析次数（多个worker并发写回配额增量时不丢失）
+CREATE OR REPLACE FUNCTION increment_subscription_usage(
+    p_user_id UUID,
+    delta INTEGER
+)
+RETURNS SETOF user_subscriptions
+LANGUAGE sql
+AS $$
+    UPDATE user_subscriptions
+    SET monthly_analyses_used = GREATEST(COALESCE(monthly_analyses_used, 0) + delta, 0)
+    WHERE user_id = p_user_id
+    RETURNING *;
+$$;
+
+-- search_cache行数与占用空间（表含TOAST，索引单独统计）
+CREATE OR REPLACE FUNCTION search_cache_stats()
+RETURNS TABLE (
+    row_count BIGINT,
+    expired_count BIGINT,
+    table_bytes BIGINT,
+    index_bytes BIGINT
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT
+        count(*),
+        count(*) FILTER (WHERE expires_at <= NOW()),
+        pg_table_size('search_cache'),
+        pg_indexes_size('search_cache')
+    FROM search_cache;
+$$;
 
 -- 创建更新时间触发器
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -105,11 +235,17 @@ CREATE TRIGGER update_patent_analyses_updated_at BEFORE UPDATE ON patent_analyse
 CREATE TRIGGER update_user_subscriptions_updated_at BEFORE UPDATE ON user_subscriptions
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- upsert更新已有专利向量时刷新updated_at，本地索引据此同步变更
+CREATE TRIGGER update_patent_embeddings_updated_at BEFORE UPDATE ON patent_embeddings
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
 -- RLS (Row Level Security) 策略
 ALTER TABLE patent_analyses ENABLE ROW LEVEL SECURITY;
 ALTER TABLE usage_logs ENABLE ROW LEVEL SECURITY;
 ALTER TABLE analysis_reports ENABLE ROW LEVEL SECURITY;
 ALTER TABLE user_subscriptions ENABLE ROW LEVEL SECURITY;
+-- 检查点仅由后端（service role）读写
+ALTER TABLE analysis_checkpoints ENABLE ROW LEVEL SECURITY;
 
 -- 用户只能查看自己的数据
 CREATE POLICY "Users can view own analyses" ON patent_analyses